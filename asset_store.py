@@ -0,0 +1,158 @@
+import csv
+import hashlib
+import logging
+import os
+import pickle
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, TypeVar
+
+log = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# Containers, ships and corporation offices hold other items, which ESI lists
+# with the container's item id as their location. Following them up more
+# levels than this means a loop in the data.
+MAX_NESTING = 10
+
+class AssetIndex():
+    """Quantities of our (unassembled) items per type and location, where the
+    location is the station or structure that holds them, whether directly or
+    inside containers, ships or offices."""
+
+    __slots__ = ('_quantities',)
+
+    def __init__(self, quantities: Optional[Dict[Tuple[int, int], int]] = None):
+        self._quantities = quantities if quantities is not None else {}
+
+    def __len__(self) -> int:
+        return len(self._quantities)
+
+    def at(self, type_id: int, location_id: int) -> int:
+        return self._quantities.get((type_id, location_id), 0)
+
+    def near(self, type_id: int, location_ids: Iterable[int]) -> int:
+        """Total at any of the given locations, e.g. a station and the
+        structures next to it."""
+        return sum(self._quantities.get((type_id, l), 0) for l in location_ids)
+
+    def locations(self) -> Dict[int, int]:
+        """Number of item types per location."""
+        res = {}
+        for _, l in self._quantities:
+            res[l] = res.get(l, 0) + 1
+        return res
+
+    @staticmethod
+    def merge(indexes: Iterable['AssetIndex']) -> 'AssetIndex':
+        quantities = {}
+        for index in indexes:
+            for k, q in index._quantities.items():
+                quantities[k] = quantities.get(k, 0) + q
+        return AssetIndex(quantities)
+
+def resolve_location(parents: Dict[int, int], location_id: int) -> int:
+    """The outermost location holding location_id, given the location of
+    each item that may contain others."""
+    for _ in range(MAX_NESTING):
+        if location_id not in parents:
+            return location_id
+        location_id = parents[location_id]
+    raise RuntimeError("items nested more than {} deep at {}, is there a loop?".format(MAX_NESTING, location_id))
+
+def parse_assets(fh) -> AssetIndex:
+    """Reads the output of esi/get-assets.py. Assets in containers are placed
+    at the station holding the container; files written before the ItemID
+    column was added can't be resolved that way, so those assets are left at
+    the container."""
+    r = csv.reader(fh)
+    header = next(r, None)
+    if header is None:
+        return AssetIndex()
+    col = {name: i for i, name in enumerate(header)}
+    type_col, singleton_col, quantity_col, location_col = col['TypeID'], col['Singleton'], col['Quantity'], col['LocationID']
+    item_col = col.get('ItemID')
+    if item_col is None:
+        log.warning("no ItemID column, assets in containers can't be placed at their station")
+
+    parents = {}
+    # (TypeID, LocationID, Quantity) before resolving containers.
+    rows = []
+    for row in r:
+        location_id = int(row[location_col])
+        if item_col is not None:
+            parents[int(row[item_col])] = location_id
+        # Assembled items are in use (ships, containers), not stock.
+        if row[singleton_col] == 'True': continue
+        rows.append((int(row[type_col]), location_id, int(row[quantity_col])))
+
+    quantities = {}
+    roots = {}
+    for type_id, location_id, quantity in rows:
+        root = roots.get(location_id)
+        if root is None:
+            root = roots[location_id] = resolve_location(parents, location_id)
+        k = (type_id, root)
+        quantities[k] = quantities.get(k, 0) + quantity
+    return AssetIndex(quantities)
+
+def parse_orders(fh) -> Dict[int, Dict[int, List]]:
+    """Reads the output of esi/get-orders.py: per station, per item, the
+    quantity and lowest price of our sell orders."""
+    res = {}
+    r = csv.reader(fh)
+    header = next(r, None)
+    if header is None:
+        return res
+    # TypeID,Quantity,Original Quantity,Price,LocationID
+    col = {name: i for i, name in enumerate(header)}
+    type_col, quantity_col, price_col, location_col = col['TypeID'], col['Quantity'], col['Price'], col['LocationID']
+    for row in r:
+        price = float(row[price_col])
+        o = res.setdefault(int(row[location_col]), {}).setdefault(int(row[type_col]), [0, None])
+        o[0] += int(row[quantity_col])
+        o[1] = price if o[1] is None else min(o[1], price)
+    return res
+
+def cached_parse(filename: str, parse: Callable[[object], T], cache_dir: Optional[str]) -> T:
+    """parse() of the file, cached on disk until the file's modification time
+    or size changes."""
+    if cache_dir is None:
+        with open(filename, "rt") as fh:
+            return parse(fh)
+    st = os.stat(filename)
+    version = (st.st_mtime_ns, st.st_size)
+    cache_file = os.path.join(cache_dir, "{}-{}.pickle".format(
+        parse.__name__, hashlib.sha256(os.path.abspath(filename).encode()).hexdigest()))
+    if os.path.exists(cache_file):
+        with open(cache_file, "rb") as fh:
+            cached_version, res = pickle.load(fh)
+        if cached_version == version:
+            return res
+
+    with open(filename, "rt") as fh:
+        res = parse(fh)
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(cache_file + ".tmp", "wb") as fh:
+        pickle.dump((version, res), fh, pickle.HIGHEST_PROTOCOL)
+    os.replace(cache_file + ".tmp", cache_file)
+    return res
+
+def load_assets(files: List[str], cache_dir: Optional[str] = None) -> AssetIndex:
+    indexes = []
+    for filename in files:
+        index = cached_parse(filename, parse_assets, cache_dir)
+        log.info("Read asset file {}: {} items at {} locations.".format(filename, len(index), len(index.locations())))
+        indexes.append(index)
+    return AssetIndex.merge(indexes)
+
+def load_orders(files: List[str], cache_dir: Optional[str] = None) -> Dict[int, Dict[int, List]]:
+    res = {}
+    for filename in files:
+        orders = cached_parse(filename, parse_orders, cache_dir)
+        log.info("Read order file {}: orders at {} locations.".format(filename, len(orders)))
+        for location_id, items in orders.items():
+            for type_id, (quantity, price) in items.items():
+                o = res.setdefault(location_id, {}).setdefault(type_id, [0, None])
+                o[0] += quantity
+                o[1] = price if o[1] is None else min(o[1], price)
+    return res
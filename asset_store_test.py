@@ -0,0 +1,103 @@
+import io
+import os
+import tempfile
+import unittest
+
+import asset_store
+
+STATION = 60003760
+OTHER = 60008494
+
+ASSETS = """TypeID,Singleton,Quantity,LocationFlag,LocationType,LocationID,ItemID
+34,False,100,Hangar,station,60003760,1
+17366,True,1,Hangar,station,60003760,2
+34,False,50,Unlocked,item,2,3
+27,True,1,OfficeFolder,station,60008494,4
+34,False,7,CorpSAG1,item,4,5
+35,False,3,Cargo,item,6,7
+587,True,1,Hangar,station,60008494,6
+587,True,1,Hangar,station,60008494,8
+"""
+
+class TestParseAssets(unittest.TestCase):
+    def setUp(self):
+        self.index = asset_store.parse_assets(io.StringIO(ASSETS))
+
+    def testContainersResolvedToStation(self):
+        self.assertEqual(150, self.index.at(34, STATION))
+        # In a corporation office.
+        self.assertEqual(7, self.index.at(34, OTHER))
+        # In a ship's cargo.
+        self.assertEqual(3, self.index.at(35, OTHER))
+
+    def testAssembledNotCounted(self):
+        self.assertEqual(0, self.index.at(17366, STATION))
+        self.assertEqual(0, self.index.at(587, OTHER))
+
+    def testNear(self):
+        self.assertEqual(157, self.index.near(34, [STATION, OTHER]))
+        self.assertEqual(0, self.index.near(34, []))
+
+    def testLocations(self):
+        self.assertEqual({STATION: 1, OTHER: 2}, self.index.locations())
+
+    def testWithoutItemID(self):
+        old = "\n".join(",".join(l.split(",")[:-1]) for l in ASSETS.splitlines())
+        index = asset_store.parse_assets(io.StringIO(old))
+        self.assertEqual(100, index.at(34, STATION))
+        self.assertEqual(50, index.at(34, 2))
+
+    def testLoop(self):
+        with self.assertRaises(RuntimeError):
+            asset_store.resolve_location({1: 2, 2: 1}, 1)
+
+    def testMerge(self):
+        merged = asset_store.AssetIndex.merge([self.index, self.index])
+        self.assertEqual(300, merged.at(34, STATION))
+
+ORDERS = """TypeID,Quantity,Original Quantity,Price,LocationID
+34,10,20,5.5,60003760
+34,5,5,5.0,60003760
+35,1,1,9.0,60008494
+"""
+
+class TestOrders(unittest.TestCase):
+    def testParse(self):
+        orders = asset_store.parse_orders(io.StringIO(ORDERS))
+        self.assertEqual({STATION: {34: [15, 5.0]}, OTHER: {35: [1, 9.0]}}, orders)
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.dir.name, "cache")
+        self.file = os.path.join(self.dir.name, "orders-1.csv")
+        self.write(ORDERS, 1)
+        self.parses = 0
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write(self, content: str, mtime: int):
+        with open(self.file, "wt") as fh:
+            fh.write(content)
+        os.utime(self.file, (mtime, mtime))
+
+    def parse_orders(self, fh):
+        self.parses += 1
+        return asset_store.parse_orders(fh)
+
+    def testReusedUntilChanged(self):
+        first = asset_store.cached_parse(self.file, self.parse_orders, self.cache_dir)
+        self.assertEqual(first, asset_store.cached_parse(self.file, self.parse_orders, self.cache_dir))
+        self.assertEqual(1, self.parses)
+        self.write(ORDERS.replace("35,1,1", "35,2,2"), 2)
+        self.assertEqual([2, 9.0], asset_store.cached_parse(self.file, self.parse_orders, self.cache_dir)[OTHER][35])
+        self.assertEqual(2, self.parses)
+
+    def testLoadOrdersMergesFiles(self):
+        orders = asset_store.load_orders([self.file, self.file], self.cache_dir)
+        self.assertEqual([30, 5.0], orders[STATION][34])
+        # Merging doesn't change what is cached.
+        self.assertEqual([15, 5.0], asset_store.load_orders([self.file], self.cache_dir)[STATION][34])
+
+unittest.main()
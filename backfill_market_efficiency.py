@@ -0,0 +1,168 @@
+#!/usr/bin/python3
+
+from argparse import ArgumentParser
+import csv
+import glob
+import io
+import logging
+import multiprocessing
+import os
+import re
+import sqlite3
+import sys
+from typing import Dict, List, Optional, Set, Tuple
+
+import calc_market_quality
+import lib
+import market_efficiency_store
+import top_market_items
+
+ItemSummary = calc_market_quality.ItemSummary
+EfficiencyRecord = market_efficiency_store.EfficiencyRecord
+
+log = logging.getLogger(__name__)
+
+# Set in each worker process by _init_worker, so the basket is sent to each
+# worker once rather than with every orderset.
+_items: Dict[int, ItemSummary] = None
+
+def _init_worker(items: Dict[int, ItemSummary]):
+    global _items
+    _items = items
+
+def _process_orderset(ofile: str) -> Tuple[str, Optional[List[EfficiencyRecord]]]:
+    """The records for one orderset, or None if it couldn't be processed, so
+    that one bad file doesn't stop the rest of the backfill."""
+    conn = sqlite3.connect("sde.db")
+    try:
+        _, records = calc_market_quality.orderset_station_stats(ofile, _items, conn.cursor())
+    except Exception:
+        log.exception("failed to process {}".format(ofile))
+        return ofile, None
+    finally:
+        conn.close()
+    return ofile, records
+
+def read_partition(fname: str) -> List[EfficiencyRecord]:
+    with open(fname, "rt") as fh:
+        if next(csv.reader(fh), None) != market_efficiency_store.CSV_HEADER:
+            raise RuntimeError("'{}' is not a market efficiency time series".format(fname))
+        fh.seek(0)
+        return list(market_efficiency_store.read_csv(fh))
+
+# The time series is kept as one csv file per day, named date=<Date>.csv, so
+# that adding an orderset rewrites only its own day.
+PARTITION_FILE = re.compile(r'date=(\d{4}-\d{2}-\d{2})\.csv')
+
+def partition_file(directory: str, date: str) -> str:
+    return os.path.join(directory, 'date={}.csv'.format(date))
+
+def read_existing(directory: str) -> List[EfficiencyRecord]:
+    """All the records in the partitions of the time series in directory."""
+    records = []
+    for f in sorted(glob.glob(os.path.join(directory, 'date=*.csv'))):
+        if PARTITION_FILE.fullmatch(os.path.basename(f)) is None:
+            log.warning("skipping {}, not named date=YYYY-MM-DD.csv".format(f))
+            continue
+        records.extend(read_partition(f))
+    return records
+
+# As named by backfill.sh: orderset-<Orderset>.csv.gz
+ORDERSET_FILE = re.compile(r'orderset-(\d+)\.csv\.gz')
+
+def orderset_id(ofile: str) -> Optional[int]:
+    """The orderset in a file named by backfill.sh, or None for other files."""
+    m = ORDERSET_FILE.fullmatch(os.path.basename(ofile))
+    return int(m.group(1)) if m is not None else None
+
+def find_ordersets(directory: str, done: Set[int]) -> List[str]:
+    """The orderset files in directory not already done, skipping any file
+    not named as backfill.sh names them."""
+    res = []
+    for f in sorted(glob.glob(os.path.join(directory, 'orderset-*.csv.gz'))):
+        i = orderset_id(f)
+        if i is None:
+            log.warning("skipping {}, not named orderset-<id>.csv.gz".format(f))
+        elif i not in done:
+            res.append(f)
+    return res
+
+def append_records(fname: str, records: List[EfficiencyRecord]):
+    """Adds the records of one orderset to the end of a partition, so
+    that they are kept even if the backfill doesn't finish."""
+    fh = io.StringIO()
+    market_efficiency_store.write_csv(fh, records)
+    rows = fh.getvalue()
+    if os.path.exists(fname) and os.path.getsize(fname) > 0:
+        # Without the header, which the file already has.
+        rows = rows[rows.index('\n') + 1:]
+    with open(fname, "at") as out:
+        out.write(rows)
+
+def sort_records(records: List[EfficiencyRecord]) -> List[EfficiencyRecord]:
+    """Orders the time series by Date, then Orderset. Within an orderset, the
+    order of the records (most covered station first) is kept."""
+    return sorted(records, key=lambda r: (r.Date, r.Orderset))
+
+def sort_partition(fname: str):
+    records = sort_records(read_partition(fname))
+    with open(fname + ".tmp", "wt") as fh:
+        market_efficiency_store.write_csv(fh, records)
+    os.replace(fname + ".tmp", fname)
+
+def main():
+    logging.basicConfig(format='%(processName)s %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    arg_parser = ArgumentParser(prog='backfill_market_efficiency.py')
+    arg_parser.add_argument('--ordersets', type=str, default='backfill', help='directory of orderset-*.csv.gz files')
+    arg_parser.add_argument('--output', type=str, default='backfill/market-efficiency', help='directory of the time series, one date=YYYY-MM-DD.csv per day; ordersets already in it are skipped')
+    arg_parser.add_argument('--store', type=str, help='also add the new results to this store')
+    arg_parser.add_argument('--jobs', type=int, default=os.cpu_count())
+    arg_parser.add_argument('--limit-top-traded-items', type=int)
+    arg_parser.add_argument('--top-traded-items', type=str)
+    top_market_items.add_basket_args(arg_parser)
+    args = arg_parser.parse_args()
+
+    done: Set[int] = set(r.Orderset for r in read_existing(args.output))
+    ordersets = find_ordersets(args.ordersets, done)
+    log.info("{} ordersets to process, {} already in {}".format(len(ordersets), len(done), args.output))
+    if not ordersets:
+        return
+
+    conn = sqlite3.connect("sde.db")
+    items = {s.ID: s for s in top_market_items.load_basket(args, conn, args.limit_top_traded_items)}
+    conn.close()
+    log.info("Basket of items loaded, {} items".format(len(items)))
+
+    store = market_efficiency_store.open_store(args.store) if args.store is not None else None
+    os.makedirs(args.output, exist_ok=True)
+    touched: Set[str] = set()
+    failed = []
+    with multiprocessing.Pool(args.jobs, initializer=_init_worker, initargs=(items,)) as pool:
+        for n, (ofile, orderset_records) in enumerate(pool.imap_unordered(_process_orderset, ordersets), 1):
+            if orderset_records is None:
+                failed.append(ofile)
+                continue
+            log.info("[{}/{}] {}: {} stations".format(n, len(ordersets), ofile, len(orderset_records)))
+            if orderset_records and orderset_records[0].Orderset in done:
+                log.warning("orderset {} from {} is already in {}".format(orderset_records[0].Orderset, ofile, args.output))
+                continue
+            done.update(r.Orderset for r in orderset_records)
+            # Saved as each orderset finishes, so an interrupted backfill
+            # resumes from where it got to.
+            for date in sorted(set(r.Date for r in orderset_records)):
+                fname = partition_file(args.output, date)
+                append_records(fname, [r for r in orderset_records if r.Date == date])
+                touched.add(fname)
+            if store is not None:
+                added, present = market_efficiency_store.ingest(store, orderset_records)
+                log.info("{}: added {}, already present {}".format(args.store, added, present))
+
+    # Once all are in, put the days that changed in order.
+    for fname in sorted(touched):
+        sort_partition(fname)
+    if failed:
+        log.error("{} ordersets failed, re-run to retry them: {}".format(len(failed), ", ".join(failed)))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
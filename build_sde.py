@@ -8,28 +8,123 @@ import math
 import operator
 from pathlib import Path
 import sqlite3
+from typing import Dict, Iterator, List, Optional, Tuple
 import yaml
 
+import lib
+
 logging.basicConfig(format='%(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 log = logging.getLogger(__name__)
 arg_parser = ArgumentParser(prog='build-sde.py')
 arg_parser.add_argument('--initial', action='store_true')
+arg_parser.add_argument('--force', action='store_true', help='rebuild tables even if their source files are unchanged')
 arg_parser.add_argument('--skip_types', action='store_true')
 arg_parser.add_argument('--skip_systems', action='store_true')
 args = arg_parser.parse_args()
 
-def build_categories(cur):
+def init_source_hashes(cur):
+    # Created unconditionally, so that databases built before this table
+    # existed pick it up on their next (incremental) run.
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS SourceHashes(
+      TableName TEXT NOT NULL,
+      Path      TEXT NOT NULL,
+      Hash      TEXT NOT NULL,
+      PRIMARY KEY (TableName, Path)
+    );""")
+    cur.commit()
+
+def migrate_schema(cur):
+    """Brings tables of an existing database up to the current schema. Run
+    whatever --skip_* options are given, so that readers of the new columns
+    work on any database."""
     if args.initial:
-        cur.execute("""
-        CREATE TABLE Categories(
-          ID      INT PRIMARY KEY NOT NULL,
-          Name    TEXT NOT NULL
-        );""")
-        cur.execute("""
-        CREATE UNIQUE INDEX Categories_ByName ON Categories(Name);
-        """)
-
-    with open("sde/fsd/categories.yaml", "rt") as fh:
+        return
+    if 'Volume' not in [r[1] for r in cur.execute("PRAGMA table_info(Types)")]:
+        cur.execute("""ALTER TABLE Types ADD COLUMN Volume FLOAT""")
+        # The new column has to be filled in even though types.yaml hasn't changed.
+        cur.execute("""DELETE FROM SourceHashes WHERE TableName = 'Types'""")
+    cur.commit()
+
+def changed_sources(cur, table: str, paths: List[str]) -> Optional[Dict[str, str]]:
+    """Returns the current hashes of the given source files if they differ from
+    those recorded when the table was last built, or None if the table is up to date."""
+    hashes = {str(p): lib.file_hash(p) for p in paths}
+    if args.initial or args.force:
+        return hashes
+    res = cur.execute("""
+    SELECT Path, Hash FROM SourceHashes WHERE TableName = ?
+    """, [table])
+    if dict(res.fetchall()) == hashes:
+        log.info("{} is up to date, skipping".format(table))
+        return None
+    return hashes
+
+def record_sources(cur, table: str, hashes: Dict[str, str]):
+    cur.execute("""DELETE FROM SourceHashes WHERE TableName = ?""", [table])
+    cur.executemany("""INSERT INTO SourceHashes VALUES(?,?,?)""",
+            [(table, p, h) for p, h in hashes.items()])
+    cur.commit()
+
+def sync_table(cur, table: str, key_len: int, rows: Dict[tuple, tuple]) -> Tuple[int, int, int, int]:
+    """Makes the contents of table equal to rows (keyed by the first key_len columns).
+
+    Only rows which are new or differ from what is already stored are written, and
+    rows which are no longer present are deleted. Returns (added, updated, deleted, failed)."""
+    existing = {r[:key_len]: r for r in cur.execute("SELECT * FROM {}".format(table))}
+    columns = [r[1] for r in cur.execute("PRAGMA table_info({})".format(table))]
+    where = " AND ".join("{} = ?".format(c) for c in columns[:key_len])
+    placeholders = ",".join("?" * len(columns))
+    insert = """INSERT INTO {} VALUES({})""".format(table, placeholders)
+    update = """UPDATE {} SET {} WHERE {}""".format(table, ", ".join("{} = ?".format(c) for c in columns[key_len:]), where)
+
+    deleted = [k for k in existing if k not in rows]
+    cur.executemany("""DELETE FROM {} WHERE {}""".format(table, where), deleted)
+
+    # Plain INSERT and UPDATE rather than INSERT OR REPLACE: a row clashing
+    # with another on a unique index (e.g. a duplicate name) must fail and be
+    # reported, not silently delete the other row.
+    added = 0
+    updated = 0
+    def write(k: tuple, row: tuple):
+        nonlocal added, updated
+        if k in existing:
+            cur.execute(update, row[key_len:] + k)
+            updated += 1
+        else:
+            cur.execute(insert, row)
+            added += 1
+
+    retry = []
+    for k, row in rows.items():
+        if existing.get(k) == row:
+            continue
+        try:
+            write(k, row)
+        except sqlite3.IntegrityError:
+            retry.append((k, row))
+    # A row can clash with the old value of a row written after it, e.g. when
+    # a name moves from one ID to another, so failures get a second try.
+    failed = 0
+    for k, row in retry:
+        try:
+            write(k, row)
+        except sqlite3.IntegrityError as e:
+            log.error("failed to write to {}: {}: {}".format(table, row, e))
+            failed += 1
+    cur.commit()
+    return added, updated, len(deleted), failed
+
+def log_sync(what: str, counts: Tuple[int, int, int, int]):
+    added, updated, deleted, failed = counts
+    msg = "{}: added {}, updated {}, deleted {}, failed {}".format(what, added, updated, deleted, failed)
+    if failed == 0:
+        log.info(msg)
+    else:
+        log.error(msg)
+
+def read_yaml_mapping(fname: str) -> Iterator[Tuple[object, object]]:
+    with open(fname, "rt") as fh:
         loader = yaml.SafeLoader(fh)
 
         # check proper stream start (should never fail)
@@ -38,13 +133,11 @@ def build_categories(cur):
         assert loader.check_event(yaml.DocumentStartEvent)
         loader.get_event()
 
-        # assume the root element is a sequence
+        # assume the root element is a mapping
         assert loader.check_event(yaml.MappingStartEvent)
         loader.get_event()
-        added = 0
-        failed = 0
 
-        # now while the next event does not end the sequence, process each item
+        # now while the next event does not end the mapping, process each item
         while not loader.check_event(yaml.MappingEndEvent):
             # compose current item to a node as if it was the root node
             node = loader.compose_node(None, None)
@@ -54,25 +147,61 @@ def build_categories(cur):
             node = loader.compose_node(None, None)
             # we set deep=True for complete processing of all the node's children
             v = loader.construct_object(node, True)
+            yield k, v
 
-            cat_id = k
-            name = v['name']['en']
-            try:
-                cur.execute("""INSERT OR REPLACE INTO Categories VALUES(?,?)""", [cat_id, name])
-                added += 1
-            except sqlite3.IntegrityError:
-                log.error("failed to insert ({},{})".format(cat_id, name))
-                failed += 1
         # assume document ends and no further documents are in stream
         loader.get_event()
         assert loader.check_event(yaml.DocumentEndEvent)
         loader.get_event()
         assert loader.check_event(yaml.StreamEndEvent)
-        cur.commit()
-        if added > 0 or failed == 0:
-            log.info("Added {} categories, failed {}".format(added, failed))
-        else:
-            log.error("Added {} categories, failed {}".format(added, failed))
+
+def read_yaml_sequence(fname: str) -> Iterator[object]:
+    with open(fname, "rt") as fh:
+        loader = yaml.SafeLoader(fh)
+
+        # check proper stream start (should never fail)
+        assert loader.check_event(yaml.StreamStartEvent)
+        loader.get_event()
+        assert loader.check_event(yaml.DocumentStartEvent)
+        loader.get_event()
+
+        # assume the root element is a sequence
+        assert loader.check_event(yaml.SequenceStartEvent)
+        loader.get_event()
+
+        # now while the next event does not end the sequence, process each item
+        while not loader.check_event(yaml.SequenceEndEvent):
+            # compose current item to a node as if it was the root node
+            node = loader.compose_node(None, None)
+            # we set deep=True for complete processing of all the node's children
+            yield loader.construct_object(node, True)
+
+        # assume document ends and no further documents are in stream
+        loader.get_event()
+        assert loader.check_event(yaml.DocumentEndEvent)
+        loader.get_event()
+        assert loader.check_event(yaml.StreamEndEvent)
+
+def build_categories(cur):
+    if args.initial:
+        cur.execute("""
+        CREATE TABLE Categories(
+          ID      INT PRIMARY KEY NOT NULL,
+          Name    TEXT NOT NULL
+        );""")
+        cur.execute("""
+        CREATE UNIQUE INDEX Categories_ByName ON Categories(Name);
+        """)
+
+    sources = changed_sources(cur, 'Categories', ["sde/fsd/categories.yaml"])
+    if sources is None:
+        return
+
+    rows = {}
+    for cat_id, v in read_yaml_mapping("sde/fsd/categories.yaml"):
+        rows[(cat_id,)] = (cat_id, v['name']['en'])
+    log_sync("Categories", sync_table(cur, 'Categories', 1, rows))
+    record_sources(cur, 'Categories', sources)
 
 def build_market_groups(cur):
     if args.initial:
@@ -84,78 +213,69 @@ def build_market_groups(cur):
         cur.execute("""
         CREATE UNIQUE INDEX MarketGroups_ByPath ON MarketGroups(Path);
         """)
-
-    def get_mgroup(group_id: int):
-        res = cur.execute("""
-        SELECT ID, Path FROM MarketGroups
-        WHERE ID = ?
-        """, [group_id])
-        r = res.fetchall()
-        if len(r) == 0:
-            return None
-        assert len(r) == 1
-        row = r[0]
-        return row[1]
+    # Closure of the market group hierarchy: one row per (ancestor, descendant)
+    # pair, including each group as its own ancestor at depth 0. Lets a whole
+    # subtree be selected with one indexed lookup on AncestorID.
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS MarketGroupTree(
+      AncestorID   INT NOT NULL,
+      DescendantID INT NOT NULL,
+      Depth        INT NOT NULL,
+      PRIMARY KEY (AncestorID, DescendantID)
+    );""")
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS MarketGroupTree_ByDescendant ON MarketGroupTree(DescendantID);
+    """)
+
+    path_sources = changed_sources(cur, 'MarketGroups', ["sde/fsd/marketGroups.yaml"])
+    tree_sources = changed_sources(cur, 'MarketGroupTree', ["sde/fsd/marketGroups.yaml"])
+    if path_sources is None and tree_sources is None:
+        return
+
+    groups = {}
+    for mgroup_id, v in read_yaml_mapping("sde/fsd/marketGroups.yaml"):
+        groups[mgroup_id] = (v['nameID']['en'], v.get('parentGroupID'))
 
     # The marketGroups file contains forward references - so an entry may refer
-    # to a parent that occurs later in the file. Greedy approach here - we just
-    # repeatedly load the file, skipping entries that are broken references
-    # and keep going until we have a pass with nothing skipped (or fail if we do
-    # a pass with nothing added).
+    # to a parent that occurs later in the file. Greedy approach here - we
+    # repeatedly pass over the entries, skipping those whose parent has no path
+    # yet, and keep going until we have a pass with nothing skipped (or stop if we
+    # do a pass with nothing added).
+    paths = {}
     skipped = 1
     added = 1
     while skipped > 0 and added > 0:
         added = 0
         skipped = 0
-        with open("sde/fsd/marketGroups.yaml", "rt") as fh:
-            loader = yaml.SafeLoader(fh)
-
-            # check proper stream start (should never fail)
-            assert loader.check_event(yaml.StreamStartEvent)
-            loader.get_event()
-            assert loader.check_event(yaml.DocumentStartEvent)
-            loader.get_event()
-
-            # assume the root element is a sequence
-            assert loader.check_event(yaml.MappingStartEvent)
-            loader.get_event()
-
-            # now while the next event does not end the sequence, process each item
-            while not loader.check_event(yaml.MappingEndEvent):
-                # compose current item to a node as if it was the root node
-                node = loader.compose_node(None, None)
-                # we set deep=True for complete processing of all the node's children
-                k = loader.construct_object(node, True)
-                # compose current item to a node as if it was the root node
-                node = loader.compose_node(None, None)
-                # we set deep=True for complete processing of all the node's children
-                v = loader.construct_object(node, True)
-
-                mgroup_id = k
-                name = v['nameID']['en']
-                try:
-                    if 'parentGroupID' in v:
-                        parentPath = get_mgroup(v['parentGroupID'])
-                        if parentPath is None:
-                            skipped += 1
-                            continue
-                        path = '{}>{}'.format(parentPath,name)
-                    else:
-                        path = name
-                    cur.execute("""INSERT OR REPLACE INTO MarketGroups VALUES(?,?)""", [mgroup_id, path])
-                    added += 1
-                except sqlite3.IntegrityError:
-                    log.error("failed to insert ({},{})".format(mgroup_id, name, v.get('parentGroupID','-')))
-            # assume document ends and no further documents are in stream
-            loader.get_event()
-            assert loader.check_event(yaml.DocumentEndEvent)
-            loader.get_event()
-            assert loader.check_event(yaml.StreamEndEvent)
-            cur.commit()
-            if added > 0 or skipped == 0:
-                log.info("Added {} market groups, skipped {}".format(added, skipped))
+        for mgroup_id, (name, parent) in groups.items():
+            if mgroup_id in paths: continue
+            if parent is None:
+                paths[mgroup_id] = name
+            elif parent in paths:
+                paths[mgroup_id] = '{}>{}'.format(paths[parent], name)
             else:
-                log.error("Added {} market groups, skipped {}".format(added, skipped))
+                skipped += 1
+                continue
+            added += 1
+    if skipped > 0:
+        log.error("Could not resolve paths for {} market groups".format(skipped))
+
+    if path_sources is not None:
+        rows = {(mgroup_id,): (mgroup_id, path) for mgroup_id, path in paths.items()}
+        log_sync("MarketGroups", sync_table(cur, 'MarketGroups', 1, rows))
+        record_sources(cur, 'MarketGroups', path_sources)
+
+    if tree_sources is not None:
+        rows = {}
+        for mgroup_id in paths:
+            ancestor = mgroup_id
+            depth = 0
+            while ancestor is not None:
+                rows[(ancestor, mgroup_id)] = (ancestor, mgroup_id, depth)
+                ancestor = groups[ancestor][1]
+                depth += 1
+        log_sync("MarketGroupTree", sync_table(cur, 'MarketGroupTree', 2, rows))
+        record_sources(cur, 'MarketGroupTree', tree_sources)
 
 # Commodity,Number of trades,Traded items,Value of trades,Lst,,as per ESI; complete New Eden; last update: 24.11.2023
 # PLEX,2.974,1.078.606,4.415.528.028.140,,,
@@ -172,51 +292,17 @@ def build_groups(cur):
         CREATE UNIQUE INDEX Groups_ByName ON Groups(Name);
         """)
 
-    with open("sde/fsd/groups.yaml", "rt") as fh:
-        loader = yaml.SafeLoader(fh)
-
-        # check proper stream start (should never fail)
-        assert loader.check_event(yaml.StreamStartEvent)
-        loader.get_event()
-        assert loader.check_event(yaml.DocumentStartEvent)
-        loader.get_event()
-
-        # assume the root element is a sequence
-        assert loader.check_event(yaml.MappingStartEvent)
-        loader.get_event()
-
-        added = 0
-        failed = 0
+    sources = changed_sources(cur, 'Groups', ["sde/fsd/groups.yaml"])
+    if sources is None:
+        return
 
-        # now while the next event does not end the sequence, process each item
-        while not loader.check_event(yaml.MappingEndEvent):
-            # compose current item to a node as if it was the root node
-            node = loader.compose_node(None, None)
-            # we set deep=True for complete processing of all the node's children
-            k = loader.construct_object(node, True)
-            # compose current item to a node as if it was the root node
-            node = loader.compose_node(None, None)
-            # we set deep=True for complete processing of all the node's children
-            v = loader.construct_object(node, True)
+    rows = {}
+    for group_id, v in read_yaml_mapping("sde/fsd/groups.yaml"):
+        rows[(group_id,)] = (group_id, v['name']['en'], v['categoryID'])
+    log_sync("Groups", sync_table(cur, 'Groups', 1, rows))
+    record_sources(cur, 'Groups', sources)
 
-            group_id = k
-            name = v['name']['en']
-            try:
-                cur.execute("""INSERT OR REPLACE INTO Groups VALUES(?,?,?)""", [group_id, name, v['categoryID']])
-                added += 1
-            except sqlite3.IntegrityError:
-                log.error("failed to insert ({},{},{})".format(group_id, name, v['categoryID']))
-                failed += 1
-        # assume document ends and no further documents are in stream
-        loader.get_event()
-        assert loader.check_event(yaml.DocumentEndEvent)
-        loader.get_event()
-        assert loader.check_event(yaml.StreamEndEvent)
-        cur.commit()
-        if added > 0 or failed == 0:
-            log.info("Added {} groups, failed {}".format(added, failed))
-        else:
-            log.error("Added {} groups, failed {}".format(added, failed))
+SHIPS_CATEGORY = 6
 
 def build_types(cur):
     if args.initial:
@@ -226,123 +312,64 @@ def build_types(cur):
           Name    TEXT NOT NULL,
           GroupID INT NOT NULL,
           MarketGroupID INT,
-          PortionSize INT
+          PortionSize INT,
+          Volume  FLOAT
         );""")
         cur.execute("""
         CREATE UNIQUE INDEX Types_ByName ON Types(Name);
         """)
 
-    with open("sde/fsd/types.yaml", "rt") as types_file:
-        loader = yaml.SafeLoader(types_file)
-
-        # check proper stream start (should never fail)
-        assert loader.check_event(yaml.StreamStartEvent)
-        loader.get_event()
-        assert loader.check_event(yaml.DocumentStartEvent)
-        loader.get_event()
-
-        # assume the root element is a sequence
-        assert loader.check_event(yaml.MappingStartEvent)
-        loader.get_event()
-
-        added = 0
-        failed = 0
-
-        # now while the next event does not end the sequence, process each item
-        while not loader.check_event(yaml.MappingEndEvent):
-            # compose current item to a node as if it was the root node
-            node = loader.compose_node(None, None)
-            # we set deep=True for complete processing of all the node's children
-            k = loader.construct_object(node, True)
-            # compose current item to a node as if it was the root node
-            node = loader.compose_node(None, None)
-            # we set deep=True for complete processing of all the node's children
-            v = loader.construct_object(node, True)
+    sources = changed_sources(cur, 'Types', ["sde/fsd/types.yaml", "sde/fsd/groups.yaml", "packaged-volumes.csv"])
+    if sources is None:
+        return
 
-            type_id = k
-            name = v['name']['en']
+    # Volume is what an item takes up in a hauler. The SDE has the assembled
+    # volume, which for ships is far more than when packaged, and the packaged
+    # volumes are not part of the SDE.
+    packaged = {}
+    with open("packaged-volumes.csv", "rt") as more_fh:
+        for row in csv.DictReader(more_fh):
             try:
-                cur.execute("""INSERT INTO Types VALUES(?,?,?,?,?);""", [type_id, name, v['groupID'], v.get('marketGroupID'), v.get('portionSize')])
-                added += 1
-            except sqlite3.IntegrityError:
-                log.error("failed to insert ({},{},{})".format(type_id, name, v['groupID']))
-                failed += 1
-
-            if added % 10000 == 0:
-                cur.commit()
-
-        # assume document ends and no further documents are in stream
-        loader.get_event()
-        assert loader.check_event(yaml.DocumentEndEvent)
-        loader.get_event()
-        assert loader.check_event(yaml.StreamEndEvent)
-        cur.commit()
-        if added > 0 or failed == 0:
-            log.info("Added {} groups, failed {}".format(added, failed))
-        else:
-            log.error("Added {} groups, failed {}".format(added, failed))
+                packaged[int(row['GroupID'])] = float(row['Volume'])
+            except (ValueError, KeyError):
+                log.error("failed to parse packaged volume '{}'".format(row))
+    group_categories = {group_id: v['categoryID'] for group_id, v in read_yaml_mapping("sde/fsd/groups.yaml")}
+
+    rows = {}
+    for type_id, v in read_yaml_mapping("sde/fsd/types.yaml"):
+        volume = v.get('volume')
+        if v['groupID'] in packaged:
+            volume = packaged[v['groupID']]
+        elif group_categories.get(v['groupID']) == SHIPS_CATEGORY:
+            # No volume rather than the assembled one, so that hauling costs
+            # leave these out until their group is in packaged-volumes.csv.
+            volume = None
+        rows[(type_id,)] = (type_id, v['name']['en'], v['groupID'], v.get('marketGroupID'), v.get('portionSize'), volume)
+    log_sync("Types", sync_table(cur, 'Types', 1, rows))
+    record_sources(cur, 'Types', sources)
 
 def build_reprocessing(cur):
     if args.initial:
-        con.execute("""
+        cur.execute("""
         CREATE TABLE ReprocessItems(
           ID       INT NOT NULL,
           OutputID INT NOT NULL,
           QuantityYielded INT
         );""")
-        con.execute("""
+        cur.execute("""
         CREATE UNIQUE INDEX ReprocessItems_Key ON ReprocessItems(ID, OutputID);
         """)
 
-    with open("sde/fsd/typeMaterials.yaml", "rt") as types_file:
-        loader = yaml.SafeLoader(types_file)
+    sources = changed_sources(cur, 'ReprocessItems', ["sde/fsd/typeMaterials.yaml"])
+    if sources is None:
+        return
 
-        # check proper stream start (should never fail)
-        assert loader.check_event(yaml.StreamStartEvent)
-        loader.get_event()
-        assert loader.check_event(yaml.DocumentStartEvent)
-        loader.get_event()
-
-        # assume the root element is a sequence
-        assert loader.check_event(yaml.MappingStartEvent)
-        loader.get_event()
-
-        added = 0
-        failed = 0
-
-        # now while the next event does not end the sequence, process each item
-        while not loader.check_event(yaml.MappingEndEvent):
-            # compose current item to a node as if it was the root node
-            node = loader.compose_node(None, None)
-            # we set deep=True for complete processing of all the node's children
-            k = loader.construct_object(node, True)
-            # compose current item to a node as if it was the root node
-            node = loader.compose_node(None, None)
-            # we set deep=True for complete processing of all the node's children
-            v = loader.construct_object(node, True)
-
-            type_id = k
-            for material in v['materials']:
-                try:
-                    con.execute("""INSERT INTO ReprocessItems VALUES(?,?,?);""", [type_id, material['materialTypeID'], material['quantity']])
-                    added += 1
-                except sqlite3.IntegrityError:
-                    log.error("failed to insert ({},{},{})".format(type_id, material['materialTypeID'], material['quantity']))
-                    failed += 1
-
-            if added % 10000 == 0:
-                cur.commit()
-
-        # assume document ends and no further documents are in stream
-        loader.get_event()
-        assert loader.check_event(yaml.DocumentEndEvent)
-        loader.get_event()
-        assert loader.check_event(yaml.StreamEndEvent)
-        con.commit()
-        if added > 0 or failed == 0:
-            log.info("Added {} types for reprocessing, failed {}".format(added, failed))
-        else:
-            log.error("Added {} types for reprocessing, failed {}".format(added, failed))
+    rows = {}
+    for type_id, v in read_yaml_mapping("sde/fsd/typeMaterials.yaml"):
+        for material in v['materials']:
+            rows[(type_id, material['materialTypeID'])] = (type_id, material['materialTypeID'], material['quantity'])
+    log_sync("ReprocessItems", sync_table(cur, 'ReprocessItems', 2, rows))
+    record_sources(cur, 'ReprocessItems', sources)
 
 def build_stations(cur):
     if args.initial:
@@ -354,65 +381,28 @@ def build_stations(cur):
           RegionID INT NOT NULL
         );""")
 
-    with open("sde/bsd/staStations.yaml", "rt") as sta_file:
-        loader = yaml.SafeLoader(sta_file)
+    sources = changed_sources(cur, 'Stations', ["sde/bsd/staStations.yaml", "extra-stations.csv"])
+    if sources is None:
+        return
 
-        # check proper stream start (should never fail)
-        assert loader.check_event(yaml.StreamStartEvent)
-        loader.get_event()
-        assert loader.check_event(yaml.DocumentStartEvent)
-        loader.get_event()
-
-        # assume the root element is a sequence
-        assert loader.check_event(yaml.SequenceStartEvent)
-        loader.get_event()
-
-        added = 0
-        failed = 0
-
-        # now while the next event does not end the sequence, process each item
-        while not loader.check_event(yaml.SequenceEndEvent):
-            # compose current item to a node as if it was the root node
-            node = loader.compose_node(None, None)
-            # we set deep=True for complete processing of all the node's children
-            v = loader.construct_object(node, True)
-
-            try:
-                cur.execute("""INSERT OR REPLACE INTO Stations VALUES(?,?,?,?);""", [v['stationID'], v['stationName'], v['solarSystemID'], v['regionID']])
-                added += 1
-            except sqlite3.IntegrityError:
-                log.error("failed to insert '{}'".format(v['stationID']))
-                failed += 1
-
-        # assume document ends and no further documents are in stream
-        loader.get_event()
-        assert loader.check_event(yaml.DocumentEndEvent)
-        loader.get_event()
-        assert loader.check_event(yaml.StreamEndEvent)
-        cur.commit()
-        if added > 0 or failed == 0:
-            log.info("Added {} stations, failed {}".format(added, failed))
-        else:
-            log.error("Added {} stations, failed {}".format(added, failed))
-
-    added = 0
-    failed = 0
+    rows = {}
+    for v in read_yaml_sequence("sde/bsd/staStations.yaml"):
+        rows[(v['stationID'],)] = (v['stationID'], v['stationName'], v['solarSystemID'], v['regionID'])
+    npc_stations = len(rows)
 
+    # Player stations are not part of the SDE.
     with open("extra-stations.csv", "rt") as more_fh:
         r = csv.DictReader(more_fh)
         for row in r:
             try:
-                cur.execute("""INSERT OR REPLACE INTO Stations VALUES(?,?,?,?)""",
-                        [row['ID'], row['Name'], row['SystemID'], row['RegionID']])
-                added += 1
-            except sqlite3.IntegrityError:
-                log.error("failed to insert extra '{}'".format(row['ID']))
-                failed += 1
-        cur.commit()
-        if added > 0 or failed == 0:
-            log.info("Added {} player stations, failed {}".format(added, failed))
-        else:
-            log.error("Added {} player stations, failed {}".format(added, failed))
+                station_id = int(row['ID'])
+                rows[(station_id,)] = (station_id, row['Name'], int(row['SystemID']), int(row['RegionID']))
+            except (ValueError, KeyError):
+                log.error("failed to parse extra station '{}'".format(row))
+    log.info("Read {} stations and {} player stations".format(npc_stations, len(rows) - npc_stations))
+
+    log_sync("Stations", sync_table(cur, 'Stations', 1, rows))
+    record_sources(cur, 'Stations', sources)
 
 def build_systems(cur):
     if args.initial:
@@ -423,51 +413,59 @@ def build_systems(cur):
           Security FLOAT32 NOT NULL
         );""")
 
-    names = {}
-
-    with open("sde/bsd/invNames.yaml", "rt") as names_file:
-        loader = yaml.SafeLoader(names_file)
-
-        # check proper stream start (should never fail)
-        assert loader.check_event(yaml.StreamStartEvent)
-        loader.get_event()
-        assert loader.check_event(yaml.DocumentStartEvent)
-        loader.get_event()
+    system_files = sorted(Path("sde/universe/eve").glob('**/solarsystem.yaml'))
+    sources = changed_sources(cur, 'Systems', ["sde/bsd/invNames.yaml"] + system_files)
+    if sources is None:
+        return
 
-        # assume the root element is a sequence
-        assert loader.check_event(yaml.SequenceStartEvent)
-        loader.get_event()
-
-        count = 0
-        # now while the next event does not end the sequence, process each item
-        while not loader.check_event(yaml.SequenceEndEvent):
-            # compose current item to a node as if it was the root node
-            node = loader.compose_node(None, None)
-            # we set deep=True for complete processing of all the node's children
-            v = loader.construct_object(node, True)
+    names = {}
+    for v in read_yaml_sequence("sde/bsd/invNames.yaml"):
+        names[v['itemID']] = v['itemName']
 
-            names[v['itemID']] = v['itemName']
+    rows = {}
+    for path in system_files:
+        with open(path, "rt") as fh:
+            d = yaml.safe_load(fh)
+            systemID = d['solarSystemID']
+            if systemID not in names:
+                log.error("no name for system from '{}'".format(path))
+                continue
+            rows[(systemID,)] = (systemID, names[systemID], d['security'])
+    log_sync("Systems", sync_table(cur, 'Systems', 1, rows))
+    record_sources(cur, 'Systems', sources)
+
+def build_regions(cur):
+    # Not part of the initial schema, so created on the next run of an existing sde.db.
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS Regions(
+      ID       INT PRIMARY KEY NOT NULL,
+      Name     TEXT NOT NULL
+    );""")
+
+    region_files = sorted(Path("sde/universe/eve").glob('*/region.yaml'))
+    sources = changed_sources(cur, 'Regions', ["sde/bsd/invNames.yaml"] + region_files)
+    if sources is None:
+        return
 
-        # assume document ends and no further documents are in stream
-        loader.get_event()
-        assert loader.check_event(yaml.DocumentEndEvent)
-        loader.get_event()
-        assert loader.check_event(yaml.StreamEndEvent)
+    names = {}
+    for v in read_yaml_sequence("sde/bsd/invNames.yaml"):
+        names[v['itemID']] = v['itemName']
 
-    for path in Path("sde/universe/eve").glob('**/solarsystem.yaml'):
+    rows = {}
+    for path in region_files:
         with open(path, "rt") as fh:
-            try:
-                d = yaml.safe_load(fh)
-                systemID = d['solarSystemID']
-                cur.execute("""INSERT OR REPLACE INTO Systems VALUES(?,?,?)""",
-                        [systemID, names[systemID], d['security']])
-            except sqlite3.IntegrityError:
-                log.error("failed to insert system from '{}'".format(path))
-        cur.commit()
+            regionID = yaml.safe_load(fh)['regionID']
+            if regionID not in names:
+                log.error("no name for region from '{}'".format(path))
+                continue
+            rows[(regionID,)] = (regionID, names[regionID])
+    log_sync("Regions", sync_table(cur, 'Regions', 1, rows))
+    record_sources(cur, 'Regions', sources)
 
 
 con = sqlite3.connect("sde.db")
-cur = con.cursor()
+init_source_hashes(con)
+migrate_schema(con)
 if not args.skip_types:
     build_types(con)
 build_reprocessing(con)
@@ -477,5 +475,6 @@ build_categories(con)
 build_stations(con)
 if not args.skip_systems:
     build_systems(con)
+    build_regions(con)
 
 log.info('...done')
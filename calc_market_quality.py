@@ -4,16 +4,20 @@ from argparse import ArgumentParser
 from collections import namedtuple
 import csv
 import datetime
+import heapq
 import logging
-import tempfile
-from typing import Dict, IO, Iterator, List, NamedTuple, Optional, Tuple
+import math
+from typing import Dict, IO, Iterable, Iterator, List, NamedTuple, Optional, Tuple
 import sqlite3
-import sys
 
 import lib
+import market_efficiency_store
+import market_groups
+import top_market_items
 import trade_lib
 
 ItemSummary = trade_lib.ItemSummary
+EfficiencyRecord = market_efficiency_store.EfficiencyRecord
 
 logging.basicConfig(format='%(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 log = logging.getLogger(__name__)
@@ -21,116 +25,238 @@ log = logging.getLogger(__name__)
 def weighted_mean(d: List[Tuple[float, float]]) -> float:
     return(sum(w*v for w,v in d)/sum(w for w,_ in d))
 
-def emit_station_stats(w, stationID: int, efficiencies: List[Tuple[int, float, float]], c: sqlite3.Cursor, items: Dict[int, ItemSummary], dump_detail_for: int):
+def station_record(stationID: int, efficiencies: List[Tuple[int, float, float]], station_info: Optional[lib.StationInfo], items: Dict[int, ItemSummary], oinfo: lib.OrdersetInfo) -> EfficiencyRecord:
     coverage = len(efficiencies) / len(items)
+    if len(efficiencies)>0:
+        mean_efficiency = weighted_mean([(w,e) for i, w, e in efficiencies])
+        inefficiency = round((mean_efficiency-1)*100, 1)
+    else:
+        inefficiency = None
+    if station_info is None:
+        log.info("Could not find station {}".format(stationID))
+    return EfficiencyRecord(StationID=stationID, Station=station_info.Name if station_info is not None else None,
+                            CoveragePercent=round(coverage*100, 1), InefficiencyPercent=inefficiency,
+                            Orderset=oinfo.Orderset, Date=oinfo.Date.date().isoformat())
+
+def sort_records(records: List[EfficiencyRecord]):
+    """Best covered stations first."""
+    records.sort(key=lambda r: r.CoveragePercent, reverse=True)
+
+class DetailCollector():
+    """Keeps the per-item efficiencies of the given stations, and of the top_k
+    stations by coverage, while going through all stations once."""
+
+    def __init__(self, stations: Iterable[int] = (), top_k: int = 0):
+        self._stations = set(stations)
+        self._top_k = top_k
+        self._selected: Dict[int, List[Tuple[int, float, float]]] = {}
+        # Min-heap of (coverage, -station) for the best top_k stations so far;
+        # ties on coverage go to the lower station ID, as in sort_records.
+        self._top: List[Tuple[int, int]] = []
+        self._top_efficiencies: Dict[int, List[Tuple[int, float, float]]] = {}
 
-    if dump_detail_for == stationID:
-        log.info("Dumping for station {}".format(stationID))
-        with open("dump.csv", "wt") as f:
-            d = csv.writer(f)
-            d.writerow(['TypeID', 'Name', 'Value Traded (universal)', 'Efficiency'])
-            for i, v, e in efficiencies:
-                ti = lib.get_type_info(c, i)
-                d.writerow([i, ti.Name, v, e])
+    def add(self, stationID: int, efficiencies: List[Tuple[int, float, float]]):
+        if stationID in self._stations:
+            self._selected[stationID] = efficiencies
+        if self._top_k <= 0: return
+        key = (len(efficiencies), -stationID)
+        if len(self._top) < self._top_k:
+            heapq.heappush(self._top, key)
+        elif key > self._top[0]:
+            _, evicted = heapq.heapreplace(self._top, key)
+            del self._top_efficiencies[-evicted]
+        else:
+            return
+        self._top_efficiencies[stationID] = efficiencies
 
+    def details(self) -> List[Tuple[int, List[Tuple[int, float, float]]]]:
+        """(station, efficiencies) for all collected stations, best covered first."""
+        missing = self._stations - self._selected.keys()
+        if missing:
+            log.info("No orders at stations {}".format(sorted(missing)))
+        collected = dict(self._top_efficiencies)
+        collected.update(self._selected)
+        return sorted(collected.items(), key=lambda se: (-len(se[1]), se[0]))
+
+def write_detail(fh: IO, details: List[Tuple[int, List[Tuple[int, float, float]]]], items: Dict[int, ItemSummary], stations: Dict[int, lib.StationInfo]):
+    d = csv.writer(fh)
+    d.writerow(['StationID', 'Station Name', 'TypeID', 'Name', 'Value Traded (universal)', 'Efficiency'])
+    for s, efficiencies in details:
+        station_name = stations[s].Name if s in stations else '-'
+        for i, v, e in efficiencies:
+            d.writerow([s, station_name, i, items[i].Name, v, e])
+
+
+def emit_group_stats(w, stationID: int, station_info: Optional[lib.StationInfo], efficiencies: List[Tuple[int, float, float]], subtrees: market_groups.SubtreeIndex, basket_counts: List[int]):
+    available = subtrees.count(i for i, _, _ in efficiencies)
+    weights = subtrees.rollup((i, v) for i, v, _ in efficiencies)
+    weighted_efficiencies = subtrees.rollup((i, v*e) for i, v, e in efficiencies)
+
+    for g, path in enumerate(subtrees.paths):
+        if basket_counts[g] == 0: continue
+        coverage = available[g] / basket_counts[g]
+        if weights[g] > 0:
+            eff_str = '{:.1f}'.format((weighted_efficiencies[g]/weights[g]-1)*100)
+        else:
+            eff_str = '-'
+        w.writerow([str(stationID), station_info.Name if station_info is not None else "-", path, '{:.1f}'.format(coverage*100), eff_str])
+
+def emit_area_stats(w, areaID: int, name: Optional[str], num_stations: int, efficiencies: List[Tuple[int, float, float]], items: Dict[int, ItemSummary], oinfo: lib.OrdersetInfo):
+    coverage = len(efficiencies) / len(items)
     if len(efficiencies)>0:
         mean_efficiency = weighted_mean([(w,e) for i, w, e in efficiencies])
         eff_str = '{:.1f}'.format((mean_efficiency-1)*100)
     else:
         eff_str = '-'
-    station_info = lib.get_station_info(c, stationID)
-    if station_info is None:
-        log.info("Could not find station {}".format(stationID))
-    w.writerow([str(stationID), station_info.Name if station_info is not None else "-", '{:.1f}'.format(coverage*100), eff_str])
+    w.writerow([str(areaID), name if name is not None else "-", num_stations, '{:.1f}'.format(coverage*100), eff_str, oinfo.Orderset, oinfo.Date.date().isoformat()])
 
+# Jita 4-4, Dodixie FNAP, Amarr EFA, Hek BCF
+HUB_STATIONS = (60003760, 60011866, 60008494, 60005686)
 
-def get_station_stats(ofile: str, items: Dict[int, ItemSummary], best_price: Dict[int, float], oinfo: lib.OrdersetInfo) -> Iterator[Tuple[int, List[Tuple[int, float, float]]]]:
-    current_station = None
-    current_type = None
-    current_station_price_efficiencies = None
-    current_type_best_sell = None
+def read_station_sell_prices(ofile: str, items: Dict[int, ItemSummary], oinfo: lib.OrdersetInfo, station_regions: Optional[Dict[int, int]] = None) -> Tuple[Dict[int, Dict[int, float]], Dict[int, float]]:
+    """Single pass over an orderset, in any order.
+
+    Returns the lowest sell price of each basket item per station (with an
+    entry for every station that has any orders), and the lowest sell price
+    of each basket item across the trade hubs. Fills in the region of every
+    station into station_regions, if given."""
+    stations = set()
+    station_sells = {}
     log.info("orderset file '{}'".format(ofile))
-    for x in lib.read_orderset_filter(ofile, oinfo):
-
-        if current_type is not None and current_type != x.TypeID:
-            if current_type_best_sell is not None:
-                all_best_sell = best_price.get(current_type)
-                if all_best_sell is None:
-                    log.info("no best sell price for common item? {}".format(current_type))
-                    efficiency = 1.0
-                else:
-                    efficiency = current_type_best_sell / all_best_sell
-
-                # Treat stupidly overpriced stuff as unavailable.
-                if efficiency <= 100:
-                    current_station_price_efficiencies.append((current_type, items[current_type].ValueTraded, efficiency))
-            current_type_best_sell = None
-            current_type = None
-
-        if current_station is None or current_station != x.StationID:
-            if current_station is not None:
-                yield(current_station, current_station_price_efficiencies)
-            current_station_price_efficiencies = []
-            current_station = x.StationID
-
-        if x.TypeID in items and not x.IsBuy:
-            current_type = x.TypeID
-            if current_type_best_sell is None or current_type_best_sell > x.Price:
-                current_type_best_sell = x.Price
-    # read_orderset() always pads the end with one bogus order line with a dummy item & station,
-    # so we never have to emit the final item or station returned.
-
-def output(csv_fh: IO, oinfo: lib.OrdersetInfo):
-    r = csv.DictReader(csv_fh)
-    fieldnames = r.fieldnames
-    fieldnames.extend(['Orderset', 'Date'])
-    w = csv.DictWriter(sys.stdout, fieldnames)
-    w.writeheader()
-    for row in r:
-        # Add global variables now to every row.
-        row['Orderset'] = oinfo.Orderset
-        row['Date'] = oinfo.Date.date().isoformat()
-        w.writerow(row)
-
-def get_best_sell_prices(orderset: str) -> Dict[int, float]:
+    for type_id, station_id, price, _ in lib.read_sell_orders(ofile, items, oinfo, stations, station_regions):
+        sells = station_sells.setdefault(station_id, {})
+        if price < sells.get(type_id, math.inf):
+            sells[type_id] = price
+    for station_id in stations:
+        station_sells.setdefault(station_id, {})
+
     best_price = {}
-    log.info('Reading buy & sell prices')
-    for o, _ in lib.read_orderset(orderset):
-        # Jita 4-4, Dodixie FNAP, Amarr EFA, Hek BCF
-        if o.StationID not in (60003760, 60011866, 60008494, 60005686): continue
-        if o.IsBuy: continue
-        if o.TypeID not in best_price or best_price[o.TypeID] > o.Price:
-            best_price[o.TypeID] = o.Price
-    log.info('...read buy & sell prices')
-    return best_price
+    for station_id in HUB_STATIONS:
+        for type_id, price in station_sells.get(station_id, {}).items():
+            if price < best_price.get(type_id, math.inf):
+                best_price[type_id] = price
+    return station_sells, best_price
+
+def area_sell_prices(station_sells: Dict[int, Dict[int, float]], station_area: Dict[int, int]) -> Tuple[Dict[int, Dict[int, float]], Dict[int, int]]:
+    """Rolls per-station lowest sell prices up into areas (systems or regions):
+    the best price available anywhere in the area. Also returns the number of
+    stations in each area. Stations with no known area are left out."""
+    sells = {}
+    num_stations = {}
+    for station_id, prices in station_sells.items():
+        area = station_area.get(station_id)
+        if area is None: continue
+        num_stations[area] = num_stations.get(area, 0) + 1
+        area_prices = sells.setdefault(area, {})
+        for type_id, price in prices.items():
+            if price < area_prices.get(type_id, math.inf):
+                area_prices[type_id] = price
+    return sells, num_stations
+
+def station_efficiencies(station_sells: Dict[int, Dict[int, float]], items: Dict[int, ItemSummary], best_price: Dict[int, float]) -> Iterator[Tuple[int, List[Tuple[int, float, float]]]]:
+    missing_best = set()
+    for station_id in sorted(station_sells):
+        efficiencies = []
+        for type_id, sell in sorted(station_sells[station_id].items()):
+            all_best_sell = best_price.get(type_id)
+            if all_best_sell is None:
+                missing_best.add(type_id)
+                efficiency = 1.0
+            else:
+                efficiency = sell / all_best_sell
+
+            # Treat stupidly overpriced stuff as unavailable.
+            if efficiency <= 100:
+                efficiencies.append((type_id, items[type_id].ValueTraded, efficiency))
+        yield station_id, efficiencies
+    if missing_best:
+        log.info("no best sell price for common items? {}".format(sorted(missing_best)))
+
+def get_station_stats(ofile: str, items: Dict[int, ItemSummary], best_price: Dict[int, float], oinfo: lib.OrdersetInfo) -> Iterator[Tuple[int, List[Tuple[int, float, float]]]]:
+    station_sells, _ = read_station_sell_prices(ofile, items, oinfo)
+    return station_efficiencies(station_sells, items, best_price)
+
+def orderset_station_stats(ofile: str, items: Dict[int, ItemSummary], c: sqlite3.Cursor) -> Tuple[lib.OrdersetInfo, List[EfficiencyRecord]]:
+    """The market efficiency records for one orderset, best covered station first."""
+    oinfo = lib.OrdersetInfo(None, None)
+    station_sells, best_price = read_station_sell_prices(ofile, items, oinfo)
+    stations = lib.get_all_station_info(c)
+    records = [station_record(s, e, stations.get(s), items, oinfo) for s, e in station_efficiencies(station_sells, items, best_price)]
+    sort_records(records)
+    return oinfo, records
 
 def main():
     arg_parser = ArgumentParser(prog='calc-market-quality.py')
     arg_parser.add_argument('--orderset', type=str)
-    arg_parser.add_argument('--dump-detail-for', type=int)
+    arg_parser.add_argument('--dump-detail-for', nargs='*', type=int, default=[], help='stations to write per-item efficiencies for')
+    arg_parser.add_argument('--dump-detail-top', type=int, default=0, help='also write per-item efficiencies for this many of the best covered stations')
+    arg_parser.add_argument('--dump-detail-output', type=str, default='dump.csv')
     arg_parser.add_argument('--limit-top-traded-items', type=int)
     arg_parser.add_argument('--top-traded-items', type=str)
+    top_market_items.add_basket_args(arg_parser)
+    market_efficiency_store.add_output_args(arg_parser)
+    arg_parser.add_argument('--rollup-groups', nargs='*', type=str, help='market group paths to also report coverage and inefficiency for, per station')
+    arg_parser.add_argument('--rollup-output', type=str, default='rollup.csv')
+    arg_parser.add_argument('--system-output', type=str, help='also write coverage and inefficiency of the best prices available in each solar system')
+    arg_parser.add_argument('--region-output', type=str, help='also write coverage and inefficiency of the best prices available in each region')
     args = arg_parser.parse_args()
 
     conn = sqlite3.connect("sde.db")
     c = conn.cursor()
 
-    with open(args.top_traded_items,"rt") as tt_fh:
-        items = {s.ID: s for s in trade_lib.get_most_traded_items(tt_fh, args.limit_top_traded_items)}
-        log.info("Basket of items loaded, {} items".format(len(items)))
+    items = {s.ID: s for s in top_market_items.load_basket(args, conn, args.limit_top_traded_items)}
+    log.info("Basket of items loaded, {} items".format(len(items)))
 
-    best_price = get_best_sell_prices(args.orderset)
-
-    temp_station_stats = tempfile.TemporaryFile(mode='w+t')
-    w = csv.writer(temp_station_stats)
-    w.writerow(['StationID', 'Station Name', 'Coverage %', 'Inefficiency %'])
+    rollup_w = None
+    if args.rollup_groups:
+        subtrees = market_groups.SubtreeIndex(c, args.rollup_groups)
+        basket_counts = subtrees.count(items.keys())
+        rollup_fh = open(args.rollup_output, "wt")
+        rollup_w = csv.writer(rollup_fh)
+        rollup_w.writerow(['StationID', 'Station Name', 'Market Group', 'Coverage %', 'Inefficiency %'])
 
     oinfo = lib.OrdersetInfo(None, None)
-    for s, e in get_station_stats(args.orderset, items, best_price, oinfo):
-        emit_station_stats(w, s, e, c, items, args.dump_detail_for)
+    station_regions = {}
+    station_sells, best_price = read_station_sell_prices(args.orderset, items, oinfo, station_regions)
+    stations = lib.get_all_station_info(c)
+    records = []
+    detail = DetailCollector(args.dump_detail_for, args.dump_detail_top)
+    for s, e in station_efficiencies(station_sells, items, best_price):
+        records.append(station_record(s, e, stations.get(s), items, oinfo))
+        detail.add(s, e)
+        if rollup_w is not None:
+            emit_group_stats(rollup_w, s, stations.get(s), e, subtrees, basket_counts)
+    if rollup_w is not None:
+        rollup_fh.close()
+    sort_records(records)
+    market_efficiency_store.output(args, records)
+
+    if args.dump_detail_for or args.dump_detail_top > 0:
+        details = detail.details()
+        log.info("Dumping detail for {} stations to {}".format(len(details), args.dump_detail_output))
+        with open(args.dump_detail_output, "wt") as fh:
+            write_detail(fh, details, items, stations)
+
+    if args.system_output:
+        # Player structures aren't in the SDE, so we don't know their system.
+        station_systems = {i: si.SystemID for i, si in stations.items()}
+        unknown = sum(1 for s in station_sells if s not in station_systems)
+        log.info("{} stations with no known system left out of system rollup".format(unknown))
+        sells, num_stations = area_sell_prices(station_sells, station_systems)
+        with open(args.system_output, "wt") as fh:
+            sw = csv.writer(fh)
+            sw.writerow(['SystemID', 'System Name', 'Stations', 'Coverage %', 'Inefficiency %', 'Orderset', 'Date'])
+            for system_id, e in station_efficiencies(sells, items, best_price):
+                system_info = lib.get_system_info(c, system_id)
+                emit_area_stats(sw, system_id, system_info[0] if system_info is not None else None, num_stations[system_id], e, items, oinfo)
 
-    temp_station_stats.seek(0)
-    output(temp_station_stats, oinfo)
+    if args.region_output:
+        sells, num_stations = area_sell_prices(station_sells, station_regions)
+        with open(args.region_output, "wt") as fh:
+            rw = csv.writer(fh)
+            rw.writerow(['RegionID', 'Region Name', 'Stations', 'Coverage %', 'Inefficiency %', 'Orderset', 'Date'])
+            for region_id, e in station_efficiencies(sells, items, best_price):
+                emit_area_stats(rw, region_id, lib.get_region_name(c, region_id), num_stations[region_id], e, items, oinfo)
 
 if __name__ == "__main__":
     main()
@@ -28,7 +28,100 @@ class TestGetStationStats(unittest.TestCase):
         self.assertEqual(1, len(e))
         self.assertEqual((12608, 1000, 1.0427142857142857), e[0])
 
-class TestEmitStationStats(unittest.TestCase):
+class TestOrdersetStationStats(unittest.TestCase):
+    def testRows(self):
+        conn = sqlite3.connect(":memory:")
+        c = conn.cursor()
+        c.execute("""
+        CREATE TABLE Stations(
+          ID       INT PRIMARY KEY NOT NULL,
+          Name     TEXT NOT NULL,
+          SystemID INT NOT NULL,
+          RegionID INT NOT NULL
+        );""")
+        c.execute("""INSERT INTO Stations VALUES(?,?,?,?);""", [60003760, "Jita IV - Moon 4 - Caldari Navy Assembly Plant", 30000142, 10000002])
+        items = {
+            12608: calc.ItemSummary(ID=12608, Name="A", GroupID=1, CategoryID=1, ValueTraded=1000, MarketGroup='Foo>Bar'),
+            47900: DUMMY_ITEM,
+        }
+        oinfo, rows = calc.orderset_station_stats("testdata/orderset4.csv.gz", items, c)
+        self.assertEqual(128142, oinfo.Orderset)
+        self.assertEqual([
+            calc.EfficiencyRecord(60003760, 'Jita IV - Moon 4 - Caldari Navy Assembly Plant', 50.0, 0.0, 128142, '2023-12-23'),
+            calc.EfficiencyRecord(60008494, None, 50.0, 14.5, 128142, '2023-12-23'),
+        ], rows)
+
+class TestStationRecord(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        c = self.conn.cursor()
+        c.execute("""
+        CREATE TABLE Stations(
+          ID       INT PRIMARY KEY NOT NULL,
+          Name     TEXT NOT NULL,
+          SystemID INT NOT NULL,
+          RegionID INT NOT NULL
+        );""")
+        c.execute("""INSERT INTO Stations VALUES(?,?,?,?);""", [1, "Amo - Minmatar Fleet Market", 123, 100])
+
+    def testWriteRecord(self):
+        f = io.StringIO()
+        oinfo = lib.OrdersetInfo(1234, calc.datetime.datetime(2024, 1, 2, 3, 4))
+        r = calc.station_record(1, [(11, 5, 1.1), (12, 1, 1.3), (13, 2, 1.2)], lib.get_station_info(self.conn.cursor(), 1), {11: DUMMY_ITEM, 12: DUMMY_ITEM, 13: DUMMY_ITEM, 14: DUMMY_ITEM}, oinfo)
+        calc.market_efficiency_store.write_csv(f, [r])
+        f.seek(0)
+        self.assertEqual(f.read(), """StationID,Station Name,Coverage %,Inefficiency %,Orderset,Date\r
+1,Amo - Minmatar Fleet Market,75.0,15.0,1234,2024-01-02\r
+""")
+
+    def testNoEfficiencies(self):
+        oinfo = lib.OrdersetInfo(1234, calc.datetime.datetime(2024, 1, 2, 3, 4))
+        r = calc.station_record(2, [], None, {11: DUMMY_ITEM}, oinfo)
+        self.assertEqual(calc.EfficiencyRecord(2, None, 0.0, None, 1234, '2024-01-02'), r)
+
+    def testSortRecords(self):
+        records = [calc.EfficiencyRecord(i, None, c, None, 1, '') for i, c in [(1, 50.0), (2, 75.0), (3, 50.0), (4, 100.0)]]
+        calc.sort_records(records)
+        self.assertEqual([4, 2, 1, 3], [r.StationID for r in records])
+
+class TestDetailCollector(unittest.TestCase):
+    def setUp(self):
+        self.efficiencies = {
+            1: [(11, 5, 1.1)],
+            2: [(11, 5, 1.0), (12, 1, 1.5)],
+            3: [(11, 5, 1.2), (12, 1, 1.0)],
+            4: [],
+            5: [(11, 5, 1.3), (12, 1, 1.1), (13, 2, 1.0)],
+        }
+
+    def collect(self, stations, top_k):
+        d = calc.DetailCollector(stations, top_k)
+        for s, e in self.efficiencies.items():
+            d.add(s, e)
+        return [s for s, _ in d.details()]
+
+    def testStations(self):
+        self.assertEqual([3, 1, 4], self.collect([4, 1, 3, 6], 0))
+
+    def testTopK(self):
+        self.assertEqual([5, 2], self.collect([], 2))
+        self.assertEqual([5], self.collect([], 1))
+
+    def testStationsAndTopK(self):
+        self.assertEqual([5, 2, 3, 4], self.collect([4, 3], 2))
+
+    def testWriteDetail(self):
+        items = {11: calc.ItemSummary(11, "Eleven", 1, 1, "", 5), 12: calc.ItemSummary(12, "Twelve", 1, 1, "", 1)}
+        stations = {2: lib.StationInfo(2, "Two", 1, 1)}
+        f = io.StringIO()
+        calc.write_detail(f, [(2, self.efficiencies[2]), (1, self.efficiencies[1])], items, stations)
+        self.assertEqual(f.getvalue(), """StationID,Station Name,TypeID,Name,Value Traded (universal),Efficiency\r
+2,Two,11,Eleven,5,1.0\r
+2,Two,12,Twelve,1,1.5\r
+1,-,11,Eleven,5,1.1\r
+""")
+
+class TestEmitGroupStats(unittest.TestCase):
     def setUp(self):
         self.conn = sqlite3.connect(":memory:")
         c = self.conn.cursor()
@@ -40,13 +133,65 @@ class TestEmitStationStats(unittest.TestCase):
           RegionID INT NOT NULL
         );""")
         c.execute("""INSERT INTO Stations VALUES(?,?,?,?);""", [1, "Amo - Minmatar Fleet Market", 123, 100])
+        c.execute("""
+        CREATE TABLE Types(
+          ID      INT PRIMARY KEY NOT NULL,
+          MarketGroupID INT
+        );""")
+        c.execute("""
+        CREATE TABLE MarketGroups(
+          ID      INT PRIMARY KEY NOT NULL,
+          Path    TEXT NOT NULL
+        );""")
+        c.execute("""
+        CREATE TABLE MarketGroupTree(
+          AncestorID   INT NOT NULL,
+          DescendantID INT NOT NULL,
+          Depth        INT NOT NULL
+        );""")
+        c.executemany("""INSERT INTO Types VALUES(?,?)""", [(11, 2), (12, 2), (13, 1), (14, 3)])
+        c.executemany("""INSERT INTO MarketGroups VALUES(?,?)""", [(1, "A"), (2, "A>B"), (3, "C")])
+        c.executemany("""INSERT INTO MarketGroupTree VALUES(?,?,?)""", [(1, 1, 0), (2, 2, 0), (1, 2, 1), (3, 3, 0)])
+
+    def testWriteRecords(self):
+        subtrees = calc.market_groups.SubtreeIndex(self.conn.cursor(), ["A", "A>B", "C"])
+        f = io.StringIO()
+        w = csv.writer(f)
+        calc.emit_group_stats(w, 1, calc.lib.get_station_info(self.conn.cursor(), 1), [(11, 5, 1.1), (12, 1, 1.3), (13, 2, 1.2)], subtrees, subtrees.count([11, 12, 13, 14]))
+        f.seek(0)
+        self.assertEqual(f.read(), """1,Amo - Minmatar Fleet Market,A,100.0,15.0\r
+1,Amo - Minmatar Fleet Market,A>B,100.0,13.3\r
+1,Amo - Minmatar Fleet Market,C,0.0,-\r
+""")
+
+class TestAreaSellPrices(unittest.TestCase):
+    def testBestPriceInArea(self):
+        station_sells = {
+            1: {11: 10.0, 12: 5.0},
+            2: {11: 8.0},
+            3: {},
+            4: {11: 1.0},  # unknown area
+        }
+        sells, num_stations = calc.area_sell_prices(station_sells, {1: 100, 2: 100, 3: 200})
+        self.assertEqual({100: {11: 8.0, 12: 5.0}, 200: {}}, sells)
+        self.assertEqual({100: 2, 200: 1}, num_stations)
+
+    def testRegionsFromOrderset(self):
+        items = {12608: DUMMY_ITEM}
+        station_regions = {}
+        calc.read_station_sell_prices("testdata/orderset4.csv.gz", items, lib.OrdersetInfo(None, None), station_regions)
+        self.assertEqual(10000002, station_regions[60003760])
 
+class TestEmitAreaStats(unittest.TestCase):
     def testWriteRecord(self):
         f = io.StringIO()
         w = csv.writer(f)
-        calc.emit_station_stats(w, 1, [(11, 5, 1.1), (12, 1, 1.3), (13, 2, 1.2)], self.conn.cursor(), {11: DUMMY_ITEM, 12: DUMMY_ITEM, 13: DUMMY_ITEM, 14: DUMMY_ITEM}, None)
+        oinfo = lib.OrdersetInfo(1234, calc.datetime.datetime(2024, 1, 2, 3, 4))
+        calc.emit_area_stats(w, 100, "The Forge", 3, [(11, 5, 1.1), (12, 1, 1.3), (13, 2, 1.2)], {11: DUMMY_ITEM, 12: DUMMY_ITEM, 13: DUMMY_ITEM, 14: DUMMY_ITEM}, oinfo)
+        calc.emit_area_stats(w, 200, None, 1, [], {11: DUMMY_ITEM}, oinfo)
         f.seek(0)
-        self.assertEqual(f.read(), """1,Amo - Minmatar Fleet Market,75.0,15.0\r
+        self.assertEqual(f.read(), """100,The Forge,3,75.0,15.0,1234,2024-01-02\r
+200,-,1,0.0,-,1234,2024-01-02\r
 """)
 
 unittest.main()
@@ -64,14 +64,15 @@ def main():
 
   w = csv.writer(sys.stdout)
   # {'is_singleton': False, 'item_id': 1043802222344, 'location_flag': 'Hangar', 'location_id': 60005686, 'location_type': 'station', 'quantity': 2, 'type_id': 37457}
-  w.writerow(['TypeID', 'Singleton', 'Quantity', 'LocationFlag', 'LocationType', 'LocationID'])
+  # ItemID lets items in containers (LocationType 'item') be traced to their station.
+  w.writerow(['TypeID', 'Singleton', 'Quantity', 'LocationFlag', 'LocationType', 'LocationID', 'ItemID'])
 
   target = 'characters/{}'.format(args.character)
   if args.corporation is not None:
       target = 'corporations/{}'.format(args.corporation)
 
   for r in get_assets(config, target, token):
-      w.writerow([r['type_id'], 'True' if r['is_singleton'] else 'False',  r['quantity'], r['location_flag'], r['location_type'], r['location_id']])
+      w.writerow([r['type_id'], 'True' if r['is_singleton'] else 'False',  r['quantity'], r['location_flag'], r['location_type'], r['location_id'], r['item_id']])
 
 
 if __name__ == "__main__":
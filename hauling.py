@@ -0,0 +1,131 @@
+#!/usr/bin/python3
+
+from argparse import ArgumentParser
+from collections import namedtuple
+import csv
+import logging
+import sqlite3
+import sys
+from typing import Dict, IO, Iterator, List, Optional, Tuple
+
+import lib
+import market_filler
+import order_book
+
+log = logging.getLogger(__name__)
+
+# Units of an item to bring from one station, with the m3 and expected profit per unit.
+Shipment = namedtuple('Shipment', ['TypeID', 'Name', 'FromStationID', 'Quantity', 'UnitVolume', 'UnitProfit'])
+
+def read_plan(fh: IO) -> Iterator[Tuple[int, str, int, int, float, float]]:
+    """The purchases in a market_filler plan, as (type, name, source station,
+    quantity, max buy price, sell price), one per source station."""
+    r = csv.DictReader(fh)
+    for row in r:
+        if int(row['Buy Quantity']) == 0: continue
+        stations = row['From StationIDs'].split(',')
+        quantities = row['From Quantities'].split(',')
+        for station, quantity in zip(stations, quantities):
+            yield (int(row['TypeID']), row['Item Name'], int(station), int(quantity),
+                   float(row['Max Buy']), float(row['My Sell Price']))
+
+def get_shipments(purchases: Iterator[Tuple[int, str, int, int, float, float]], volumes: Dict[int, float], from_stations: Dict[int, dict]) -> List[Shipment]:
+    """Purchases worth hauling: those with a known volume that make a profit
+    once the hauling costs of their source station are paid."""
+    res = []
+    for type_id, name, station, quantity, buy, sell in purchases:
+        volume = volumes.get(type_id)
+        if volume is None:
+            log.warning("no volume for {}, not hauling it".format(name))
+            continue
+        costs = from_stations.get(station, {})
+        landed = order_book.landed_price(buy, costs.get('isk_cost', 0), costs.get('vol_cost', 0) * volume)
+        if sell <= landed:
+            log.info("{} from {} makes no profit after hauling ({:.2f} vs {:.2f})".format(name, station, sell, landed))
+            continue
+        res.append(Shipment(type_id, name, station, quantity, volume, sell - landed))
+    return res
+
+def _load(s: Shipment, capacity: float) -> int:
+    if s.UnitVolume <= 0:
+        return s.Quantity
+    return min(s.Quantity, int(capacity // s.UnitVolume))
+
+def fill_trip(candidates: List[Shipment], capacity: float) -> List[Shipment]:
+    """Picks what to carry in one trip of the given capacity (m3) to make the
+    most profit.
+
+    This is a bounded knapsack where each item is available in many units, so
+    loading by profit per m3 comes within the volume of one unit of the best
+    possible load. As with the usual greedy knapsack bound, the load is
+    compared with filling the hold with the single most profitable item, which
+    guards against large items being crowded out."""
+    load = []
+    free = capacity
+    for s in sorted(candidates, key=lambda s: s.UnitProfit / s.UnitVolume if s.UnitVolume > 0 else float('inf'), reverse=True):
+        n = _load(s, free)
+        if n <= 0: continue
+        load.append(s._replace(Quantity=n))
+        free -= n * s.UnitVolume
+
+    best_single = max(candidates, key=lambda s: _load(s, capacity) * s.UnitProfit, default=None)
+    if best_single is not None and _load(best_single, capacity) * best_single.UnitProfit > trip_profit(load):
+        return [best_single._replace(Quantity=_load(best_single, capacity))]
+    return load
+
+def trip_profit(load: List[Shipment]) -> float:
+    return sum(s.Quantity * s.UnitProfit for s in load)
+
+def trip_volume(load: List[Shipment]) -> float:
+    return sum(s.Quantity * s.UnitVolume for s in load)
+
+def plan_trips(candidates: List[Shipment], capacity: float, max_trips: Optional[int] = None) -> List[List[Shipment]]:
+    """Fills trips one after another from what is left, until everything is
+    carried or max_trips is reached."""
+    trips = []
+    remaining = {(s.TypeID, s.FromStationID): s for s in candidates}
+    while remaining and (max_trips is None or len(trips) < max_trips):
+        load = fill_trip(list(remaining.values()), capacity)
+        if not load:
+            log.warning("{} items don't fit in a hold of {} m3".format(len(remaining), capacity))
+            break
+        trips.append(load)
+        for s in load:
+            key = (s.TypeID, s.FromStationID)
+            left = remaining[key].Quantity - s.Quantity
+            if left > 0:
+                remaining[key] = remaining[key]._replace(Quantity=left)
+            else:
+                del remaining[key]
+    return trips
+
+def main():
+    logging.basicConfig(format='%(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    arg_parser = ArgumentParser(prog='hauling.py')
+    arg_parser.add_argument('--plan', type=str, required=True, help='output of market_filler.py')
+    arg_parser.add_argument('--sources', type=str, required=True)
+    arg_parser.add_argument('--station', type=str, required=True, help='id in the sources file that the plan is for')
+    arg_parser.add_argument('--capacity', type=float, required=True, help='m3 per trip, unless the source sets its own capacity')
+    arg_parser.add_argument('--trips', type=int, help='most trips to plan per source station')
+    args = arg_parser.parse_args()
+
+    sde_conn = sqlite3.connect("sde.db")
+    _, from_stations = market_filler.get_sources(sde_conn, args.station, args.sources)
+
+    with open(args.plan, "rt") as fh:
+        purchases = list(read_plan(fh))
+    volumes = lib.get_type_volumes(sde_conn.cursor(), set(p[0] for p in purchases))
+    shipments = get_shipments(purchases, volumes, from_stations)
+
+    w = csv.writer(sys.stdout)
+    w.writerow(['FromStationID', 'From Station Name', 'Trip', 'TypeID', 'Item Name', 'Quantity', 'Volume m3', 'Profit'])
+    for station in sorted(set(s.FromStationID for s in shipments)):
+        station_info = lib.get_station_info(sde_conn, station)
+        trips = plan_trips([s for s in shipments if s.FromStationID == station], from_stations.get(station, {}).get('capacity') or args.capacity, args.trips)
+        for n, load in enumerate(trips, 1):
+            log.info("{} trip {}: {:.0f} m3, profit {:.0f}".format(station_info.Name, n, trip_volume(load), trip_profit(load)))
+            for s in load:
+                w.writerow([station, station_info.Name, n, s.TypeID, s.Name, s.Quantity, '{:.2f}'.format(s.Quantity * s.UnitVolume), '{:.2f}'.format(s.Quantity * s.UnitProfit)])
+
+if __name__ == "__main__":
+    main()
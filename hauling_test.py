@@ -0,0 +1,61 @@
+import io
+import unittest
+
+import hauling
+
+def shipment(type_id, quantity, volume, profit, station=1):
+    return hauling.Shipment(type_id, "Item{}".format(type_id), station, quantity, volume, profit)
+
+class TestReadPlan(unittest.TestCase):
+    PLAN = """TypeID,Item Name,Buy Quantity,Max Buy,My Quantity,Sell Quantity,My Sell Price,Stock Quantity,From StationIDs,From Station Names,From Quantities,IndustryCost,Build Quantity,Adjust Order?,Notes
+1,A,30,10.00,0,30,13.00,30,"100,200","X,Y","20,10",,0,N,
+2,B,0,10.00,0,0,13.00,0,,-,-,,0,N,
+3,C,5,1.00,0,5,2.00,5,100,X,5,,0,N,
+"""
+
+    def testRead(self):
+        self.assertEqual([
+            (1, 'A', 100, 20, 10.0, 13.0),
+            (1, 'A', 200, 10, 10.0, 13.0),
+            (3, 'C', 100, 5, 1.0, 2.0),
+        ], list(hauling.read_plan(io.StringIO(self.PLAN))))
+
+class TestGetShipments(unittest.TestCase):
+    def testProfitAfterHauling(self):
+        purchases = [(1, 'A', 100, 20, 10.0, 13.0), (2, 'B', 100, 5, 10.0, 13.0), (3, 'C', 100, 5, 1.0, 2.0)]
+        s = hauling.get_shipments(purchases, {1: 2.0, 3: 1.0}, {100: {'isk_cost': 0.05, 'vol_cost': 1.0}})
+        # B has no volume, C costs more to haul than it makes.
+        self.assertEqual([1], [x.TypeID for x in s])
+        self.assertAlmostEqual(13.0 - 10.5 - 2.0, s[0].UnitProfit)
+
+class TestFillTrip(unittest.TestCase):
+    def testByDensity(self):
+        load = hauling.fill_trip([shipment(1, 100, 1.0, 1.0), shipment(2, 100, 1.0, 3.0), shipment(3, 10, 2.0, 5.0)], 50)
+        self.assertEqual([(2, 50)], [(s.TypeID, s.Quantity) for s in load])
+        load = hauling.fill_trip([shipment(1, 100, 1.0, 1.0), shipment(2, 30, 1.0, 3.0), shipment(3, 5, 2.0, 5.0)], 50)
+        self.assertEqual([(2, 30), (3, 5), (1, 10)], [(s.TypeID, s.Quantity) for s in load])
+
+    def testBestSingleItem(self):
+        # By density the small item goes first and leaves no room for the big one.
+        load = hauling.fill_trip([shipment(1, 1, 1.0, 2.0), shipment(2, 1, 10.0, 10.0)], 10)
+        self.assertEqual([(2, 1)], [(s.TypeID, s.Quantity) for s in load])
+
+    def testZeroVolume(self):
+        load = hauling.fill_trip([shipment(1, 100, 0.0, 1.0)], 1)
+        self.assertEqual([(1, 100)], [(s.TypeID, s.Quantity) for s in load])
+
+class TestPlanTrips(unittest.TestCase):
+    def testSeveralTrips(self):
+        trips = hauling.plan_trips([shipment(1, 100, 1.0, 1.0), shipment(2, 30, 1.0, 3.0)], 50)
+        self.assertEqual([[(2, 30), (1, 20)], [(1, 50)], [(1, 30)]], [[(s.TypeID, s.Quantity) for s in t] for t in trips])
+        self.assertEqual(110.0, hauling.trip_profit(trips[0]))
+        self.assertEqual(50.0, hauling.trip_volume(trips[0]))
+
+    def testMaxTrips(self):
+        trips = hauling.plan_trips([shipment(1, 100, 1.0, 1.0)], 50, 1)
+        self.assertEqual(1, len(trips))
+
+    def testTooBig(self):
+        self.assertEqual([], hauling.plan_trips([shipment(1, 1, 100.0, 1.0)], 50))
+
+unittest.main()
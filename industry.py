@@ -1,20 +1,22 @@
+from collections import defaultdict, deque, namedtuple
+from dataclasses import dataclass
 import datetime
 import logging
 import math
 import sqlite3
-from typing import Dict, Optional
+from typing import Dict, Iterable, List, Optional, Tuple
 
 import lib
-from price_lib import get_pricing
+from price_lib import get_fair_prices, get_pricing
 
 log = logging.getLogger(__name__)
 
 def _get_buildable_items(sde_conn: sqlite3.Connection, industry_conn: sqlite3.Connection, exclude_industry: str):
-    exclude = set()
     with open(exclude_industry, "rt") as f:
-        for line in f:
-            item = lib.get_type_info_byname(sde_conn, line.rstrip())
-            exclude.add(item.ID)
+        excluded, unknown = lib.get_type_info_bynames(sde_conn, (line.rstrip() for line in f if line.strip()))
+    for name in unknown:
+        log.warning("unrecognised excluded item {}".format(name))
+    exclude = set(item.ID for item in excluded.values())
 
     res = {}
     r = industry_conn.execute("""
@@ -25,47 +27,129 @@ def _get_buildable_items(sde_conn: sqlite3.Connection, industry_conn: sqlite3.Co
         item = lib.get_type_info(sde_conn.cursor(), type_id)
         if item is None:
             log.warning("unrecognised item {}".format(x[1]))
+            continue
         if item.ID not in exclude:
             res[item.ID] = {'Name': item.Name, 'QuantityBuilt': x[2]}
     return res
 
-def _get_item_build_costs(items: Dict[int, dict], prices_conn: sqlite3.Connection, industry_conn: sqlite3.Connection, date):
-    # Greedy algorithm here - we do a pass over the data structure filling in
-    # costs for everything that we know all the input costs for. Then we
-    # repeat, filling in on later passes items that can now be built from items
-    # that we just filled in the costs for.
-    done = True
-    while True:
-        for bi in items.keys():
-            if 'BuildCost' in items[bi]: continue
-
-            inputs = industry_conn.execute("""
-                SELECT ID,QuantityRequired FROM BuildItemInputs WHERE OutputID=?;
-                """, [bi])
-            build_cost = 0
-            for i in inputs:
-                price = None
-                if i[0] in items:
-                  if 'BuildCost' in items[i[0]]:
-                    price = items[i[0]]['BuildCost']
-                  else:
-                    done = False
-                    break
-                else:
-                  p = get_pricing(prices_conn, i[0], date)
-                  if p.fair_price is None:
-                    input_type = lib.get_type_info(sde_conn.cursor(), i[0])
-                    log.warning("No fair price for {}: {} {}".format(input_type.Name, i[0], date))
-                    break
-                  price = p.fair_price
-                build_cost += price * i[1]
+def read_bill_of_materials(industry_conn: sqlite3.Connection) -> Dict[int, List[Tuple[int, float]]]:
+    """Per buildable item, its inputs and the quantity of each needed for
+    one run (QuantityBuilt units)."""
+    bom = defaultdict(list)
+    for input_id, output_id, quantity in industry_conn.execute("""
+        SELECT ID,OutputID,QuantityRequired FROM BuildItemInputs;
+        """):
+        bom[output_id].append((input_id, quantity))
+    return dict(bom)
+
+def build_order(outputs: Iterable[int], bom: Dict[int, List[Tuple[int, float]]]) -> List[int]:
+    """The outputs ordered so that each comes after those of its inputs which
+    are outputs themselves (Kahn's algorithm). Raises RuntimeError if some
+    outputs are made, directly or not, from themselves."""
+    outputs = set(outputs)
+    # Per output, how many of its inputs are outputs not yet ordered.
+    pending = {}
+    used_by = defaultdict(list)
+    for o in outputs:
+        pending[o] = 0
+        for i, _ in bom.get(o, []):
+            if i in outputs:
+                pending[o] += 1
+                used_by[i].append(o)
+
+    ready = deque(sorted(o for o, n in pending.items() if n == 0))
+    order = []
+    while ready:
+        o = ready.popleft()
+        order.append(o)
+        for u in used_by[o]:
+            pending[u] -= 1
+            if pending[u] == 0:
+                ready.append(u)
+    if len(order) < len(outputs):
+        raise RuntimeError("cycle in the bill of materials, between or from {}".format(sorted(o for o, n in pending.items() if n > 0)))
+    return order
+
+# Whether to build or buy an item needed as an input, and what a unit costs that way.
+Choice = namedtuple('Choice', ['TypeID', 'Build', 'UnitCost'])
+# Quantity of an item to build or buy, what it costs, and when built the steps for its inputs.
+ProductionStep = namedtuple('ProductionStep', ['TypeID', 'Quantity', 'Build', 'Cost', 'Inputs'])
+
+@dataclass
+class BuildPlan:
+    """The cheapest way to make each buildable item, see plan_builds."""
+    bom: Dict[int, List[Tuple[int, float]]]
+    quantity_built: Dict[int, int]
+    prices: Dict[int, Optional[float]]
+    # Cost per unit of building each output, or None if some input can't be had.
+    build_costs: Dict[int, Optional[float]]
+    choices: Dict[int, Choice]
+
+    def unit_price(self, type_id: int) -> Optional[float]:
+        """Cost of a unit of type_id as an input, built or bought."""
+        c = self.choices.get(type_id)
+        return c.UnitCost if c is not None else self.prices.get(type_id)
+
+    def tree(self, type_id: int, quantity: float = 1) -> ProductionStep:
+        """The steps to build quantity units of an output, down to what is bought."""
+        inputs = []
+        for i, q in self.bom.get(type_id, []):
+            needed = q * quantity / self.quantity_built[type_id]
+            c = self.choices.get(i)
+            if c is not None and c.Build:
+                inputs.append(self.tree(i, needed))
             else:
-                logging.info('setting build cost for {}, currently {}'.format(bi, items.get(bi, None)))
-                items[bi]['BuildCost'] = build_cost / items[bi]['QuantityBuilt']
+                price = self.unit_price(i)
+                inputs.append(ProductionStep(i, needed, False, needed * price if price is not None else None, []))
+        cost = self.build_costs.get(type_id)
+        return ProductionStep(type_id, quantity, True, quantity * cost if cost is not None else None, inputs)
+
+def plan_builds(order: List[int], bom: Dict[int, List[Tuple[int, float]]], quantity_built: Dict[int, int], prices: Dict[int, Optional[float]]) -> BuildPlan:
+    """Costs each output in build order, getting each input the cheaper way:
+    bought at its price, or if it is an output too, built the cheapest way in
+    turn. An output with no price can only be built, and one that can't be
+    built either leaves whatever uses it without a cost.
 
-        if done:
-            return
-        done = True
+    Each input's cheapest cost is settled before anything made from it, so
+    it is worked out once however many outputs use it."""
+    build_costs = {}
+    choices = {}
+    for o in order:
+        cost = 0.0
+        for i, quantity in bom.get(o, []):
+            c = choices.get(i)
+            price = c.UnitCost if c is not None else prices.get(i)
+            if price is None:
+                cost = None
+                break
+            cost += price * quantity
+        build_costs[o] = cost / quantity_built[o] if cost is not None else None
+
+        market = prices.get(o)
+        if build_costs[o] is not None and (market is None or build_costs[o] < market):
+            choices[o] = Choice(o, True, build_costs[o])
+        elif market is not None:
+            choices[o] = Choice(o, False, market)
+    return BuildPlan(bom, quantity_built, prices, build_costs, choices)
+
+def read_build_plan(sde_conn: sqlite3.Connection, prices_conn: sqlite3.Connection, industry_conn: sqlite3.Connection, exclude_industry: str, date) -> BuildPlan:
+    items = _get_buildable_items(sde_conn, industry_conn, exclude_industry)
+    log.info("Loaded list of {} buildable items".format(len(items)))
+
+    # One query for the bill of materials and one for the prices of
+    # everything used, including the outputs that could be bought instead.
+    bom = read_bill_of_materials(industry_conn)
+    order = build_order(items.keys(), bom)
+    inputs = set(i for o in order for i, _ in bom.get(o, []))
+    prices = get_fair_prices(prices_conn, inputs | set(order), date)
+    for i in sorted(i for i in inputs if i not in items and prices[i] is None):
+        input_type = lib.get_type_info(sde_conn.cursor(), i)
+        log.warning("No fair price for {}: {} {}".format(input_type.Name if input_type is not None else '?', i, date))
+
+    plan = plan_builds(order, bom, {o: items[o]['QuantityBuilt'] for o in order}, prices)
+    log.info("Computed build costs for {} items, {} of them cheaper to build than buy".format(
+        sum(1 for c in plan.build_costs.values() if c is not None), sum(1 for c in plan.choices.values() if c.Build)))
+    return plan
 
 def get_reprocess_value(sde_conn: sqlite3.Connection, prices_conn: sqlite3.Connection, type_id: int, date: datetime.date) -> Optional[float]:
     item = lib.get_type_info(sde_conn.cursor(), type_id)
@@ -81,12 +165,47 @@ def get_reprocess_value(sde_conn: sqlite3.Connection, prices_conn: sqlite3.Conne
         reprocess_value += p.fair_price * math.floor(o[1] * 0.5)
     return reprocess_value/item.PortionSize if reprocess_value > 0.0 else None
 
-def read_items(sde_conn: sqlite3.Connection, prices_conn: sqlite3.Connection, industry_conn: sqlite3.Connection, exclude_industry: str, date) -> Dict[int, float]:
-    items = _get_buildable_items(sde_conn, industry_conn, exclude_industry)
-    log.info("Loaded list of {} buildable items".format(len(items)))
+def read_reprocess_yields(sde_conn: sqlite3.Connection, type_ids: Iterable[int]) -> Dict[int, List[Tuple[int, int]]]:
+    """Part of the reprocessing table as a sparse matrix: type -> [(output
+    type, quantity)], for those of type_ids which reprocess into anything."""
+    sde_conn.execute("""
+    CREATE TEMP TABLE IF NOT EXISTS ReprocessTypes(
+      TypeID INTEGER PRIMARY KEY NOT NULL
+    );""")
+    sde_conn.execute("""DELETE FROM temp.ReprocessTypes""")
+    sde_conn.executemany("""INSERT INTO temp.ReprocessTypes VALUES(?)""", [(i,) for i in set(type_ids)])
+    yields = defaultdict(list)
+    for type_id, output_id, quantity in sde_conn.execute("""
+        SELECT ID,OutputID,QuantityYielded FROM ReprocessItems
+        WHERE ID IN (SELECT TypeID FROM temp.ReprocessTypes);
+        """):
+        yields[type_id].append((output_id, quantity))
+    sde_conn.execute("""DELETE FROM temp.ReprocessTypes""")
+    return dict(yields)
 
-    _get_item_build_costs(items, prices_conn, industry_conn, date)
-    log.info("Computed build costs for {} items".format(len(items)))
+def get_reprocess_values(sde_conn: sqlite3.Connection, prices_conn: sqlite3.Connection, type_ids: Iterable[int], date: datetime.date) -> Dict[int, Optional[float]]:
+    """Same as get_reprocess_value, for many types, with one query for all prices."""
+    type_ids = set(type_ids)
+    yields = read_reprocess_yields(sde_conn, type_ids)
+    prices = get_fair_prices(prices_conn, set(o for y in yields.values() for o, _ in y), date)
+    portion_sizes = dict(sde_conn.execute("""
+        SELECT ID,PortionSize FROM Types WHERE ID IN ({});
+        """.format(",".join(str(int(i)) for i in yields))).fetchall())
 
-    return {x: items[x]['BuildCost'] for x in items if 'BuildCost' in items[x]}
+    res = {i: None for i in type_ids}
+    for type_id, outputs in yields.items():
+        reprocess_value = 0.0
+        for output_id, quantity in outputs:
+            if prices[output_id] is None:
+                reprocess_value = None
+                break
+            reprocess_value += prices[output_id] * math.floor(quantity * 0.5)
+        if reprocess_value:
+            res[type_id] = reprocess_value / portion_sizes[type_id]
+    return res
 
+def read_items(sde_conn: sqlite3.Connection, prices_conn: sqlite3.Connection, industry_conn: sqlite3.Connection, exclude_industry: str, date) -> Dict[int, float]:
+    """Cost per unit of building each buildable item, with each input built
+    or bought, whichever is cheaper."""
+    plan = read_build_plan(sde_conn, prices_conn, industry_conn, exclude_industry, date)
+    return {x: c for x, c in plan.build_costs.items() if c is not None}
@@ -0,0 +1,111 @@
+import sqlite3
+import unittest
+
+import industry
+
+# 3 is built from 1 and 2; 4 from 3 and 1; 5 from 4.
+BOM = {
+    3: [(1, 10), (2, 5)],
+    4: [(3, 2), (1, 1)],
+    5: [(4, 1)],
+}
+
+class TestBillOfMaterials(unittest.TestCase):
+    def testRead(self):
+        conn = sqlite3.connect(":memory:")
+        conn.execute("""
+        CREATE TABLE BuildItemInputs(
+          ID INT NOT NULL,
+          OutputID INT NOT NULL,
+          QuantityRequired INT
+        );""")
+        conn.executemany("""INSERT INTO BuildItemInputs VALUES(?,?,?)""", [(i, o, q) for o, inputs in BOM.items() for i, q in inputs])
+        bom = industry.read_bill_of_materials(conn)
+        self.assertEqual({o: sorted(inputs) for o, inputs in BOM.items()}, {o: sorted(inputs) for o, inputs in bom.items()})
+
+class TestBuildOrder(unittest.TestCase):
+    def testInputsFirst(self):
+        self.assertEqual([3, 4, 5], industry.build_order([5, 4, 3], BOM))
+
+    def testOnlyOutputsOrdered(self):
+        # 3 isn't buildable (e.g. excluded), so it is bought and 4 has no built inputs.
+        self.assertEqual([4, 5], industry.build_order([5, 4], BOM))
+
+    def testCycle(self):
+        bom = dict(BOM)
+        bom[3] = [(1, 10), (5, 1)]
+        with self.assertRaises(RuntimeError):
+            industry.build_order([3, 4, 5], bom)
+
+    def testSelfInput(self):
+        with self.assertRaises(RuntimeError):
+            industry.build_order([6], {6: [(6, 1)]})
+
+class TestPlanBuilds(unittest.TestCase):
+    def testChain(self):
+        # With no market for the outputs, everything is built.
+        plan = industry.plan_builds([3, 4, 5], BOM, {3: 1, 4: 2, 5: 1}, {1: 1.0, 2: 2.0})
+        self.assertEqual(20.0, plan.build_costs[3])
+        self.assertEqual((2 * 20.0 + 1.0) / 2, plan.build_costs[4])
+        self.assertEqual(plan.build_costs[4], plan.build_costs[5])
+        self.assertTrue(all(c.Build for c in plan.choices.values()))
+
+    def testBoughtInput(self):
+        plan = industry.plan_builds([4, 5], BOM, {4: 1, 5: 1}, {1: 1.0, 3: 100.0})
+        self.assertEqual(201.0, plan.build_costs[4])
+
+    def testBuyCheaperInput(self):
+        # 3 costs 20 to build but 15 to buy, so 4 is built from bought 3s.
+        plan = industry.plan_builds([3, 4, 5], BOM, {3: 1, 4: 1, 5: 1}, {1: 1.0, 2: 2.0, 3: 15.0, 4: 100.0})
+        self.assertEqual(industry.Choice(3, False, 15.0), plan.choices[3])
+        self.assertEqual(31.0, plan.build_costs[4])
+        self.assertEqual(industry.Choice(4, True, 31.0), plan.choices[4])
+        self.assertEqual(31.0, plan.build_costs[5])
+
+    def testBuildCheaperInput(self):
+        plan = industry.plan_builds([3, 4, 5], BOM, {3: 1, 4: 1, 5: 1}, {1: 1.0, 2: 2.0, 3: 25.0, 4: 30.0})
+        self.assertTrue(plan.choices[3].Build)
+        # 4 costs 41 to build, so 5 is made from bought 4s.
+        self.assertEqual(industry.Choice(4, False, 30.0), plan.choices[4])
+        self.assertEqual(30.0, plan.build_costs[5])
+
+    def testUnbuildableInputBought(self):
+        # 3 can't be built without a price for 2, but can be bought.
+        plan = industry.plan_builds([3, 4, 5], BOM, {3: 1, 4: 1, 5: 1}, {1: 1.0, 2: None, 3: 15.0})
+        self.assertIsNone(plan.build_costs[3])
+        self.assertEqual(31.0, plan.build_costs[4])
+
+    def testMissingPricePropagates(self):
+        plan = industry.plan_builds([3, 4, 5], BOM, {3: 1, 4: 1, 5: 1}, {1: 1.0, 2: None})
+        self.assertEqual({3: None, 4: None, 5: None}, plan.build_costs)
+        self.assertEqual({}, plan.choices)
+        self.assertIsNone(plan.tree(5).Cost)
+
+    def testTree(self):
+        plan = industry.plan_builds([3, 4, 5], BOM, {3: 1, 4: 2, 5: 1}, {1: 1.0, 2: 2.0, 3: 25.0})
+        tree = plan.tree(5, 4)
+        self.assertEqual((5, 4, True), tree[:3])
+        self.assertAlmostEqual(4 * plan.build_costs[5], tree.Cost)
+        [four] = tree.Inputs
+        self.assertEqual((4, 4.0, True), four[:3])
+        one, three = sorted(four.Inputs)
+        # 4 units of 4 take 2 runs of 2 of 3 and 1 of 1.
+        self.assertEqual((1, 2.0, False, 2.0, []), one)
+        self.assertEqual((3, 4.0, True, 80.0), three[:4])
+        self.assertEqual([(1, 40.0, False, 40.0, []), (2, 20.0, False, 40.0, [])], sorted(three.Inputs))
+
+class TestReprocessYields(unittest.TestCase):
+    def testOnlyRequestedTypes(self):
+        conn = sqlite3.connect(":memory:")
+        conn.execute("""
+        CREATE TABLE ReprocessItems(
+          ID              INT NOT NULL,
+          OutputID        INT NOT NULL,
+          QuantityYielded INT NOT NULL
+        );""")
+        conn.executemany("""INSERT INTO ReprocessItems VALUES(?,?,?)""", [(10, 1, 100), (10, 2, 5), (11, 1, 7), (12, 2, 3)])
+        yields = industry.read_reprocess_yields(conn, [10, 12, 13])
+        self.assertEqual({10: [(1, 100), (2, 5)], 12: [(2, 3)]}, {i: sorted(y) for i, y in yields.items()})
+        self.assertEqual({11: [(1, 7)]}, industry.read_reprocess_yields(conn, [11]))
+
+unittest.main()
@@ -3,8 +3,9 @@ import csv
 from dataclasses import dataclass
 from datetime import datetime
 import gzip
+import hashlib
 import sqlite3
-from typing import Iterator, Optional, Tuple
+from typing import Container, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
 Order = namedtuple('Order', ['TypeID', 'StationID', 'IsBuy', 'Price', 'Volume', 'Date'])
 StationInfo = namedtuple('StationInfo', ['ID', 'Name', 'SystemID', 'RegionID'])
@@ -15,6 +16,13 @@ class OrdersetInfo:
     Orderset: Optional[int]
     Date: Optional[datetime.date]
 
+def file_hash(path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
 def get_type_info(cur: sqlite3.Cursor, type_id: int) -> TypeInfo:
     res = cur.execute("""
     SELECT Types.ID, Types.name, Groups.ID, Groups.Name, Categories.ID, Categories.Name, MarketGroups.Path, Types.PortionSize
@@ -48,6 +56,54 @@ def get_type_info_byname(cur: sqlite3.Cursor, name: str) -> TypeInfo:
     row = r[0]
     return TypeInfo(row[0], row[1], row[2], row[3], row[4], row[5], row[6], row[7])
 
+def get_type_info_bynames(cur: sqlite3.Cursor, names: Iterable[str]) -> Tuple[Dict[str, TypeInfo], List[str]]:
+    """Looks up many types by name in a single query.
+
+    Returns the types found, keyed by name, and the list of names that are not known."""
+    names = list(dict.fromkeys(names))
+    cur.execute("""
+    CREATE TEMP TABLE IF NOT EXISTS LookupNames(
+      Name TEXT PRIMARY KEY NOT NULL
+    );""")
+    cur.execute("""DELETE FROM temp.LookupNames""")
+    cur.executemany("""INSERT INTO temp.LookupNames VALUES(?)""", [(n,) for n in names])
+    res = cur.execute("""
+    SELECT Types.ID, Types.name, Groups.ID, Groups.Name, Categories.ID, Categories.Name, MarketGroups.Path, Types.PortionSize
+    FROM temp.LookupNames JOIN Types ON (Types.Name = LookupNames.Name)
+        JOIN Groups ON (Types.GroupID = Groups.ID)
+        JOIN Categories ON (Categories.ID = Groups.CategoryID)
+    LEFT JOIN MarketGroups ON (MarketGroups.ID = Types.MarketGroupID)
+    """)
+    found = {}
+    for row in res.fetchall():
+        found[row[1]] = TypeInfo(row[0], row[1], row[2], row[3], row[4], row[5], row[6], row[7])
+    cur.execute("""DELETE FROM temp.LookupNames""")
+    return found, [n for n in names if n not in found]
+
+def get_type_volumes(cur: sqlite3.Cursor, type_ids: Iterable[int]) -> Dict[int, float]:
+    """Volume in m3 of one unit of each type, for the types that have one."""
+    type_ids = set(type_ids)
+    if not type_ids:
+        return {}
+    res = cur.execute("""
+    SELECT ID, Volume
+    FROM Types
+    WHERE ID IN ({}) AND Volume IS NOT NULL
+    """.format(",".join(str(int(i)) for i in type_ids)))
+    return dict(res.fetchall())
+
+def get_station_names(cur: sqlite3.Cursor, station_ids: Iterable[int]) -> Dict[int, str]:
+    """Names of the given stations, for those in the SDE."""
+    station_ids = set(station_ids)
+    if not station_ids:
+        return {}
+    res = cur.execute("""
+    SELECT ID, Name
+    FROM Stations
+    WHERE ID IN ({})
+    """.format(",".join(str(int(i)) for i in station_ids)))
+    return dict(res.fetchall())
+
 def get_station_info(cur: sqlite3.Cursor, stationID: int) -> StationInfo:
     res = cur.execute("""
     SELECT ID, Name, SystemID, RegionID
@@ -76,6 +132,13 @@ def get_station_info_byname(cur: sqlite3.Cursor, station: str) -> StationInfo:
     row = r[0]
     return StationInfo(row[0], row[1], row[2], row[3])
 
+def get_all_station_info(cur: sqlite3.Cursor) -> Dict[int, StationInfo]:
+    res = cur.execute("""
+    SELECT ID, Name, SystemID, RegionID
+    FROM Stations
+    """)
+    return {r[0]: StationInfo(r[0], r[1], r[2], r[3]) for r in res.fetchall()}
+
 def get_system_info(cur: sqlite3.Cursor, systemID: int) -> (str, float):
     res = cur.execute("""
         SELECT Name, Security
@@ -90,6 +153,17 @@ def get_system_info(cur: sqlite3.Cursor, systemID: int) -> (str, float):
     row = r[0]
     return (row[0], row[1])
 
+def get_region_name(cur: sqlite3.Cursor, regionID: int) -> Optional[str]:
+    res = cur.execute("""
+        SELECT Name
+        FROM Regions
+        WHERE ID = ?
+        """, [regionID])
+    r = res.fetchall()
+    if len(r) == 0:
+        return None
+    return r[0][0]
+
 def read_orderset(orderset_file: str) -> Iterator[Tuple[Order, int]]:
     with gzip.open(orderset_file, "rt") as ofh:
         r = csv.reader(ofh, delimiter="\t")
@@ -107,3 +181,34 @@ def read_orderset_filter(orderset_file: str, oinfo: OrdersetInfo) -> Iterator[Or
         assert oinfo.Orderset is None or oinfo.Orderset == item_orderset or item_orderset == 0
         if item_orderset > 0: oinfo.Orderset = item_orderset
         if oinfo.Date is None or (x.Date is not None and oinfo.Date < x.Date): oinfo.Date = x.Date
+
+def read_sell_orders(orderset_file: str, type_ids: Container[int], oinfo: OrdersetInfo, stations: Optional[Set[int]] = None, station_regions: Optional[Dict[int, int]] = None) -> Iterator[Tuple[int, int, float, int]]:
+    """Fast scan of an (unsorted) orderset for sell orders of the given types.
+
+    Yields (TypeID, StationID, Price, Volume), without building an Order per line.
+    Fills in oinfo like read_orderset_filter, and adds every station with any
+    order at all to stations, and its region to station_regions, if given."""
+    type_strs = set(str(t) for t in type_ids)
+    seen_stations = {}
+    max_date = None
+    current_orderset = None
+    with gzip.open(orderset_file, "rt") as ofh:
+        r = csv.reader(ofh, delimiter="\t")
+        for row in r:
+            _, typeID, date, is_buy, volume, _, _, price, stationID, _, _, regionID, orderset = row
+            seen_stations[stationID] = regionID
+            # ISO dates of the same format compare correctly as strings.
+            if max_date is None or date > max_date: max_date = date
+            if orderset != current_orderset:
+                assert oinfo.Orderset is None or oinfo.Orderset == int(orderset)
+                oinfo.Orderset = int(orderset)
+                current_orderset = orderset
+            if is_buy == 'True' or typeID not in type_strs: continue
+            yield int(typeID), int(stationID), float(price), int(volume)
+    if max_date is not None:
+        date = datetime.fromisoformat(max_date.rstrip('Z'))  # python <3.11 doesn't know Z.
+        if oinfo.Date is None or oinfo.Date < date: oinfo.Date = date
+    if stations is not None:
+        stations.update(int(s) for s in seen_stations)
+    if station_regions is not None:
+        station_regions.update((int(s), int(r)) for s, r in seen_stations.items())
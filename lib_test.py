@@ -92,6 +92,62 @@ class TestGetTypeInfo(unittest.TestCase):
     def testGetStationInfoFailed(self):
         self.assertIsNone(lib.get_station_info_byname(self.conn.cursor(), "Jita IV - Moon 3 - Not Here"))
 
+    def testGetStationNames(self):
+        self.assertEqual({1234: "Amo - Minmatar Fleet Market"}, lib.get_station_names(self.conn.cursor(), [1234, 9999]))
+        self.assertEqual({}, lib.get_station_names(self.conn.cursor(), []))
+
+class TestGetTypeInfoByNames(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        c = self.conn.cursor()
+        c.execute("""
+        CREATE TABLE Types(
+          ID      INT PRIMARY KEY NOT NULL,
+          Name    TEXT NOT NULL,
+          GroupID INT NOT NULL,
+          MarketGroupID INT,
+          PortionSize INT
+        );""")
+        c.execute("""
+        CREATE TABLE Groups(
+          ID      INT PRIMARY KEY NOT NULL,
+          Name    TEXT NOT NULL,
+          CategoryID INT NOT NULL
+        );""")
+        c.execute("""
+        CREATE TABLE Categories(
+          ID      INT PRIMARY KEY NOT NULL,
+          Name    TEXT NOT NULL
+        );""")
+        c.execute("""
+        CREATE TABLE MarketGroups(
+          ID      INT PRIMARY KEY NOT NULL,
+          Path    TEXT NOT NULL
+        );""")
+        c.execute("""INSERT INTO Types VALUES(?,?,?,?,?)""", [1, "Multispectrum Energized Membrane I", 123, 7, 1])
+        c.execute("""INSERT INTO Types VALUES(?,?,?,?,?)""", [2, "Multispectrum Energized Membrane II", 123, None, 1])
+        c.execute("""INSERT INTO Groups VALUES(?,?,?)""", [123, "Modules", 1234])
+        c.execute("""INSERT INTO Categories VALUES(?,?)""", [1234, "Cat"])
+        c.execute("""INSERT INTO MarketGroups VALUES(?,?)""", [7, "Ship Equipment>Hull & Armor"])
+
+    def tearDown(self):
+        self.conn.close()
+
+    def testLookup(self):
+        found, unknown = lib.get_type_info_bynames(self.conn.cursor(), [
+            "Multispectrum Energized Membrane II", "Not An Item", "Multispectrum Energized Membrane I", "Not An Item"])
+        self.assertEqual(set(found.keys()), set(["Multispectrum Energized Membrane I", "Multispectrum Energized Membrane II"]))
+        self.assertEqual(found["Multispectrum Energized Membrane I"].ID, 1)
+        self.assertEqual(found["Multispectrum Energized Membrane I"].MarketGroup, "Ship Equipment>Hull & Armor")
+        self.assertIsNone(found["Multispectrum Energized Membrane II"].MarketGroup)
+        self.assertEqual(unknown, ["Not An Item"])
+
+    def testRepeatedLookups(self):
+        lib.get_type_info_bynames(self.conn.cursor(), ["Multispectrum Energized Membrane I"])
+        found, unknown = lib.get_type_info_bynames(self.conn.cursor(), ["Multispectrum Energized Membrane II"])
+        self.assertEqual(list(found.keys()), ["Multispectrum Energized Membrane II"])
+        self.assertEqual(unknown, [])
+
 class TestReadOrderset(unittest.TestCase):
     def runTest(self):
         d = [x for x in lib.read_orderset("testdata/orderset.csv.gz")]
@@ -40,15 +40,16 @@ if args.initial:
 
 with open(args.industry) as fh:
     cur = industryDB.cursor()
-    reader = csv.DictReader(fh)
-    for r in reader:
+    rows = list(csv.DictReader(fh))
+    type_infos, _ = lib.get_type_info_bynames(sde, [r[k] for r in rows for k in ("Thing to make", "Input")])
+    for r in rows:
         outputName = r["Thing to make"]
-        outputInfo = lib.get_type_info_byname(sde, outputName)
+        outputInfo = type_infos.get(outputName)
         if outputInfo is None:
             log.warn("output {} not recognised".format(outputName))
             continue
         inputName = r["Input"]
-        inputInfo = lib.get_type_info_byname(sde, inputName)
+        inputInfo = type_infos.get(inputName)
         if inputInfo is None:
             log.warn("input {} not recognised".format(inputName))
             continue
@@ -0,0 +1,53 @@
+#!/usr/bin/python3
+
+from argparse import ArgumentParser
+import datetime
+import logging
+import sqlite3
+import sys
+
+import industry
+import lib
+import name_index
+
+log = logging.getLogger(__name__)
+
+def print_step(sde_conn: sqlite3.Connection, step: industry.ProductionStep, depth: int = 0):
+    ti = lib.get_type_info(sde_conn, step.TypeID)
+    print("{}{} {:g} x {}: {}".format(
+        '  ' * depth, 'build' if step.Build else 'buy', step.Quantity, ti.Name if ti is not None else step.TypeID,
+        '{:.2f}'.format(step.Cost) if step.Cost is not None else 'no price'))
+    for s in sorted(step.Inputs, key=lambda s: s.TypeID):
+        print_step(sde_conn, s, depth + 1)
+
+def main():
+    logging.basicConfig(format='%(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    arg_parser = ArgumentParser(prog='lookup_build.py', description='Prints the cheapest way to build items read from stdin, by id or name.')
+    arg_parser.add_argument('--exclude_industry', type=str, required=True)
+    arg_parser.add_argument('--quantity', type=float, default=1)
+    args = arg_parser.parse_args()
+
+    sde_conn = sqlite3.connect("sde.db")
+    prices_conn = sqlite3.connect("market-prices.db")
+    industry_conn = sqlite3.connect("industry.db")
+    plan = industry.read_build_plan(sde_conn, prices_conn, industry_conn, args.exclude_industry, datetime.date.today())
+
+    for x in sys.stdin:
+        x = x.rstrip()
+        try:
+            ti = lib.get_type_info(sde_conn, int(x))
+        except ValueError:
+            ti = lib.get_type_info_byname(sde_conn, x)
+        if ti is None:
+            c = name_index.type_index(sde_conn).unique(x)
+            if c is None:
+                log.error("No unique item matching '{}', candidates: {}".format(x, [m.Name for m in name_index.type_index(sde_conn).search(x, 5)]))
+                continue
+            ti = lib.get_type_info(sde_conn, c.ID)
+        if ti.ID not in plan.build_costs:
+            log.error("{} is not buildable".format(ti.Name))
+            continue
+        print_step(sde_conn, plan.tree(ti.ID, args.quantity))
+
+if __name__ == "__main__":
+    main()
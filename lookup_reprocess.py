@@ -6,6 +6,7 @@ import logging
 import sqlite3
 
 import lib
+import name_index
 from price_lib import get_pricing
 from industry import get_reprocess_value
 
@@ -22,6 +23,12 @@ def main():
             ti = lib.get_type_info(sde_conn, int(x))
         except ValueError:
             ti = lib.get_type_info_byname(sde_conn, x)
+        if ti is None:
+            c = name_index.type_index(sde_conn).unique(x)
+            if c is None:
+                log.error("No unique item matching '{}', candidates: {}".format(x, [m.Name for m in name_index.type_index(sde_conn).search(x, 5)]))
+                continue
+            ti = lib.get_type_info(sde_conn, c.ID)
         v = get_reprocess_value(sde_conn, prices_conn, ti.ID, datetime.date.today())
         print(v)
 
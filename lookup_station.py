@@ -2,6 +2,7 @@
 
 import fileinput
 import lib
+import name_index
 import sqlite3
 
 sde_conn = sqlite3.connect("sde.db")
@@ -12,5 +13,9 @@ for x in fileinput.input():
         ti = lib.get_station_info(sde_conn, int(x))
     except ValueError:
         ti = lib.get_station_info_byname(sde_conn, x)
+        if ti is None:
+            for c in name_index.station_index(sde_conn).search(x):
+                print("{}\t{}\t{:.2f}".format(c.ID, c.Name, c.Score))
+            continue
     print(ti)
 
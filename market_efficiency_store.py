@@ -0,0 +1,181 @@
+#!/usr/bin/python3
+
+from argparse import ArgumentParser
+from collections import namedtuple
+import csv
+import datetime
+import gzip
+import json
+import logging
+import sqlite3
+import sys
+from typing import IO, Iterable, Iterator, List, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+# Same columns as market-efficiency-schema.json.
+EfficiencyRecord = namedtuple('EfficiencyRecord', ['StationID', 'Station', 'CoveragePercent', 'InefficiencyPercent', 'Orderset', 'Date'])
+
+DEFAULT_STORE = "market-efficiency.db"
+
+def init_db(conn: sqlite3.Connection):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS MarketEfficiency(
+      StationID           INTEGER NOT NULL,
+      Station             TEXT,
+      CoveragePercent     FLOAT NOT NULL,
+      InefficiencyPercent FLOAT,
+      Orderset            INTEGER NOT NULL,
+      Date                DATE NOT NULL,
+      PRIMARY KEY (Orderset, StationID)
+    );""")
+    conn.execute("""
+    CREATE INDEX IF NOT EXISTS MarketEfficiency_ByStationDate ON MarketEfficiency(StationID, Date);
+    """)
+    conn.execute("""
+    CREATE INDEX IF NOT EXISTS MarketEfficiency_ByDate ON MarketEfficiency(Date, Orderset);
+    """)
+
+def open_store(fname: str = DEFAULT_STORE) -> sqlite3.Connection:
+    conn = sqlite3.connect(fname)
+    init_db(conn)
+    return conn
+
+def _optional_float(s: str) -> Optional[float]:
+    # '-' is the null marker used for bq load.
+    return None if s in ('-', '') else float(s)
+
+def read_csv(fh: IO) -> Iterator[EfficiencyRecord]:
+    """Reads the output of calc_market_quality.py."""
+    r = csv.DictReader(fh)
+    for row in r:
+        yield EfficiencyRecord(
+                StationID=int(row['StationID']),
+                Station=None if row['Station Name'] == '-' else row['Station Name'],
+                CoveragePercent=float(row['Coverage %']),
+                InefficiencyPercent=_optional_float(row['Inefficiency %']),
+                Orderset=int(row['Orderset']),
+                Date=row['Date'])
+
+def ingest(conn: sqlite3.Connection, records: Iterable[EfficiencyRecord]) -> Tuple[int, int]:
+    """Appends records, ignoring any (Orderset, StationID) already stored.
+    Returns (added, already present)."""
+    before = conn.total_changes
+    total = 0
+    with conn:
+        for rec in records:
+            conn.execute("""
+            INSERT OR IGNORE INTO MarketEfficiency VALUES(?,?,?,?,?,?)
+            """, rec)
+            total += 1
+    added = conn.total_changes - before
+    return added, total - added
+
+def station_history(conn: sqlite3.Connection, station_id: int, since: Optional[datetime.date] = None) -> List[EfficiencyRecord]:
+    res = conn.execute("""
+    SELECT StationID, Station, CoveragePercent, InefficiencyPercent, Orderset, Date
+    FROM MarketEfficiency
+    WHERE StationID = ? AND Date >= ?
+    ORDER BY Date, Orderset
+    """, [station_id, since.isoformat() if since is not None else ''])
+    return [EfficiencyRecord(*r) for r in res.fetchall()]
+
+def top_stations(conn: sqlite3.Connection, date: datetime.date, n: int = 10) -> List[EfficiencyRecord]:
+    """The n stations with the best coverage in the last orderset of the given
+    date, least inefficient first among equal coverage."""
+    res = conn.execute("""
+    SELECT StationID, Station, CoveragePercent, InefficiencyPercent, Orderset, Date
+    FROM MarketEfficiency
+    WHERE Orderset = (SELECT MAX(Orderset) FROM MarketEfficiency WHERE Date = ?)
+    ORDER BY CoveragePercent DESC, InefficiencyPercent IS NULL, InefficiencyPercent
+    LIMIT ?
+    """, [date.isoformat(), n])
+    return [EfficiencyRecord(*r) for r in res.fetchall()]
+
+# Output formats for lists of records. csv is market-efficiency.csv, as read by
+# read_csv and bq load; ndjson can also be loaded by bq load
+# (--source_format=NEWLINE_DELIMITED_JSON); columnar is gzipped JSON holding
+# one list per column.
+
+CSV_HEADER = ['StationID', 'Station Name', 'Coverage %', 'Inefficiency %', 'Orderset', 'Date']
+
+def write_csv(fh: IO, records: Iterable[EfficiencyRecord]):
+    w = csv.writer(fh)
+    w.writerow(CSV_HEADER)
+    for r in records:
+        w.writerow([r.StationID, r.Station if r.Station is not None else '-', '{:.1f}'.format(r.CoveragePercent),
+                    '{:.1f}'.format(r.InefficiencyPercent) if r.InefficiencyPercent is not None else '-',
+                    r.Orderset, r.Date])
+
+def write_ndjson(fh: IO, records: Iterable[EfficiencyRecord]):
+    for r in records:
+        fh.write(json.dumps(r._asdict()))
+        fh.write('\n')
+
+def write_columnar(fh: IO[bytes], records: Iterable[EfficiencyRecord]):
+    columns = {f: [] for f in EfficiencyRecord._fields}
+    for r in records:
+        for f, v in zip(EfficiencyRecord._fields, r):
+            columns[f].append(v)
+    with gzip.open(fh, "wt") as gz:
+        json.dump(columns, gz)
+
+def read_columnar(fh: IO[bytes]) -> Iterator[EfficiencyRecord]:
+    with gzip.open(fh, "rt") as gz:
+        columns = json.load(gz)
+    return map(EfficiencyRecord._make, zip(*(columns[f] for f in EfficiencyRecord._fields)))
+
+WRITERS = {
+    'csv': write_csv,
+    'ndjson': write_ndjson,
+    'columnar': write_columnar,
+}
+BINARY_FORMATS = {'columnar'}
+
+def add_output_args(arg_parser: ArgumentParser):
+    arg_parser.add_argument('--format', choices=sorted(WRITERS), default='csv')
+    arg_parser.add_argument('--output', type=str, help='defaults to stdout')
+    arg_parser.add_argument('--store', type=str, help='also add the results to this store')
+
+def output(args, records: List[EfficiencyRecord]):
+    """Writes records as given by the add_output_args options."""
+    binary = args.format in BINARY_FORMATS
+    if args.output is None:
+        WRITERS[args.format](sys.stdout.buffer if binary else sys.stdout, records)
+    else:
+        with open(args.output, "wb" if binary else "wt") as fh:
+            WRITERS[args.format](fh, records)
+    if args.store is not None:
+        conn = open_store(args.store)
+        added, present = ingest(conn, records)
+        log.info("{}: added {}, already present {}".format(args.store, added, present))
+        conn.close()
+
+def main():
+    logging.basicConfig(format='%(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    arg_parser = ArgumentParser(prog='market_efficiency_store.py')
+    arg_parser.add_argument('--store', type=str, default=DEFAULT_STORE)
+    subparsers = arg_parser.add_subparsers(dest='command', required=True)
+    ingest_parser = subparsers.add_parser('ingest', help='add market-efficiency.csv files to the store')
+    ingest_parser.add_argument('files', nargs='+', type=str)
+    history_parser = subparsers.add_parser('history', help='one station over time')
+    history_parser.add_argument('--station', type=int, required=True)
+    history_parser.add_argument('--since', type=datetime.date.fromisoformat)
+    top_parser = subparsers.add_parser('top', help='the best covered stations on a date')
+    top_parser.add_argument('--date', type=datetime.date.fromisoformat, required=True)
+    top_parser.add_argument('-n', type=int, default=10)
+    args = arg_parser.parse_args()
+
+    conn = open_store(args.store)
+    if args.command == 'ingest':
+        for fname in args.files:
+            with open(fname, "rt") as fh:
+                added, present = ingest(conn, read_csv(fh))
+            log.info("{}: added {}, already present {}".format(fname, added, present))
+    elif args.command == 'history':
+        write_csv(sys.stdout, station_history(conn, args.station, args.since))
+    elif args.command == 'top':
+        write_csv(sys.stdout, top_stations(conn, args.date, args.n))
+
+if __name__ == "__main__":
+    main()
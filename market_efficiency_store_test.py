@@ -0,0 +1,68 @@
+import datetime
+import io
+import unittest
+
+import market_efficiency_store as store
+
+CSV = """StationID,Station Name,Coverage %,Inefficiency %,Orderset,Date
+60003760,Jita 4-4,99.0,0.5,100,2024-01-01
+60008494,Amarr,90.0,3.0,100,2024-01-01
+1,-,90.0,-,100,2024-01-01
+60003760,Jita 4-4,98.0,0.7,101,2024-01-01
+60008494,Amarr,99.0,1.0,101,2024-01-01
+60003760,Jita 4-4,97.0,0.8,102,2024-01-02
+"""
+
+class TestStore(unittest.TestCase):
+    def setUp(self):
+        self.conn = store.open_store(":memory:")
+        store.ingest(self.conn, store.read_csv(io.StringIO(CSV)))
+
+    def testReadNulls(self):
+        r = list(store.read_csv(io.StringIO(CSV)))[2]
+        self.assertEqual(store.EfficiencyRecord(1, None, 90.0, None, 100, '2024-01-01'), r)
+
+    def testIngestIsIdempotent(self):
+        added, present = store.ingest(self.conn, store.read_csv(io.StringIO(CSV)))
+        self.assertEqual((0, 6), (added, present))
+
+    def testStationHistory(self):
+        h = store.station_history(self.conn, 60003760)
+        self.assertEqual([100, 101, 102], [r.Orderset for r in h])
+        self.assertEqual([0.5, 0.7, 0.8], [r.InefficiencyPercent for r in h])
+
+    def testStationHistorySince(self):
+        h = store.station_history(self.conn, 60003760, datetime.date(2024, 1, 2))
+        self.assertEqual([102], [r.Orderset for r in h])
+
+    def testTopStationsUsesLastOrdersetOfDate(self):
+        top = store.top_stations(self.conn, datetime.date(2024, 1, 1), 1)
+        self.assertEqual([(60008494, 101)], [(r.StationID, r.Orderset) for r in top])
+
+    def testTopStationsOrder(self):
+        conn = store.open_store(":memory:")
+        store.ingest(conn, (r for r in store.read_csv(io.StringIO(CSV)) if r.Orderset == 100))
+        top = store.top_stations(conn, datetime.date(2024, 1, 1))
+        self.assertEqual([60003760, 60008494, 1], [r.StationID for r in top])
+
+class TestWriters(unittest.TestCase):
+    def setUp(self):
+        self.records = list(store.read_csv(io.StringIO(CSV)))[:3]
+
+    def testCsvRoundTrip(self):
+        f = io.StringIO()
+        store.write_csv(f, self.records)
+        self.assertEqual(CSV.splitlines()[:4], f.getvalue().splitlines())
+
+    def testNdjson(self):
+        f = io.StringIO()
+        store.write_ndjson(f, self.records[2:])
+        self.assertEqual(f.getvalue(), """{"StationID": 1, "Station": null, "CoveragePercent": 90.0, "InefficiencyPercent": null, "Orderset": 100, "Date": "2024-01-01"}\n""")
+
+    def testColumnarRoundTrip(self):
+        f = io.BytesIO()
+        store.write_columnar(f, self.records)
+        f.seek(0)
+        self.assertEqual(self.records, list(store.read_columnar(f)))
+
+unittest.main()
@@ -1,41 +1,113 @@
 #!/usr/bin/python3
 
-from argparse import ArgumentParser
-from collections import defaultdict, namedtuple
+from argparse import ArgumentParser, ArgumentTypeError
+from collections import namedtuple
 import csv
-from dataclasses import dataclass
+from dataclasses import dataclass, field, replace
 import datetime
-from fnmatch import fnmatch
+import glob
+import hashlib
 import industry
+import itertools
+import json
 import logging
 import math
+import multiprocessing
+import os
+import pickle
 import sqlite3
 import sys
-from typing import Dict, List, Optional, Set, Tuple
+from typing import Callable, Dict, List, Optional, Set, Tuple
 import yaml
 
+import asset_store
 import lib
-from price_lib import get_pricing
+import market_paths
+import name_index
+import order_book
+from price_lib import get_fair_prices, get_pricing, price_history_version
+import top_market_items
 import trade_lib
 
 log = logging.getLogger(__name__)
 
-def get_sources(conn: sqlite3.Connection, to: str, fname: str) -> (int, Dict[int, dict]):
+def get_station_id(conn: sqlite3.Connection, name: str) -> int:
+    s = lib.get_station_info_byname(conn, name)
+    if s is not None:
+        return s.ID
+    # Allow abbreviated names, as long as they are unambiguous.
+    c = name_index.station_index(conn).unique(name)
+    if c is None:
+        raise RuntimeError("no unique station matching '{}', candidates: {}".format(
+            name, [m.Name for m in name_index.station_index(conn).search(name, 5)]))
+    log.info("station '{}' resolved to {}".format(name, c.Name))
+    return c.ID
+
+def _source_stations(conn: sqlite3.Connection, source: dict) -> Dict[int, dict]:
+    return {
+            get_station_id(conn, y['name']): {
+                'isk_cost': y.get('isk_cost', 0),
+                'vol_cost': y.get('vol_cost', 0),
+                # m3 per trip, for hauling.py
+                'capacity': y.get('capacity'),
+                }
+            for y in source['from']
+            }
+
+def read_sources(fname: str) -> Dict[str, dict]:
     with open(fname, "rt") as fh:
-        d = yaml.safe_load(fh)
-        for x in d:
-            if x['id'] == to:
-                to_id = lib.get_station_info_byname(conn, x['to']).ID
-                from_stations = {
-                        lib.get_station_info_byname(conn, y['name']).ID: {
-                            'isk_cost': y.get('isk_cost', 0),
-                            'vol_cost': y.get('isk_cost', 0)
-                            }
-                        for y in x['from']
-                        }
-                return to_id, from_stations
+        return {x['id']: x for x in yaml.safe_load(fh)}
 
+def get_sources(conn: sqlite3.Connection, to: str, fname: str) -> (int, Dict[int, dict]):
+    sources = read_sources(fname)
+    if to not in sources:
         raise RuntimeError('failed to find source {}'.format(to))
+    return get_station_id(conn, sources[to]['to']), _source_stations(conn, sources[to])
+
+@dataclass
+class StationPlan:
+    """A station to plan for, with its settings from sources.yaml."""
+    id: str
+    to_station: int
+    from_stations: Dict[int, dict]
+    limit: Optional[int]
+    stock_fraction: float
+    excluded_mpaths: market_paths.MarketPathMatcher
+    # Other stations whose assets count as available at to_station.
+    assets_near: Set[int] = field(default_factory=set)
+    # The file excluded_mpaths was read from.
+    exclude_file: Optional[str] = None
+
+    @property
+    def stations(self) -> Set[int]:
+        return set(self.from_stations.keys()) | {self.to_station}
+
+    @property
+    def asset_stations(self) -> Set[int]:
+        return self.assets_near | {self.to_station}
+
+def get_plans(conn: sqlite3.Connection, ids: List[str], fname: str, limit: Optional[int], stock_fraction: float, exclude_market_paths: Optional[str]) -> List[StationPlan]:
+    """Plans for the given sources.yaml ids. limit, stock_fraction and
+    exclude_market_paths can be set per station in sources.yaml, otherwise
+    the given defaults apply. Our assets count as in stock at a station if
+    they are there or at one of the stations listed in its assets_near."""
+    sources = read_sources(fname)
+    plans = []
+    for i in ids:
+        if i not in sources:
+            raise RuntimeError('failed to find source {}'.format(i))
+        x = sources[i]
+        mpaths_file = x.get('exclude_market_paths', exclude_market_paths)
+        plans.append(StationPlan(
+            id=i,
+            to_station=get_station_id(conn, x['to']),
+            from_stations=_source_stations(conn, x),
+            limit=x.get('limit', limit),
+            stock_fraction=x.get('stock_fraction', stock_fraction),
+            excluded_mpaths=market_paths.compile_patterns(read_market_paths(mpaths_file) if mpaths_file is not None else []),
+            assets_near=set(get_station_id(conn, name) for name in x.get('assets_near', [])),
+            exclude_file=mpaths_file))
+    return plans
 
 @dataclass
 class ItemModel:
@@ -45,77 +117,103 @@ class ItemModel:
     newSell: Optional[float] # the price we would list new sales at
     notes: List[str]
 
-def pick_prices(prices_conn: sqlite3.Connection, trade_summary: trade_lib.ItemSummary, date) -> trade_lib.ItemSummary:
-    type_id = trade_summary.ID
-    availability = get_pricing(prices_conn, type_id, date)
+# Multiples of the fair price at which we buy, list new sales, and are happy to see an item selling.
+Markups = namedtuple('Markups', ['Buy', 'NewSell', 'Sell'])
+# allow buying slightly over the fair price.
+# Acceptable sell price is slightly higher than the new sale price, we need some hysteresis
+# so that we don't keep adjusting orders constantly.
+DEFAULT_MARKUPS = Markups(Buy=1.01, NewSell=1.24, Sell=1.26)
+
+def price_item(trade_summary: trade_lib.ItemSummary, fair_price: Optional[float], markups: Markups = DEFAULT_MARKUPS) -> ItemModel:
     imodel = ItemModel(trade=trade_summary, notes = [], buy=None, sell=None, newSell=None)
 
-    if availability.fair_price is None:
+    if fair_price is None:
         imodel.notes.append("no fair price available")
         return imodel
 
-    # allow buying slightly over the fair price.
-    imodel.buy = availability.fair_price*1.01
-    imodel.newSell = availability.fair_price*1.24
-    # Acceptable sell price is slightly higher, we need some hysteresis so that we don't
-    # keep adjusting orders constantly.
-    imodel.sell = availability.fair_price*1.26
+    imodel.buy = fair_price*markups.Buy
+    imodel.newSell = fair_price*markups.NewSell
+    imodel.sell = fair_price*markups.Sell
     return imodel
 
-def get_orderset_info(ofile: str) -> lib.OrdersetInfo:
-    oinfo = lib.OrdersetInfo(None, None)
-    for _ in lib.read_orderset_filter(ofile, oinfo):
-        pass
-    return oinfo
+def pick_prices(prices_conn: sqlite3.Connection, trade_summary: trade_lib.ItemSummary, date, markups: Markups = DEFAULT_MARKUPS) -> ItemModel:
+    availability = get_pricing(prices_conn, trade_summary.ID, date)
+    return price_item(trade_summary, availability.fair_price, markups)
 
-def process_orderset(ofile: str, market_model: Dict[int, ItemModel], stations: Set[int]) -> Tuple[Dict[int, Dict[int, List]], Dict[int, Tuple[float, int]]]:
-    # Per item, per station, stocks below buy and sell prices
-    stock_per_station = {i: defaultdict(lambda: [0,0]) for i in market_model.keys()}
-    lowest_sell = defaultdict(lambda: (1e99,0))
+def read_station_ladders(ofile: str, type_ids: Set[int], stations: Set[int], oinfo: lib.OrdersetInfo) -> Dict[int, Dict[int, order_book.PriceLadder]]:
+    """Single pass over an orderset, building the sell order book of the given
+    items at the given stations, per item and station."""
+    orders = {}
     log.info("reading orderset file '{}'".format(ofile))
-    for x,_ in lib.read_orderset(ofile):
-        if x.StationID not in stations: continue
-        if x.TypeID not in market_model: continue
-        if x.IsBuy: continue
+    for type_id, station_id, price, volume in lib.read_sell_orders(ofile, type_ids, oinfo):
+        if station_id not in stations: continue
+        orders.setdefault(type_id, {}).setdefault(station_id, []).append((price, volume))
+    return order_book.build_ladders(orders)
 
-        try:
-            if market_model[x.TypeID].buy is None: continue
-            if x.Price < market_model[x.TypeID].buy:
-                stock_per_station[x.TypeID][x.StationID][0] += x.Volume
-            if x.Price < market_model[x.TypeID].sell:
-                stock_per_station[x.TypeID][x.StationID][1] += x.Volume
-            if x.Price < lowest_sell[x.TypeID][0]:
-                lowest_sell[x.TypeID] = (x.Price, x.StationID)
-        except TypeError as e:
-            raise RuntimeError("failed to parse {} (mm {}): {}".format(x, market_model[x.TypeID], e))
-
-    # Convert to a regular dict, to avoid exposing implementation.
-    return ({i: dict(v) for i,v in stock_per_station.items()},
-            dict(lowest_sell))
-
-Result = namedtuple('Result', ['ID', 'Name', 'BuyQuantity', 'MaxBuy', 'MyAssets', 'MyCurrentSell', 'SellQuantity', 'MySell', 'StockQuantity', 'FromStationID', 'FromStationName', 'ToStationID', 'ToStationName', 'IndustryCost', 'BuildQuantity', 'AdjustOrder', 'Notes'])
+def station_stocks(ladders: Dict[int, Dict[int, order_book.PriceLadder]], market_model: Dict[int, ItemModel], stations: Set[int]) -> Tuple[Dict[int, Dict[int, List]], Dict[int, Tuple[float, int]]]:
+    # Per item, per station, stocks below buy and sell prices
+    stock_per_station = {i: {} for i in market_model.keys()}
+    lowest_sell = {}
+    for type_id, item_ladders in ladders.items():
+        im = market_model.get(type_id)
+        if im is None or im.buy is None: continue
+        for station_id, ladder in item_ladders.items():
+            if station_id not in stations: continue
+            below_buy = ladder.volume_below(im.buy)
+            below_sell = ladder.volume_below(im.sell)
+            if below_buy > 0 or below_sell > 0:
+                stock_per_station[type_id][station_id] = [below_buy, below_sell]
+            if ladder.lowest < lowest_sell.get(type_id, (1e99,0))[0]:
+                lowest_sell[type_id] = (ladder.lowest, station_id)
+    return stock_per_station, lowest_sell
+
+def process_orderset(ofile: str, market_model: Dict[int, ItemModel], stations: Set[int]) -> Tuple[Dict[int, Dict[int, List]], Dict[int, Tuple[float, int]]]:
+    ladders = read_station_ladders(ofile, set(market_model.keys()), stations, lib.OrdersetInfo(None, None))
+    return station_stocks(ladders, market_model, stations)
+
+Result = namedtuple('Result', ['ID', 'Name', 'BuyQuantity', 'MaxBuy', 'MyAssets', 'MyCurrentSell', 'SellQuantity', 'MySell', 'StockQuantity', 'FromStationIDs', 'FromStationName', 'FromQuantities', 'ToStationID', 'ToStationName', 'IndustryCost', 'BuildQuantity', 'AdjustOrder', 'Notes'])
 
 def bool_to_str(b: bool) -> str:
     return "Y" if b else "N"
 
-def suggest_stock(station: int, item: ItemModel, station_stocks: Dict[int, int], current_assets: int, current_order: Optional[Tuple[int, float]], industry_items: Set[int], stock_fraction: float) -> Result:
-    min_order = trade_lib.get_order_size(item.trade).MinOrderSize
-    notes = item.notes
-
-    market_quantity = math.floor(item.trade.ValueTraded / item.buy)
-    # original_stock_quantity how much supply of this item we want to be available on the market.
-    original_stock_quantity = market_quantity * stock_fraction
+@dataclass
+class Basket:
+    """The items of a plan as columns, one entry per item in the same order,
+    so that each step of planning is one pass over the whole basket."""
+    items: List[ItemModel]
+    min_orders: List[int]
+    # Per station, the stock below the buy and the sell price.
+    stocks: List[Dict[int, List]]
+    # The lowest sell price and its station.
+    lowest_sell: List[Tuple[float, int]]
+    assets: List[int]
+    # Quantity and price of our sell order, if we have one.
+    orders: List[Optional[Tuple[int, float]]]
+    industry_costs: List[Optional[float]]
+    # Per station, the order book. Without, each item is bought from the
+    # single best station according to stocks.
+    ladders: Optional[List[Dict[int, order_book.PriceLadder]]]
+    volumes: List[float]
+
+# How much of each item of a basket we want to stock, buy and sell, before
+# deciding where to buy it. See Result for the fields.
+StockColumns = namedtuple('StockColumns', ['StockQuantity', 'BuyQuantity', 'SellQuantity', 'MyCurrentSell', 'AdjustOrder', 'Notes'])
+
+def suggest_stock(station: int, basket: Basket, stock_fraction: float, competitor_weight: float = 1.0) -> StockColumns:
+    items = basket.items
+    orders = basket.orders
+
+    # original_stock_quantity how much supply of each item we want to be available on the market.
     # Round to nearest multiple of min_order,
     # unless we are below min_order in which case round to 1 if >=1/4 of min_order
     #                                                or to 0 stock otherwise.
-    original_stock_quantity = min_order * math.floor(
-        0.5 + original_stock_quantity/min_order)
+    original_stock_quantity = [min_order * math.floor(0.5 + math.floor(im.trade.ValueTraded / im.buy) * stock_fraction / min_order)
+                               for im, min_order in zip(items, basket.min_orders)]
 
     # Reduce potential order by the amount of existing stock below the target sale price.
-    existing_stock = station_stocks.get(station, [0,0])[1]
-    competitor_stock = existing_stock
-    if current_order is not None and current_order[1] <= item.newSell:
-        competitor_stock -= current_order[0]
+    existing_stock = [s.get(station, [0, 0])[1] for s in basket.stocks]
+    competitor_stock = [e - o[0] if o is not None and o[1] <= im.newSell else e
+                        for e, o, im in zip(existing_stock, orders, items)]
     # Intentionally reduce the *total* target stock level (including competitors) by the amount
     # of any competitor's stocks.
     # So if a competitor is stocking half of our target level, we halve the target stock here and then
@@ -123,126 +221,144 @@ def suggest_stock(station: int, item: ItemModel, station_stocks: Dict[int, int],
     # reduce our purchase by 1/2 in total.
     # Basically we assume that if a competitor is stocking a substantial amount now, they will stock more
     # later and we should greatly reduce or even not bother trying to supply it ourselves.
-    original_stock_quantity = max(0, original_stock_quantity-competitor_stock)
+    # competitor_weight scales how much we back off for competitors.
+    original_stock_quantity = [max(0, q - math.ceil(c * competitor_weight)) for q, c in zip(original_stock_quantity, competitor_stock)]
 
     # stock_quantity is how much more *we* want to supply to the market (not including any stock that
     # we already listed) - before considering availability.
-    if current_order and existing_stock*2 + (current_order[0]*3 if current_order is not None else 0) > original_stock_quantity:
-        # We reduce our potential stocking even more aggressively if we have an order up already
-        # note that existing stock may include an existing order, so this is really:
-        # competitor stock*2 + my_stock_below_target*2 + my_stock_total*2
-        stock_quantity = 0
-        if existing_stock > 0:
-            notes.append("already in stock below target price, volume={}".format(existing_stock))
+    notes = [im.notes for im in items]
+    stock_quantity = []
+    for q, e, o, n in zip(original_stock_quantity, existing_stock, orders, notes):
+        if o and e*2 + o[0]*3 > q:
+            # We reduce our potential stocking even more aggressively if we have an order up already
+            # note that existing stock may include an existing order, so this is really:
+            # competitor stock*2 + my_stock_below_target*2 + my_stock_total*2
+            stock_quantity.append(0)
+            if e > 0:
+                n.append("already in stock below target price, volume={}".format(e))
+            else:
+                n.append("existing order needs no addition")
+        elif e > 0:
+            stock_quantity.append(max(0, q - e))
+            n.append("some stock below target price, volume={}".format(e))
         else:
-            notes.append("existing order needs no addition")
-    elif existing_stock > 0:
-        stock_quantity = max(0, original_stock_quantity - existing_stock)
-        notes.append("some stock below target price, volume={}".format(existing_stock))
-    else:
-        stock_quantity = original_stock_quantity
+            stock_quantity.append(q)
 
     # buy_quantity is how much we therefore want to buy or build.
-    adjust_order = False
-    buy_quantity = max(0, stock_quantity - current_assets)
-    if current_order is not None:
-        notes.append("already listed for sale, volume={}".format(current_order[0]))
-        buy_quantity = max(0, buy_quantity - current_order[0])
-
-        if item.newSell * 1.1 < current_order[1]:
-            adjust_order=True
-
-    return Result(ID=item.trade.ID, Name=item.trade.Name,
-                  BuyQuantity=buy_quantity, MaxBuy=item.buy,
-                  MyAssets=current_assets,
-                  MyCurrentSell=(current_order[0] if current_order else 0),
-                  StockQuantity=original_stock_quantity,
-                  IndustryCost=industry_items.get(item.trade.ID),
-                  AdjustOrder=bool_to_str(adjust_order),
-                  MySell=item.newSell,
-                  Notes=notes,
-                  # Before going to SuggestBuys, SellQuantity is the amount we
-                  # want additionally to sell if we buy/build *nothing*.
-                  SellQuantity=stock_quantity - buy_quantity,
-                  FromStationID=None,
-                  FromStationName=None,
-                  ToStationID=None,
-                  ToStationName=None,
-                  BuildQuantity=None)
-
-def suggest_buys(sde_conn: sqlite3.Connection, r: Result, item: ItemModel, station_stocks: Dict[int, int], lowest_sell: Tuple[float, int], allowed_stations: Set[int]) -> Result:
-    min_order = trade_lib.get_order_size(item.trade).MinOrderSize
-    from_station = None
-    station_info = None
-    notes = []
-    build_quantity = 0
-
-    if r.BuyQuantity < min_order/2:
-        if r.MyCurrentSell == 0 and r.MyAssets == 0:
-            notes.append("target stock quantity too low, original_stock_quantity={}, buy_quantity={}, min_order={}".format(r.StockQuantity, r.BuyQuantity, min_order))
-        buy_quantity = 0
-    elif r.IndustryCost and lowest_sell[0] > r.IndustryCost*1.1:
-        buy_quantity = 0
-        build_quantity = r.BuyQuantity
-    else:
-        buy_quantity = min_order * math.ceil(r.BuyQuantity/min_order)
-
-        # Prefer station with lowest price, then stations with most stock in the target price range.
-        for station, stock in sorted(station_stocks.items(), key=lambda x: (x[0] == lowest_sell[1],x[1][0]), reverse=True):
-            if station not in allowed_stations: continue
-            station_info = lib.get_station_info(sde_conn, station)
-            if stock[0] == 0:
-                notes.append("not available at station {} (quantity {})".format(station_info.Name, buy_quantity))
-            elif stock[0] < min_order or stock[0] < buy_quantity / 2:
-                notes.append("not available in quantity at station {} for target price (want {} available {})".format(station_info.Name, buy_quantity, stock[0]))
-            else:
-               buy_quantity = min([stock[0], buy_quantity])
-               from_station = station
-               break
-
-        if from_station is None:
-            buy_quantity = 0
-
-    return r._replace(
-            Notes=r.Notes + notes,
-            FromStationID=from_station,
+    buy_quantity = [max(0, s - a) for s, a in zip(stock_quantity, basket.assets)]
+    for k, (o, n) in enumerate(zip(orders, notes)):
+        if o is not None:
+            n.append("already listed for sale, volume={}".format(o[0]))
+            buy_quantity[k] = max(0, buy_quantity[k] - o[0])
+
+    return StockColumns(
+            StockQuantity=original_stock_quantity,
+            BuyQuantity=buy_quantity,
+            # Before going to suggest_buys, SellQuantity is the amount we
+            # want additionally to sell if we buy/build *nothing*.
+            SellQuantity=[s - b for s, b in zip(stock_quantity, buy_quantity)],
+            MyCurrentSell=[o[0] if o else 0 for o in orders],
+            AdjustOrder=[o is not None and im.newSell * 1.1 < o[1] for o, im in zip(orders, items)],
+            Notes=notes)
+
+def station_name(sde_conn: sqlite3.Connection, station: int, names: Optional[Dict[int, str]] = None) -> str:
+    """The name of a station, from names if given there."""
+    if names is not None and station in names:
+        return names[station]
+    return lib.get_station_info(sde_conn, station).Name
+
+def allocate_buys(sde_conn: sqlite3.Connection, item: ItemModel, buy_quantity: int, min_order: int, ladders: Dict[int, order_book.PriceLadder], from_stations: Dict[int, dict], unit_volume: float, notes: List[str], names: Optional[Dict[int, str]] = None) -> List[order_book.Allocation]:
+    """Splits buy_quantity across the source stations at the lowest landed cost."""
+    sources = {s: l for s, l in ladders.items() if s in from_stations}
+    costs = {s: (from_stations[s]['isk_cost'], from_stations[s]['vol_cost'] * unit_volume) for s in sources}
+    allocations = order_book.allocate(sources, buy_quantity, item.buy, costs)
+    available = sum(a.Quantity for a in allocations)
+    if available == 0:
+        notes.append("not available at source stations (quantity {})".format(buy_quantity))
+        return []
+    if available < min_order or available < buy_quantity / 2:
+        notes.append("not available in quantity at source stations for target price (want {} available {})".format(buy_quantity, available))
+        return []
+    if len(allocations) > 1:
+        for a in allocations:
+            notes.append("{} from {} at {:.2f}".format(a.Quantity, station_name(sde_conn, a.StationID, names), a.LandedCost / a.Quantity))
+    return allocations
+
+def buy_at_best_station(sde_conn: sqlite3.Connection, station_stocks: Dict[int, List], lowest_sell: Tuple[float, int], from_stations: Dict[int, dict], buy_quantity: int, min_order: int, notes: List[str], names: Optional[Dict[int, str]] = None) -> Tuple[int, Optional[int], Optional[str]]:
+    """How much to buy, where and the station's name, buying all from one station."""
+    # Prefer station with lowest price, then stations with most stock in the target price range.
+    for station, stock in sorted(station_stocks.items(), key=lambda x: (x[0] == lowest_sell[1],x[1][0]), reverse=True):
+        if station not in from_stations: continue
+        name = station_name(sde_conn, station, names)
+        if stock[0] == 0:
+            notes.append("not available at station {} (quantity {})".format(name, buy_quantity))
+        elif stock[0] < min_order or stock[0] < buy_quantity / 2:
+            notes.append("not available in quantity at station {} for target price (want {} available {})".format(name, buy_quantity, stock[0]))
+        else:
+            return min([stock[0], buy_quantity]), station, name
+    return 0, None, None
+
+# Where suggest_buys buys each item of a basket from, and how much it buys,
+# builds and sells. See Result for the fields.
+BuyColumns = namedtuple('BuyColumns', ['BuyQuantity', 'BuildQuantity', 'SellQuantity', 'FromStationIDs', 'FromStationName', 'FromQuantities', 'Notes'])
+
+def suggest_buys(sde_conn: sqlite3.Connection, basket: Basket, stock: StockColumns, from_stations: Dict[int, dict], names: Optional[Dict[int, str]] = None) -> BuyColumns:
+    """Decides where to buy from. With the order book ladders of the items, a
+    purchase may be split across all of from_stations; without, it comes from
+    the single best station according to the stocks."""
+    n = len(basket.items)
+    buy_quantity = [0] * n
+    bought_from = [()] * n
+    from_name = ["-"] * n
+    from_quantities = [()] * n
+    notes = [[] for _ in range(n)]
+
+    too_few = [b < min_order/2 for b, min_order in zip(stock.BuyQuantity, basket.min_orders)]
+    for k in range(n):
+        if too_few[k] and stock.MyCurrentSell[k] == 0 and basket.assets[k] == 0:
+            notes[k].append("target stock quantity too low, original_stock_quantity={}, buy_quantity={}, min_order={}".format(stock.StockQuantity[k], stock.BuyQuantity[k], basket.min_orders[k]))
+    # Build what costs less to build than to buy.
+    build = [not f and bool(cost) and lowest[0] > cost*1.1
+             for f, cost, lowest in zip(too_few, basket.industry_costs, basket.lowest_sell)]
+    build_quantity = [b if x else 0 for b, x in zip(stock.BuyQuantity, build)]
+
+    for k in range(n):
+        if too_few[k] or build[k]: continue
+        min_order = basket.min_orders[k]
+        quantity = min_order * math.ceil(stock.BuyQuantity[k]/min_order)
+        if basket.ladders is not None:
+            allocations = allocate_buys(sde_conn, basket.items[k], quantity, min_order, basket.ladders[k], from_stations, basket.volumes[k], notes[k], names)
+            if allocations:
+                buy_quantity[k] = sum(a.Quantity for a in allocations)
+                bought_from[k] = tuple(a.StationID for a in allocations)
+                from_name[k] = ",".join(station_name(sde_conn, a.StationID, names) for a in allocations)
+                from_quantities[k] = tuple(a.Quantity for a in allocations)
+        else:
+            quantity, station, name = buy_at_best_station(sde_conn, basket.stocks[k], basket.lowest_sell[k], from_stations, quantity, min_order, notes[k], names)
+            if station is not None:
+                buy_quantity[k] = quantity
+                bought_from[k] = (station,)
+                from_name[k] = name
+                from_quantities[k] = (quantity,)
+
+    return BuyColumns(
             BuyQuantity=buy_quantity,
-            SellQuantity=min(buy_quantity+r.SellQuantity, max(r.StockQuantity - r.MyCurrentSell, 0)),
             BuildQuantity=build_quantity,
-            FromStationName=station_info.Name if from_station else "-"
-            )
-
-def read_assets(files: str) -> Dict[int, int]:
-    res = defaultdict(int)
-    for filename in files:
-        i = 0
-        with open(filename, "rt") as f:
-            reader = csv.DictReader(f)
-            for r in reader:
-                i += 1
-                if r['Singleton'] == 'True': continue
-                res[int(r['TypeID'])] += int(r['Quantity'])
-        log.info("Read asset file {}: {} assets.".format(filename, i))
-    return dict(res)
+            SellQuantity=[min(b + s, max(q - m, 0)) for b, s, q, m in zip(buy_quantity, stock.SellQuantity, stock.StockQuantity, stock.MyCurrentSell)],
+            FromStationIDs=bought_from,
+            FromStationName=from_name,
+            FromQuantities=from_quantities,
+            Notes=notes)
+
+def read_assets(files: List[str], cache_dir: Optional[str] = None) -> asset_store.AssetIndex:
+    return asset_store.load_assets(files, cache_dir)
+
+def read_orders_by_location(files: List[str], cache_dir: Optional[str] = None) -> Dict[int, Dict[int, List]]:
+    """Per station, per item, the quantity and lowest price of our sell orders."""
+    return asset_store.load_orders(files, cache_dir)
 
 def read_orders(station: int, files: str) -> Dict[int, int]:
-    res = defaultdict(lambda: [0, None])
-    for filename in files:
-        with open(filename, "rt") as f:
-            i = 0
-            # TypeID,Quantity,Original Quantity,Price,LocationID
-            reader = csv.DictReader(f)
-            for r in reader:
-                i += 1
-                if int(r['LocationID']) != station: continue
-                typeID = int(r['TypeID'])
-                res[typeID][0] += int(r['Quantity'])
-                if res[typeID][1] is not None:
-                    res[typeID][1] = min(res[typeID][1], float(r['Price']))
-                else:
-                    res[typeID][1] = float(r['Price'])
-        log.info("Read order file {}: {} orders.".format(filename, i))
-    return dict(res)
+    return read_orders_by_location(files).get(station, {})
 
 def read_market_paths(filename: str) -> List[str]:
     res = []
@@ -253,72 +369,354 @@ def read_market_paths(filename: str) -> List[str]:
             res.append(l)
     return res
 
-def decide_actions(sde_conn: sqlite3.Connection, station: int, item, s,lowest_sell, from_stations, assets, orders, industry, stock_fraction: float):
-    r = suggest_stock(station, item, s, assets, orders, industry, stock_fraction)
-    r = suggest_buys(sde_conn, r, item, s, lowest_sell, from_stations)
+def plan_basket(sde_conn: sqlite3.Connection, station: int, basket: Basket, from_stations: Dict[int, dict], stock_fraction: float, competitor_weight: float = 1.0, names: Optional[Dict[int, str]] = None) -> List[Result]:
+    """The plan for each item of the basket at station."""
+    stock = suggest_stock(station, basket, stock_fraction, competitor_weight)
+    buys = suggest_buys(sde_conn, basket, stock, from_stations, names)
+    return [Result(ID=item.trade.ID, Name=item.trade.Name,
+                   BuyQuantity=buys.BuyQuantity[k], MaxBuy=item.buy,
+                   MyAssets=basket.assets[k],
+                   MyCurrentSell=stock.MyCurrentSell[k],
+                   StockQuantity=stock.StockQuantity[k],
+                   IndustryCost=basket.industry_costs[k],
+                   AdjustOrder=bool_to_str(stock.AdjustOrder[k]),
+                   MySell=item.newSell,
+                   Notes=stock.Notes[k] + buys.Notes[k],
+                   SellQuantity=buys.SellQuantity[k],
+                   FromStationIDs=buys.FromStationIDs[k],
+                   FromStationName=buys.FromStationName[k],
+                   FromQuantities=buys.FromQuantities[k],
+                   ToStationID=None,
+                   ToStationName=None,
+                   BuildQuantity=buys.BuildQuantity[k])
+            for k, item in enumerate(basket.items)]
+
+def decide_actions(sde_conn: sqlite3.Connection, station: int, item, s,lowest_sell, from_stations, assets, orders, industry, stock_fraction: float, ladders: Optional[Dict[int, order_book.PriceLadder]] = None, unit_volume: float = 0.0, competitor_weight: float = 1.0, min_order: Optional[int] = None, names: Optional[Dict[int, str]] = None):
+    """The plan for a single item, as plan_basket."""
+    if min_order is None:
+        min_order = trade_lib.get_order_size(item.trade).MinOrderSize
+    basket = Basket(items=[item], min_orders=[min_order], stocks=[s], lowest_sell=[lowest_sell], assets=[assets], orders=[orders],
+                    industry_costs=[industry.get(item.trade.ID)], ladders=[ladders] if ladders is not None else None, volumes=[unit_volume])
+    r, = plan_basket(sde_conn, station, basket, from_stations, stock_fraction, competitor_weight, names)
     return r
 
+@dataclass
+class MarketState:
+    """What planning needs that doesn't depend on the planning settings
+    (markups, stock fraction, competitor weight), so that plans for many
+    settings can be made from one read of the orderset, prices and industry."""
+    oinfo: lib.OrdersetInfo
+    # Per plan id, the basket items it stocks.
+    plan_items: Dict[str, List[trade_lib.ItemSummary]]
+    ladders: Dict[int, Dict[int, order_book.PriceLadder]]
+    fair_prices: Dict[int, Optional[float]]
+    industry_items: Dict[int, float]
+    assets: asset_store.AssetIndex
+    my_orders: Dict[int, Dict[int, List]]
+    volumes: Dict[int, float]
+
+    @property
+    def items(self) -> Dict[int, trade_lib.ItemSummary]:
+        return {s.ID: s for ss in self.plan_items.values() for s in ss}
+
+def basket_items(args, plans: List[StationPlan], sde_conn: sqlite3.Connection) -> Dict[str, List[trade_lib.ItemSummary]]:
+    """Per plan id, the basket items it stocks."""
+    # The basket is shared, each station takes the top items of it up to its own limit.
+    limits = [plan.limit for plan in plans]
+    basket = top_market_items.load_basket(args, sde_conn, None if None in limits else max(limits))
+    plan_items = {plan.id: [s for s in basket[:plan.limit] if not plan.excluded_mpaths.matches(s.MarketGroup)] for plan in plans}
+    log.info("Basket of items loaded, {} items".format(len(set(s.ID for ss in plan_items.values() for s in ss))))
+    return plan_items
+
+def all_stations(plans: List[StationPlan]) -> Set[int]:
+    res = set()
+    for plan in plans:
+        res |= plan.stations
+    return res
+
+def read_market(args, plans: List[StationPlan], plan_items: Dict[str, List[trade_lib.ItemSummary]], sde_conn: sqlite3.Connection, prices_conn: sqlite3.Connection, industry_conn: sqlite3.Connection) -> MarketState:
+    """The market state, without our assets and orders."""
+    items = {s.ID: s for ss in plan_items.values() for s in ss}
+    oinfo = lib.OrdersetInfo(None, None)
+    ladders = read_station_ladders(args.orderset, set(items.keys()), all_stations(plans), oinfo)
+    log.info("orderset {}: #{}, {}".format(args.orderset, oinfo.Orderset, oinfo.Date))
+
+    return MarketState(
+            oinfo=oinfo,
+            plan_items=plan_items,
+            ladders=ladders,
+            fair_prices=get_fair_prices(prices_conn, items.keys(), oinfo.Date),
+            industry_items=industry.read_items(sde_conn, prices_conn, industry_conn, args.exclude_industry, oinfo.Date),
+            assets=asset_store.AssetIndex(),
+            my_orders={},
+            volumes=lib.get_type_volumes(sde_conn.cursor(), items.keys()))
+
+def market_cache_key(args, plans: List[StationPlan], plan_items: Dict[str, List[trade_lib.ItemSummary]], sde_conn: sqlite3.Connection, prices_conn: sqlite3.Connection, industry_file: str) -> str:
+    """Identifies everything read_market depends on."""
+    key = {
+        'orderset': lib.file_hash(args.orderset),
+        'items': {p: [list(s) for s in items] for p, items in plan_items.items()},
+        'stations': sorted(all_stations(plans)),
+        'price_history': price_history_version(prices_conn),
+        'industry': lib.file_hash(industry_file),
+        'exclude_industry': lib.file_hash(args.exclude_industry) if args.exclude_industry is not None else None,
+        # Volumes and industry inputs come from the SDE.
+        'sde': top_market_items.sde_hashes(sde_conn),
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+# Market states kept in the cache directory: enough for the current orderset
+# and a few recent ones, e.g. while comparing plans between them.
+MARKET_CACHE_KEEP = 4
+
+def prune_market_cache(cache_dir: str, keep: int = MARKET_CACHE_KEEP):
+    """Removes all but the keep most recently used market states."""
+    files = []
+    for f in glob.glob(os.path.join(cache_dir, "market-state-*.pickle")):
+        try:
+            files.append((os.stat(f).st_mtime_ns, f))
+        except FileNotFoundError:
+            pass
+    for _, f in sorted(files, reverse=True)[keep:]:
+        log.info("Removing old market state {}".format(f))
+        try:
+            os.remove(f)
+        except FileNotFoundError:
+            pass
+
+def cached_market(key: str, cache_dir: str, read: Callable[[], MarketState], keep: int = MARKET_CACHE_KEEP) -> MarketState:
+    """read(), with the result cached on disk under key. Only the keep most
+    recently used states are kept."""
+    cache_file = os.path.join(cache_dir, "market-state-{}.pickle".format(key))
+    if os.path.exists(cache_file):
+        log.info("Using cached market state {}".format(cache_file))
+        try:
+            with open(cache_file, "rb") as fh:
+                state = MarketState(**pickle.load(fh))
+            os.utime(cache_file)
+            return state
+        except (pickle.UnpicklingError, AttributeError, EOFError, TypeError) as e:
+            log.warning("Ignoring unreadable market state {}: {}".format(cache_file, e))
+
+    state = read()
+    os.makedirs(cache_dir, exist_ok=True)
+    # The fields rather than the MarketState itself: run as a script, the
+    # class is __main__.MarketState, which plan_server couldn't load.
+    with open(cache_file + ".tmp", "wb") as fh:
+        pickle.dump(vars(state), fh, pickle.HIGHEST_PROTOCOL)
+    os.replace(cache_file + ".tmp", cache_file)
+    prune_market_cache(cache_dir, keep)
+    return state
+
+def load_state(args, plans: List[StationPlan], sde_conn: sqlite3.Connection, prices_conn: sqlite3.Connection, industry_conn: sqlite3.Connection, cache_dir: Optional[str] = None, industry_file: str = "industry.db") -> MarketState:
+    """The market state with our assets and orders. With a cache_dir, the
+    rest is reused from an earlier run with the same orderset, basket,
+    prices and industry data, so that re-planning after assets or orders
+    changed doesn't read the orderset again; asset and order files are
+    cached there too, until they change."""
+    plan_items = basket_items(args, plans, sde_conn)
+    read = lambda: read_market(args, plans, plan_items, sde_conn, prices_conn, industry_conn)
+    if cache_dir is None:
+        state = read()
+    else:
+        state = cached_market(market_cache_key(args, plans, plan_items, sde_conn, prices_conn, industry_file), cache_dir, read)
+    return replace(state,
+                   assets=read_assets(args.assets, cache_dir) if args.assets else asset_store.AssetIndex(),
+                   my_orders=read_orders_by_location(args.orders, cache_dir) if args.orders else {})
+
+def plan_station(sde_conn: sqlite3.Connection, state: MarketState, plan: StationPlan, markups: Markups = DEFAULT_MARKUPS, stock_fraction: Optional[float] = None, competitor_weight: float = 1.0) -> List[Result]:
+    """The plan for one station. stock_fraction defaults to the plan's own."""
+    if stock_fraction is None:
+        stock_fraction = plan.stock_fraction
+    items = state.plan_items[plan.id]
+    model = {s.ID: price_item(s, state.fair_prices.get(s.ID), markups) for s in items}
+    item_stocks, lowest_sell = station_stocks(state.ladders, model, plan.stations)
+    ids = [i for i in item_stocks if i in lowest_sell]
+    station_orders = state.my_orders.get(plan.to_station, {})
+    basket = Basket(
+            items=[model[i] for i in ids],
+            min_orders=[trade_lib.get_order_size(model[i].trade).MinOrderSize for i in ids],
+            stocks=[item_stocks[i] for i in ids],
+            lowest_sell=[lowest_sell[i] for i in ids],
+            assets=[state.assets.near(i, plan.asset_stations) for i in ids],
+            orders=[station_orders.get(i) for i in ids],
+            industry_costs=[state.industry_items.get(i) for i in ids],
+            ladders=[state.ladders.get(i, {}) for i in ids],
+            volumes=[state.volumes.get(i, 0.0) for i in ids])
+    return plan_basket(sde_conn, plan.to_station, basket, plan.from_stations, stock_fraction, competitor_weight, lib.get_station_names(sde_conn, plan.stations))
+
 def item_order_key(conn: sqlite3.Connection, s: trade_lib.ItemSummary):
     info = lib.get_type_info(conn.cursor(), s.ID)
     return (info.CategoryName, info.GroupName, s.Name)
 
+def write_plan(fh, trade_suggestions: List[Result], order_keys: Dict[int, tuple]):
+    w = csv.writer(fh)
+    w.writerow(["TypeID", "Item Name", "Buy Quantity", "Max Buy", "My Quantity", "Sell Quantity", "My Sell Price", "Stock Quantity", "From StationIDs", "From Station Names", "From Quantities", "IndustryCost", "Build Quantity", "Adjust Order?", "Notes"])
+    for s in sorted(trade_suggestions, key=lambda x: order_keys[x.ID]):
+        w.writerow([s.ID, s.Name, s.BuyQuantity, '{:.2f}'.format(s.MaxBuy), s.MyAssets + s.MyCurrentSell, s.SellQuantity, "{:.2f}".format(s.MySell), s.StockQuantity, ",".join(str(x) for x in s.FromStationIDs), s.FromStationName, ",".join(str(x) for x in s.FromQuantities) or "-", "{:.2f}".format(s.IndustryCost) if s.IndustryCost else '', s.BuildQuantity, s.AdjustOrder, ",".join(s.Notes)])
+
+# Planning settings to try: the stock fraction (None for each plan's own),
+# the markups and the competitor weight.
+SweepPoint = namedtuple('SweepPoint', ['StockFraction', 'Markups', 'CompetitorWeight'])
+NORMAL_POINT = SweepPoint(StockFraction=None, Markups=DEFAULT_MARKUPS, CompetitorWeight=1.0)
+
+# An item whose buy, build or sell quantity differs from the normal plan.
+PlanChange = namedtuple('PlanChange', ['ID', 'Name', 'BaseBuy', 'Buy', 'BaseBuild', 'Build', 'BaseSell', 'Sell'])
+
+def parse_markups(s: str) -> Markups:
+    parts = s.split(':')
+    if len(parts) != 3:
+        raise ArgumentTypeError("markups should be buy:new sell:sell, e.g. 1.01:1.24:1.26, not '{}'".format(s))
+    return Markups(*(float(p) for p in parts))
+
+def sweeping(args) -> bool:
+    return any(x is not None for x in (args.sweep_stock_fractions, args.sweep_markups, args.sweep_competitor_weights))
+
+def sweep_points(stock_fractions: Optional[List[float]], markups: Optional[List[Markups]], competitor_weights: Optional[List[float]]) -> List[SweepPoint]:
+    """The grid of settings, each setting left out keeping its normal value."""
+    return [SweepPoint(*p) for p in itertools.product(
+        stock_fractions or [NORMAL_POINT.StockFraction],
+        markups or [NORMAL_POINT.Markups],
+        competitor_weights or [NORMAL_POINT.CompetitorWeight])]
+
+def evaluate_point(sde_conn: sqlite3.Connection, plans: List[StationPlan], state: MarketState, point: SweepPoint) -> Dict[str, List[Result]]:
+    return {plan.id: plan_station(sde_conn, state, plan, point.Markups, point.StockFraction, point.CompetitorWeight) for plan in plans}
+
+# Set in each worker process by _init_sweep_worker, so the market state is
+# sent to each worker once rather than with every point.
+_sweep = None
+
+def _init_sweep_worker(plans: List[StationPlan], state: MarketState):
+    global _sweep
+    _sweep = (sqlite3.connect("sde.db"), plans, state)
+
+def _evaluate_point(point: SweepPoint) -> Dict[str, List[Result]]:
+    return evaluate_point(*_sweep, point)
+
+def evaluate_sweep(sde_conn: sqlite3.Connection, plans: List[StationPlan], state: MarketState, points: List[SweepPoint], jobs: int = 1) -> List[Dict[str, List[Result]]]:
+    """The plans for each point, in the order of points."""
+    if jobs <= 1 or len(points) <= 1:
+        return [evaluate_point(sde_conn, plans, state, p) for p in points]
+    with multiprocessing.Pool(min(jobs, len(points)), initializer=_init_sweep_worker, initargs=(plans, state)) as pool:
+        return pool.map(_evaluate_point, points)
+
+def plan_capital(results: List[Result], ladders: Dict[int, Dict[int, order_book.PriceLadder]], from_stations: Dict[int, dict], volumes: Dict[int, float]) -> Tuple[float, float]:
+    """ISK needed to buy and deliver, and to build, what a plan says."""
+    buy = 0.0
+    build = 0.0
+    for r in results:
+        if r.BuildQuantity and r.IndustryCost:
+            build += r.BuildQuantity * r.IndustryCost
+        if r.BuyQuantity == 0: continue
+        for station, quantity in zip(r.FromStationIDs, r.FromQuantities):
+            ladder = ladders.get(r.ID, {}).get(station)
+            cost = ladder.cost_to_acquire(quantity) if ladder is not None else None
+            if cost is None:
+                cost = quantity * r.MaxBuy
+            costs = from_stations.get(station, {})
+            buy += cost * (1 + costs.get('isk_cost', 0)) + quantity * costs.get('vol_cost', 0) * volumes.get(r.ID, 0.0)
+    return buy, build
+
+def plan_diff(base: List[Result], other: List[Result]) -> List[PlanChange]:
+    """Items whose buy, build or sell quantities differ between two plans for the same station."""
+    before = {r.ID: r for r in base}
+    after = {r.ID: r for r in other}
+    def quantities(r: Optional[Result]) -> Tuple[int, int, int]:
+        return (r.BuyQuantity, r.BuildQuantity or 0, r.SellQuantity) if r is not None else (0, 0, 0)
+    res = []
+    for i in sorted(before.keys() | after.keys()):
+        b, a = quantities(before.get(i)), quantities(after.get(i))
+        if a == b: continue
+        res.append(PlanChange(i, (before.get(i) or after.get(i)).Name, b[0], a[0], b[1], a[1], b[2], a[2]))
+    return res
+
+def run_sweep(args, plans: List[StationPlan], state: MarketState, sde_conn: sqlite3.Connection):
+    """Writes the capital needed for each point of the grid given by the
+    --sweep options, and optionally how each plan differs from the normal one."""
+    points = sweep_points(args.sweep_stock_fractions, args.sweep_markups, args.sweep_competitor_weights)
+    log.info("sweeping {} settings for {} stations".format(len(points), len(plans)))
+    normal, *results = evaluate_sweep(sde_conn, plans, state, [NORMAL_POINT] + points, args.jobs)
+
+    setting_header = ["Station", "Stock Fraction", "Buy Markup", "New Sell Markup", "Sell Markup", "Competitor Weight"]
+    def setting(plan: StationPlan, point: SweepPoint) -> list:
+        return [plan.id, point.StockFraction if point.StockFraction is not None else plan.stock_fraction,
+                point.Markups.Buy, point.Markups.NewSell, point.Markups.Sell, point.CompetitorWeight]
+
+    summary = open(args.sweep_output, "wt") if args.sweep_output is not None else sys.stdout
+    w = csv.writer(summary)
+    w.writerow(setting_header + ["Items Bought", "Items Built", "Buy ISK", "Build ISK", "Changed Items"])
+    diff = None
+    if args.sweep_diff is not None:
+        diff = open(args.sweep_diff, "wt")
+        dw = csv.writer(diff)
+        dw.writerow(setting_header + ["TypeID", "Item Name", "Normal Buy Quantity", "Buy Quantity", "Normal Build Quantity", "Build Quantity", "Normal Sell Quantity", "Sell Quantity"])
+    for point, plan_results in zip(points, results):
+        for plan in plans:
+            r = plan_results[plan.id]
+            buy, build = plan_capital(r, state.ladders, plan.from_stations, state.volumes)
+            changes = plan_diff(normal[plan.id], r)
+            w.writerow(setting(plan, point) + [
+                sum(1 for x in r if x.BuyQuantity > 0), sum(1 for x in r if x.BuildQuantity), '{:.2f}'.format(buy), '{:.2f}'.format(build), len(changes)])
+            if diff is not None:
+                for c in changes:
+                    dw.writerow(setting(plan, point) + list(c))
+    if summary is not sys.stdout:
+        summary.close()
+    if diff is not None:
+        diff.close()
+
 def main():
     logging.basicConfig(format='%(name)s - %(levelname)s - %(message)s', level=logging.DEBUG)
     arg_parser = ArgumentParser(prog='market_filler.py')
     arg_parser.add_argument('--orderset', type=str)
     arg_parser.add_argument('--limit-top-traded-items', type=int)
     arg_parser.add_argument('--top-traded-items', type=str)
-    arg_parser.add_argument('--station', type=str)
+    top_market_items.add_basket_args(arg_parser)
+    arg_parser.add_argument('--station', nargs='+', type=str, help='ids from the sources file')
     arg_parser.add_argument('--stock_fraction', type=float, default=0.02)
     arg_parser.add_argument('--sources', type=str)
     arg_parser.add_argument('--assets', nargs='*', type=str)
     arg_parser.add_argument('--orders', nargs='*', type=str)
     arg_parser.add_argument('--exclude_market_paths', type=str)
     arg_parser.add_argument('--exclude_industry', type=str)
+    arg_parser.add_argument('--output', type=str, help="file to write each station's plan to, '{id}' is replaced by the lower-cased station id (default stdout, for a single station)")
+    arg_parser.add_argument('--sweep-stock-fractions', nargs='+', type=float, help='instead of writing plans, compare plans for these stock fractions, see --sweep-output')
+    arg_parser.add_argument('--sweep-markups', nargs='+', type=parse_markups, help='buy:new sell:sell multiples of the fair price to compare, e.g. 1.01:1.24:1.26')
+    arg_parser.add_argument('--sweep-competitor-weights', nargs='+', type=float, help='how much competitor stock reduces our target stock, 1 when not sweeping')
+    arg_parser.add_argument('--sweep-output', type=str, help='capital needed for each setting of the sweep (default stdout)')
+    arg_parser.add_argument('--sweep-diff', type=str, help='file to write how each plan of the sweep differs from the normal plan')
+    arg_parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='processes to sweep with')
+    arg_parser.add_argument('--no_cache', action='store_true', help='read the orderset, prices and industry data even if cached')
     args = arg_parser.parse_args()
+    if args.output is None and len(args.station) > 1 and not sweeping(args):
+        arg_parser.error("--output is required for more than one station")
 
     sde_conn = sqlite3.connect("sde.db")
     prices_conn = sqlite3.connect("market-prices.db")
     industry_conn = sqlite3.connect("industry.db")
-    excluded_mpaths = read_market_paths(args.exclude_market_paths) if args.exclude_market_paths is not None else []
-
-    to_station, from_stations = get_sources(sde_conn, args.station, args.sources)
-    logging.info("assessing market needs for {}".format(to_station))
-    logging.info("source stations {}".format(','.join([str(x) for x in from_stations.keys()])))
-    with open(args.top_traded_items, "rt") as tt_fh:
-        items = {}
-        for s in trade_lib.get_most_traded_items(tt_fh, args.limit_top_traded_items):
-            excluded = False
-            for x in excluded_mpaths:
-                if fnmatch(s.MarketGroup, x):
-                    excluded = True
-                    break
-            if excluded: continue
-            items[s.ID] = s 
-        log.info("Basket of items loaded, {} items".format(len(items)))
-
-    oinfo = get_orderset_info(args.orderset)
-    log.info("orderset {}: #{}, {}".format(args.orderset, oinfo.Orderset, oinfo.Date))
-    market_model = {
-            i: pick_prices(prices_conn, item, oinfo.Date) for i, item in items.items()}
-    market_model = {i: m for i, m in market_model.items() if m is not None}
-
-    industry_items = industry.read_items(sde_conn, prices_conn, industry_conn, args.exclude_industry, oinfo.Date)
-    assets = read_assets(args.assets) if args.assets else {}
-    orders = read_orders(to_station, args.orders) if args.orders else {}
-
-    all_stations = set(from_stations.keys())
-    all_stations.add(to_station)
-    item_stocks, lowest_sell = process_orderset(args.orderset, market_model, all_stations)
-
-    trade_suggestions = [
-            decide_actions(sde_conn, to_station, market_model[i], s, lowest_sell[i], from_stations, assets.get(i, 0), orders.get(i), industry_items, args.stock_fraction)
-            for i, s in item_stocks.items() if i in lowest_sell]
-
-    w = csv.writer(sys.stdout)
-    w.writerow(["TypeID", "Item Name", "Buy Quantity", "Max Buy", "My Quantity", "Sell Quantity", "My Sell Price", "Stock Quantity", "From StationIDs", "From Station Names", "IndustryCost", "Build Quantity", "Adjust Order?", "Notes"])
-    for s in sorted(trade_suggestions, key=lambda x: item_order_key(sde_conn, market_model[x[0]].trade)):
-        w.writerow([s.ID, s.Name, s.BuyQuantity, '{:.2f}'.format(s.MaxBuy), s.MyAssets + s.MyCurrentSell, s.SellQuantity, "{:.2f}".format(s.MySell), s.StockQuantity, s.FromStationID, s.FromStationName, "{:.2f}".format(s.IndustryCost) if s.IndustryCost else '', s.BuildQuantity, s.AdjustOrder, ",".join(s.Notes)])
+
+    plans = get_plans(sde_conn, args.station, args.sources, args.limit_top_traded_items, args.stock_fraction, args.exclude_market_paths)
+    for plan in plans:
+        logging.info("assessing market needs for {} ({})".format(plan.id, plan.to_station))
+        logging.info("source stations {}".format(','.join([str(x) for x in plan.from_stations.keys()])))
+
+    state = load_state(args, plans, sde_conn, prices_conn, industry_conn, None if args.no_cache else top_market_items.CACHE_DIR)
+
+    if sweeping(args):
+        run_sweep(args, plans, state, sde_conn)
+        return
+
+    order_keys = {i: item_order_key(sde_conn, item) for i, item in state.items.items()}
+    for plan in plans:
+        trade_suggestions = plan_station(sde_conn, state, plan)
+
+        if args.output is None:
+            write_plan(sys.stdout, trade_suggestions, order_keys)
+        else:
+            fname = args.output.format(id=plan.id.lower())
+            with open(fname, "wt") as fh:
+                write_plan(fh, trade_suggestions, order_keys)
+            log.info("plan for {} written to {}".format(plan.id, fname))
 
 
 if __name__ == "__main__":
@@ -4,7 +4,10 @@ import csv
 import datetime
 import io
 import logging
+import os
+import random
 import sqlite3
+import tempfile
 from typing import List
 import unittest
 
@@ -63,6 +66,17 @@ class TestPickPrices(unittest.TestCase):
         self.assertEqual(p.sell, 138.6)
         self.assertEqual(p.newSell, 136.4)
 
+    def testMarkups(self):
+        self.AddPrices(1, self.TODAY, self.JITA, [100]*3, [110]*3, [1000]*3)
+
+        p = m.pick_prices(self.conn, self.ts(1), self.TODAY, m.Markups(Buy=1.0, NewSell=1.5, Sell=2.0))
+        self.assertEqual((110, 165, 220), (p.buy, p.newSell, p.sell))
+
+    def testNoFairPrice(self):
+        p = m.price_item(self.ts(1), None)
+        self.assertIsNone(p.buy)
+        self.assertEqual(["no fair price available"], p.notes)
+
 class TestProcessOrderset(unittest.TestCase):
     JITA = 60003760
     AMARR = 60008494
@@ -83,8 +97,65 @@ class TestProcessOrderset(unittest.TestCase):
         self.assertEqual(lowest[im.trade.ID][1], self.JITA)
         self.assertEqual(lowest[im.trade.ID][0], 72.99)
 
+    def testStationStocksPerPlan(self):
+        im = m.ItemModel(self.ts(12608), buy=80, sell=90, newSell=90, notes=[])
+        ladders = m.read_station_ladders("testdata/orderset4.csv.gz", {im.trade.ID}, {self.JITA, self.AMARR}, m.lib.OrdersetInfo(None, None))
+        stock, lowest = m.station_stocks(ladders, {im.trade.ID: im}, {self.JITA})
+        self.assertEqual([12066461, 21482637], stock[im.trade.ID][self.JITA])
+        self.assertNotIn(self.AMARR, stock[im.trade.ID])
+        _, lowest = m.station_stocks(ladders, {im.trade.ID: im}, {self.AMARR})
+        self.assertEqual(self.AMARR, lowest[im.trade.ID][1])
+
+class TestGetPlans(unittest.TestCase):
+    SOURCES = """
+- id: A
+  to: Station A
+  limit: 10
+  stock_fraction: 0.04
+  from:
+    - name: Station B
+      isk_cost: 0.007
+- id: B
+  to: Station B
+  assets_near:
+    - Station A
+  from:
+    - name: Station A
+"""
+
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        self.conn.execute("""
+        CREATE TABLE Stations(
+          ID       INT PRIMARY KEY NOT NULL,
+          Name     TEXT NOT NULL,
+          SystemID INT NOT NULL,
+          RegionID INT NOT NULL
+        );""")
+        self.conn.executemany("""INSERT INTO Stations VALUES(?,?,?,?);""", [(1, "Station A", 1, 1), (2, "Station B", 2, 1)])
+        self.sources = tempfile.NamedTemporaryFile(mode="wt", suffix=".yaml")
+        self.sources.write(self.SOURCES)
+        self.sources.flush()
+
+    def tearDown(self):
+        self.sources.close()
+
+    def testPerStationSettings(self):
+        a, b = m.get_plans(self.conn, ["A", "B"], self.sources.name, 100, 0.02, None)
+        self.assertEqual(("A", 1, {2}, 10, 0.04), (a.id, a.to_station, set(a.from_stations), a.limit, a.stock_fraction))
+        self.assertEqual(("B", 2, {1}, 100, 0.02), (b.id, b.to_station, set(b.from_stations), b.limit, b.stock_fraction))
+        self.assertEqual({1, 2}, a.stations)
+        self.assertEqual({1}, a.asset_stations)
+        self.assertEqual({1, 2}, b.asset_stations)
+
+    def testUnknownStation(self):
+        with self.assertRaises(RuntimeError):
+            m.get_plans(self.conn, ["C"], self.sources.name, 100, 0.02, None)
+
 class TestSuggestStock(unittest.TestCase):
     ALLOW = [60003760, 60008494]
+    # The source stations, with no hauling costs.
+    SOURCES = {s: {'isk_cost': 0, 'vol_cost': 0} for s in ALLOW}
     DEST = 60005686
 
     def setUp(self):
@@ -112,7 +183,7 @@ class TestSuggestStock(unittest.TestCase):
             self.ALLOW[0]: [2000, 2000],
             self.ALLOW[1]: [1000, 1000],
             self.DEST: [0, 1000],
-            }, (78.4, self.ALLOW[0]), set(self.ALLOW), 0, None, {}, 0.04)
+            }, (78.4, self.ALLOW[0]), self.SOURCES, 0, None, {}, 0.04)
         self.assertEqual(r.ID, 1)
         self.assertEqual(r.MyAssets, 0)
         self.assertEqual(r.MyCurrentSell, 0)
@@ -126,7 +197,7 @@ class TestSuggestStock(unittest.TestCase):
             self.ALLOW[0]: [2000, 2000],
             self.ALLOW[1]: [1000, 1000],
             self.DEST: [0, 0],
-            }, (78.4, self.ALLOW[0]), set(self.ALLOW), 1000, None, {}, 0.04)
+            }, (78.4, self.ALLOW[0]), self.SOURCES, 1000, None, {}, 0.04)
         self.assertEqual(r.ID, 1)
         self.assertEqual(r.Name, "Item1")
         self.assertEqual(r.MyAssets, 1000)
@@ -140,10 +211,10 @@ class TestSuggestStock(unittest.TestCase):
             self.ALLOW[0]: [0, 10000],
             self.ALLOW[1]: [0, 1000],
             self.DEST: [0, 0],
-            }, (78.4, self.ALLOW[0]), set(self.ALLOW), 0, None, {}, 0.04)
+            }, (78.4, self.ALLOW[0]), self.SOURCES, 0, None, {}, 0.04)
         self.assertEqual(r.ID, 1)
         self.assertEqual(r.Name, "Item1")
-        self.assertEqual(r.FromStationID, None)
+        self.assertEqual(r.FromStationIDs, ())
         self.assertEqual(r.FromStationName, '-')
         self.assertIn("not available", "".join(r.Notes))
 
@@ -153,10 +224,10 @@ class TestSuggestStock(unittest.TestCase):
             self.ALLOW[0]: [0, 10000],
             self.ALLOW[1]: [0, 1000],
             self.DEST: [0, 0],
-            }, (78.4, self.ALLOW[0]), set(self.ALLOW), 2, None, {}, 0.04)
+            }, (78.4, self.ALLOW[0]), self.SOURCES, 2, None, {}, 0.04)
         self.assertEqual(r.ID, 1)
         self.assertEqual(r.Name, "Item1")
-        self.assertEqual(r.FromStationID, None)
+        self.assertEqual(r.FromStationIDs, ())
         self.assertEqual(r.FromStationName, '-')
         self.assertEqual(r.MyAssets, 2)
         self.assertEqual(r.BuyQuantity, 0)
@@ -168,11 +239,11 @@ class TestSuggestStock(unittest.TestCase):
         r = m.decide_actions(self.sde_conn, self.DEST, im, {
             self.ALLOW[0]: [1000, 1000],
             self.DEST: [0, 0],
-            }, (78.4, self.ALLOW[0]), set(self.ALLOW), 0, None, {}, 0.04)
+            }, (78.4, self.ALLOW[0]), self.SOURCES, 0, None, {}, 0.04)
         self.assertEqual(r.ID, 1)
         self.assertEqual(r.Name, "Item1")
         self.assertEqual(r.BuyQuantity, 5)
-        self.assertEqual(r.FromStationID, self.ALLOW[0])
+        self.assertEqual(r.FromStationIDs, (self.ALLOW[0],))
         self.assertEqual(r.FromStationName, 'Jita 4-4')
 
     def testBuyReducedByExistingStock(self):
@@ -180,19 +251,19 @@ class TestSuggestStock(unittest.TestCase):
         r = m.decide_actions(self.sde_conn, self.DEST, im, {
             self.ALLOW[0]: [1000, 1000],
             self.DEST: [0, 0],
-            }, (78.4, self.ALLOW[0]), set(self.ALLOW), 2, None, {}, 0.04)
+            }, (78.4, self.ALLOW[0]), self.SOURCES, 2, None, {}, 0.04)
         self.assertEqual(r.ID, 1)
         self.assertEqual(r.Name, "Item1")
         self.assertEqual(r.BuyQuantity, 3)
         self.assertEqual(r.SellQuantity, 5)
-        self.assertEqual(r.FromStationID, self.ALLOW[0])
+        self.assertEqual(r.FromStationIDs, (self.ALLOW[0],))
 
     def testBuyReducedToZeroByCompetitorStock(self):
         im = m.ItemModel(self.ts(1), buy=80, sell=90, newSell=90, notes=[])
         r = m.decide_actions(self.sde_conn, self.DEST, im, {
             self.ALLOW[0]: [1000, 1000],
             self.DEST: [0, 2],
-            }, (78.4, self.ALLOW[0]), set(self.ALLOW), 0, None, {}, 0.04)
+            }, (78.4, self.ALLOW[0]), self.SOURCES, 0, None, {}, 0.04)
         self.assertEqual(r.ID, 1)
         self.assertEqual(r.Name, "Item1")
         self.assertEqual(r.BuyQuantity, 0)
@@ -204,13 +275,23 @@ class TestSuggestStock(unittest.TestCase):
         r = m.decide_actions(self.sde_conn, self.DEST, im, {
             self.ALLOW[0]: [1000, 1000],
             self.DEST: [0, 2],
-            }, (78.4, self.ALLOW[0]), set(self.ALLOW), 0, None, {}, 0.04)
+            }, (78.4, self.ALLOW[0]), self.SOURCES, 0, None, {}, 0.04)
         self.assertEqual(r.ID, 1)
         self.assertEqual(r.Name, "Item1")
         self.assertEqual(r.BuyQuantity, 6)
         self.assertEqual(r.SellQuantity, 6)
         self.assertEqual(r.StockQuantity, 8)
-        self.assertEqual(r.FromStationID, self.ALLOW[0])
+        self.assertEqual(r.FromStationIDs, (self.ALLOW[0],))
+
+    def testCompetitorWeight(self):
+        for weight, stock in [(0, 10), (0.5, 9), (2, 6)]:
+            im = m.ItemModel(self.ts(1), buy=40, sell=45, newSell=90, notes=[])
+            r = m.decide_actions(self.sde_conn, self.DEST, im, {
+                self.ALLOW[0]: [1000, 1000],
+                self.DEST: [0, 2],
+                }, (78.4, self.ALLOW[0]), self.SOURCES, 0, None, {}, 0.04, competitor_weight=weight)
+            self.assertEqual(r.StockQuantity, stock)
+            self.assertEqual(r.BuyQuantity, stock - 2)
 
     def testBuyFromLowestPriceStation(self):
         im = m.ItemModel(self.ts(1), buy=80, sell=90, newSell=90, notes=[])
@@ -218,12 +299,12 @@ class TestSuggestStock(unittest.TestCase):
             self.ALLOW[0]: [10000, 10000],
             self.ALLOW[1]: [1000, 1000],
             self.DEST: [0, 0],
-            }, (78.4, self.ALLOW[1]), set(self.ALLOW), 0, None, {}, 0.04)
+            }, (78.4, self.ALLOW[1]), self.SOURCES, 0, None, {}, 0.04)
         self.assertEqual(r.ID, 1)
         self.assertEqual(r.Name, "Item1")
         self.assertEqual(r.BuyQuantity, 5)
         self.assertEqual(r.SellQuantity, 5)
-        self.assertEqual(r.FromStationID, self.ALLOW[1])
+        self.assertEqual(r.FromStationIDs, (self.ALLOW[1],))
 
     def testDontBuyFromLowestPriceStationIfNoStock(self):
         im = m.ItemModel(self.ts(1), buy=80, sell=90, newSell=90, notes=[])
@@ -231,12 +312,44 @@ class TestSuggestStock(unittest.TestCase):
             self.ALLOW[0]: [0, 10000],
             self.ALLOW[1]: [0, 1000],
             self.DEST: [0, 0],
-            }, (100, self.ALLOW[1]), set(self.ALLOW), 0, None, {}, 0.04)
+            }, (100, self.ALLOW[1]), self.SOURCES, 0, None, {}, 0.04)
         self.assertEqual(r.ID, 1)
         self.assertEqual(r.Name, "Item1")
         self.assertEqual(r.SellQuantity, 0)
         self.assertEqual(r.BuyQuantity, 0)
-        self.assertEqual(r.FromStationID, None)
+        self.assertEqual(r.FromStationIDs, ())
+
+    def testSplitBuyAcrossStations(self):
+        im = m.ItemModel(self.ts(1), buy=80, sell=90, newSell=90, notes=[])
+        ladders = {
+            self.ALLOW[0]: m.order_book.PriceLadder([(70, 3), (85, 100)]),
+            self.ALLOW[1]: m.order_book.PriceLadder([(75, 3)]),
+        }
+        r = m.decide_actions(self.sde_conn, self.DEST, im, {
+            self.ALLOW[0]: [3, 3],
+            self.ALLOW[1]: [3, 3],
+            self.DEST: [0, 0],
+            }, (70, self.ALLOW[0]), self.SOURCES, 0, None, {}, 0.04, ladders)
+        # 3 from Jita at 70, the other 2 from Amarr at 75 rather than Jita at 85.
+        self.assertEqual(r.BuyQuantity, 5)
+        self.assertEqual(r.FromStationIDs, (self.ALLOW[0], self.ALLOW[1]))
+        self.assertEqual(r.FromStationName, "Jita 4-4,Amarr EFA")
+        self.assertEqual(r.FromQuantities, (3, 2))
+
+    def testBuyAtLowestLandedCost(self):
+        im = m.ItemModel(self.ts(1), buy=80, sell=90, newSell=90, notes=[])
+        ladders = {
+            self.ALLOW[0]: m.order_book.PriceLadder([(70, 100)]),
+            self.ALLOW[1]: m.order_book.PriceLadder([(75, 100)]),
+        }
+        sources = {self.ALLOW[0]: {'isk_cost': 0.0, 'vol_cost': 1000}, self.ALLOW[1]: {'isk_cost': 0.0, 'vol_cost': 0}}
+        r = m.decide_actions(self.sde_conn, self.DEST, im, {
+            self.ALLOW[0]: [100, 100],
+            self.ALLOW[1]: [100, 100],
+            self.DEST: [0, 0],
+            }, (70, self.ALLOW[0]), sources, 0, None, {}, 0.04, ladders, 0.01)
+        self.assertEqual(r.BuyQuantity, 5)
+        self.assertEqual(r.FromStationIDs, (self.ALLOW[1],))
 
     def testDontBuyIfTooFewNeeded(self):
         im = m.ItemModel(trade_lib.ItemSummary(2, "Charge S", 1, 8, "Ammunition & Charges>Hybrid Charges", 10000), buy=80, sell=90, newSell=90, notes=[])
@@ -244,10 +357,10 @@ class TestSuggestStock(unittest.TestCase):
             self.ALLOW[0]: [10000, 10000],
             self.ALLOW[1]: [0, 1000],
             self.DEST: [0, 0],
-            }, (78.4, self.ALLOW[0]), set(self.ALLOW), 0, None, {}, 0.04)
+            }, (78.4, self.ALLOW[0]), self.SOURCES, 0, None, {}, 0.04)
         self.assertEqual(r.ID, 2)
         self.assertEqual(r.BuyQuantity, 0)
-        self.assertEqual(r.FromStationID, None)
+        self.assertEqual(r.FromStationIDs, ())
         self.assertEqual(r.FromStationName, '-')
         self.assertIn("target stock quantity too low", "".join(r.Notes))
 
@@ -257,12 +370,12 @@ class TestSuggestStock(unittest.TestCase):
             self.ALLOW[0]: [10000, 10000],
             self.ALLOW[1]: [0, 1000],
             self.DEST: [0, 100],
-            }, (78.4, self.ALLOW[0]), set(self.ALLOW), 0, None, {}, 0.04)
+            }, (78.4, self.ALLOW[0]), self.SOURCES, 0, None, {}, 0.04)
         self.assertEqual(r.ID, 1)
         self.assertEqual(r.BuyQuantity, 0)
         self.assertEqual(r.SellQuantity, 0)
         self.assertEqual(r.StockQuantity, 0)
-        self.assertEqual(r.FromStationID, None)
+        self.assertEqual(r.FromStationIDs, ())
         self.assertEqual(r.FromStationName, '-')
         self.assertIn("already in stock", "".join(r.Notes))
 
@@ -272,12 +385,12 @@ class TestSuggestStock(unittest.TestCase):
             self.ALLOW[0]: [10000, 10000],
             self.ALLOW[1]: [0, 1000],
             self.DEST: [0, 10],
-            }, (78.4, self.ALLOW[0]), set(self.ALLOW), 0, [10, 89], {}, 0.04)
+            }, (78.4, self.ALLOW[0]), self.SOURCES, 0, [10, 89], {}, 0.04)
         self.assertEqual(r.ID, 1)
         self.assertEqual(r.BuyQuantity, 0)
         self.assertEqual(r.SellQuantity, 0)
         self.assertEqual(r.StockQuantity, 5)
-        self.assertEqual(r.FromStationID, None)
+        self.assertEqual(r.FromStationIDs, ())
         self.assertEqual(r.FromStationName, '-')
         self.assertIn("already in stock", "".join(r.Notes))
 
@@ -287,12 +400,12 @@ class TestSuggestStock(unittest.TestCase):
             self.ALLOW[0]: [10000, 10000],
             self.ALLOW[1]: [0, 1000],
             self.DEST: [0, 2],
-            }, (78.4, self.ALLOW[0]), set(self.ALLOW), 0, [2, 89], {}, 0.04)
+            }, (78.4, self.ALLOW[0]), self.SOURCES, 0, [2, 89], {}, 0.04)
         self.assertEqual(r.ID, 1)
         self.assertEqual(r.BuyQuantity, 0)
         self.assertEqual(r.SellQuantity, 0)
         self.assertEqual(r.StockQuantity, 5)
-        self.assertEqual(r.FromStationID, None)
+        self.assertEqual(r.FromStationIDs, ())
         self.assertEqual(r.FromStationName, '-')
         self.assertIn("already in stock", "".join(r.Notes))
 
@@ -302,12 +415,12 @@ class TestSuggestStock(unittest.TestCase):
             self.ALLOW[0]: [10000, 10000],
             self.ALLOW[1]: [0, 1000],
             self.DEST: [0, 0],
-            }, (78.4, self.ALLOW[0]), set(self.ALLOW), 0, [5, 100], {}, 0.04)
+            }, (78.4, self.ALLOW[0]), self.SOURCES, 0, [5, 100], {}, 0.04)
         self.assertEqual(r.ID, 1)
         self.assertEqual(r.BuyQuantity, 0)
         self.assertEqual(r.SellQuantity, 0)
         self.assertEqual(r.StockQuantity, 5)
-        self.assertEqual(r.FromStationID, None)
+        self.assertEqual(r.FromStationIDs, ())
         self.assertEqual(r.FromStationName, '-')
         self.assertIn("already listed for sale", "".join(r.Notes))
 
@@ -317,12 +430,12 @@ class TestSuggestStock(unittest.TestCase):
             self.ALLOW[0]: [10000, 10000],
             self.ALLOW[1]: [0, 1000],
             self.DEST: [0, 0],
-            }, (78.4, self.ALLOW[0]), set(self.ALLOW), 5, [5, 100], {}, 0.04)
+            }, (78.4, self.ALLOW[0]), self.SOURCES, 5, [5, 100], {}, 0.04)
         self.assertEqual(r.ID, 1)
         self.assertEqual(r.BuyQuantity, 0)
         self.assertEqual(r.SellQuantity, 0)
         self.assertEqual(r.StockQuantity, 5)
-        self.assertEqual(r.FromStationID, None)
+        self.assertEqual(r.FromStationIDs, ())
         self.assertEqual(r.FromStationName, '-')
         self.assertIn("already listed for sale", "".join(r.Notes))
 
@@ -332,14 +445,148 @@ class TestSuggestStock(unittest.TestCase):
             self.ALLOW[0]: [10000, 10000],
             self.ALLOW[1]: [0, 1000],
             self.DEST: [0, 2],
-            }, (78.4, self.ALLOW[0]), set(self.ALLOW), 2, None, {}, 0.04)
+            }, (78.4, self.ALLOW[0]), self.SOURCES, 2, None, {}, 0.04)
         self.assertEqual(r.ID, 1)
         self.assertEqual(r.BuyQuantity, 0)
         self.assertEqual(r.SellQuantity, 0)
         self.assertEqual(r.StockQuantity, 3)
-        self.assertEqual(r.FromStationID, None)
+        self.assertEqual(r.FromStationIDs, ())
         self.assertEqual(r.FromStationName, '-')
         self.assertIn("already in stock", "".join(r.Notes))
 
+class TestSweep(unittest.TestCase):
+    JITA = 60003760
+    DEST = 60005686
+
+    def setUp(self):
+        self.sde_conn = sqlite3.connect(":memory:")
+        self.sde_conn.execute("""
+        CREATE TABLE Stations(
+          ID       INT PRIMARY KEY NOT NULL,
+          Name     TEXT NOT NULL,
+          SystemID INT NOT NULL,
+          RegionID INT NOT NULL
+        );""")
+        self.sde_conn.executemany("""INSERT INTO Stations VALUES(?,?,?,?);""", [(self.JITA, "Jita 4-4", 1, 1), (self.DEST, "Hek BC", 2, 2)])
+        self.plan = m.StationPlan(id="H", to_station=self.DEST, from_stations={self.JITA: {'isk_cost': 0.1, 'vol_cost': 10}},
+                                  limit=None, stock_fraction=0.04, excluded_mpaths=m.market_paths.compile_patterns([]))
+        items = [trade_lib.ItemSummary(i, "Item{}".format(i), 1, 1, "mgroup", 10000) for i in (1, 2)]
+        self.state = m.MarketState(
+                oinfo=m.lib.OrdersetInfo(1, None),
+                plan_items={"H": items},
+                ladders={
+                    1: {self.JITA: m.order_book.PriceLadder([(30, 5), (35, 100)])},
+                    2: {self.JITA: m.order_book.PriceLadder([(60, 100)])},
+                },
+                fair_prices={1: 40, 2: 50},
+                industry_items={}, assets=m.asset_store.AssetIndex(), my_orders={}, volumes={1: 0.5})
+
+    def testPoints(self):
+        points = m.sweep_points([0.01, 0.02], None, [0.5, 1, 2])
+        self.assertEqual(6, len(points))
+        self.assertEqual(m.SweepPoint(0.01, m.DEFAULT_MARKUPS, 0.5), points[0])
+        self.assertEqual([m.NORMAL_POINT], m.sweep_points(None, None, None))
+
+    def testParseMarkups(self):
+        self.assertEqual(m.Markups(1.01, 1.24, 1.26), m.parse_markups("1.01:1.24:1.26"))
+        with self.assertRaises(m.ArgumentTypeError):
+            m.parse_markups("1.01:1.24")
+
+    def testEvaluate(self):
+        normal, double, high = m.evaluate_sweep(self.sde_conn, [self.plan], self.state, [
+            m.NORMAL_POINT,
+            m.NORMAL_POINT._replace(StockFraction=0.08),
+            m.NORMAL_POINT._replace(Markups=m.Markups(1.5, 1.6, 1.7))])
+        self.assertEqual(m.plan_station(self.sde_conn, self.state, self.plan), normal["H"])
+        # Item2 is above the buy price at Jita until the buy markup is raised.
+        self.assertEqual([(1, 10, (10,))], [(r.ID, r.BuyQuantity, r.FromQuantities) for r in normal["H"] if r.BuyQuantity])
+        self.assertEqual([(1, 20)], [(r.ID, r.BuyQuantity) for r in double["H"] if r.BuyQuantity])
+        self.assertEqual([m.PlanChange(1, "Item1", 10, 20, 0, 0, 10, 20)], m.plan_diff(normal["H"], double["H"]))
+        self.assertEqual([2], [c.ID for c in m.plan_diff(normal["H"], high["H"]) if c.Buy > c.BaseBuy])
+
+    def testOnlyAssetsAtStation(self):
+        self.state.assets = m.asset_store.AssetIndex({(1, self.DEST): 4, (1, self.JITA): 100})
+        r, = [r for r in m.plan_station(self.sde_conn, self.state, self.plan) if r.ID == 1]
+        self.assertEqual((4, 6), (r.MyAssets, r.BuyQuantity))
+        self.plan.assets_near = {self.JITA}
+        r, = [r for r in m.plan_station(self.sde_conn, self.state, self.plan) if r.ID == 1]
+        self.assertEqual((104, 0), (r.MyAssets, r.BuyQuantity))
+
+    def testPlanStationMatchesDecideActions(self):
+        random.seed(1)
+        items = [trade_lib.ItemSummary(i, "Item{}".format(i), 1, 1, "mgroup", random.uniform(1e3, 1e6)) for i in range(1, 200)]
+        self.state.plan_items = {"H": items}
+        self.state.fair_prices = {s.ID: random.uniform(10, 100) for s in items}
+        self.state.ladders = {s.ID: {station: m.order_book.PriceLadder([(self.state.fair_prices[s.ID] * random.uniform(0.8, 1.4), random.randint(1, 50)) for _ in range(5)])
+                                     for station in (self.JITA, self.DEST) if random.random() < 0.9} for s in items}
+        self.state.industry_items = {s.ID: self.state.fair_prices[s.ID] * 0.8 for s in items[::7]}
+        self.state.assets = m.asset_store.AssetIndex({(s.ID, self.DEST): 3 for s in items[::5]})
+        self.state.my_orders = {self.DEST: {s.ID: [2, self.state.fair_prices[s.ID] * 1.3] for s in items[::9]}}
+        self.state.volumes = {s.ID: random.uniform(0.01, 10) for s in items}
+
+        model = {s.ID: m.price_item(s, self.state.fair_prices[s.ID]) for s in items}
+        stocks, lowest_sell = m.station_stocks(self.state.ladders, model, self.plan.stations)
+        expected = [m.decide_actions(self.sde_conn, self.DEST, model[i], s, lowest_sell[i], self.plan.from_stations, self.state.assets.at(i, self.DEST),
+                                     self.state.my_orders[self.DEST].get(i), self.state.industry_items, self.plan.stock_fraction, self.state.ladders[i], self.state.volumes[i])
+                    for i, s in stocks.items() if i in lowest_sell]
+        self.assertEqual(expected, m.plan_station(self.sde_conn, self.state, self.plan))
+        self.assertTrue(any(r.BuyQuantity for r in expected))
+        self.assertTrue(any(r.BuildQuantity for r in expected))
+
+    def testCapital(self):
+        normal, = m.evaluate_sweep(self.sde_conn, [self.plan], self.state, [m.NORMAL_POINT])
+        buy, build = m.plan_capital(normal["H"], self.state.ladders, self.plan.from_stations, self.state.volumes)
+        # 5 at 30 and 5 at 35, plus 10% and 5 ISK a unit to haul.
+        self.assertAlmostEqual(325 * 1.1 + 10 * 5, buy)
+        self.assertEqual(0, build)
+
+class TestMarketCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.reads = 0
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def read(self) -> m.MarketState:
+        self.reads += 1
+        return m.MarketState(oinfo=m.lib.OrdersetInfo(128142, None), plan_items={},
+                             ladders={1: {2: m.order_book.PriceLadder([(70, 3), (85, 100)])}},
+                             fair_prices={1: 80}, industry_items={}, assets=m.asset_store.AssetIndex(), my_orders={}, volumes={})
+
+    def testReusedForSameKey(self):
+        first = m.cached_market("k", self.dir.name, self.read)
+        second = m.cached_market("k", self.dir.name, self.read)
+        self.assertEqual(1, self.reads)
+        self.assertEqual(first.oinfo, second.oinfo)
+        self.assertEqual(first.ladders[1][2].cost_to_acquire(5), second.ladders[1][2].cost_to_acquire(5))
+
+    def testReadForNewKey(self):
+        m.cached_market("k", self.dir.name, self.read)
+        m.cached_market("k2", self.dir.name, self.read)
+        self.assertEqual(2, self.reads)
+
+    def cached(self) -> List[str]:
+        return sorted(f for f in os.listdir(self.dir.name) if f.startswith("market-state-"))
+
+    def testKeepsMostRecentlyUsed(self):
+        for i in range(4):
+            m.cached_market("k{}".format(i), self.dir.name, self.read, keep=3)
+            os.utime(os.path.join(self.dir.name, "market-state-k{}.pickle".format(i)), (i, i))
+        self.assertEqual(["market-state-k1.pickle", "market-state-k2.pickle", "market-state-k3.pickle"], self.cached())
+        # Using k1 makes it the most recent, so k2 goes next.
+        m.cached_market("k1", self.dir.name, self.read, keep=3)
+        m.cached_market("k4", self.dir.name, self.read, keep=3)
+        self.assertEqual(["market-state-k1.pickle", "market-state-k3.pickle", "market-state-k4.pickle"], self.cached())
+        self.assertEqual(5, self.reads)
+
+    def testUnreadableStateReadAgain(self):
+        with open(os.path.join(self.dir.name, "market-state-k.pickle"), "wb") as fh:
+            fh.write(b"not a pickle")
+        state = m.cached_market("k", self.dir.name, self.read)
+        self.assertEqual(1, self.reads)
+        self.assertEqual(80, state.fair_prices[1])
+        m.cached_market("k", self.dir.name, self.read)
+        self.assertEqual(1, self.reads)
 
 unittest.main()
@@ -0,0 +1,59 @@
+from collections import defaultdict
+import sqlite3
+from typing import Dict, Iterable, List, Tuple
+
+def subtree_types(cur: sqlite3.Cursor, path: str) -> List[int]:
+    """IDs of all types in the market group at path, or any group below it."""
+    res = cur.execute("""
+    SELECT Types.ID
+    FROM MarketGroups JOIN MarketGroupTree ON (MarketGroupTree.AncestorID = MarketGroups.ID)
+        JOIN Types ON (Types.MarketGroupID = MarketGroupTree.DescendantID)
+    WHERE MarketGroups.Path = ?
+    """, [path])
+    return [r[0] for r in res.fetchall()]
+
+def child_group_types(cur: sqlite3.Cursor, path: str) -> Dict[int, str]:
+    """Maps each type below the market group at path to the path of the
+    immediate child group that it falls under."""
+    res = cur.execute("""
+    SELECT Types.ID, Child.Path
+    FROM MarketGroups AS Root
+        JOIN MarketGroupTree AS ToChild ON (ToChild.AncestorID = Root.ID AND ToChild.Depth = 1)
+        JOIN MarketGroups AS Child ON (Child.ID = ToChild.DescendantID)
+        JOIN MarketGroupTree AS Below ON (Below.AncestorID = Child.ID)
+        JOIN Types ON (Types.MarketGroupID = Below.DescendantID)
+    WHERE Root.Path = ?
+    """, [path])
+    return {r[0]: r[1] for r in res.fetchall()}
+
+class SubtreeIndex():
+    """Maps types to the (possibly overlapping) market group subtrees they fall
+    under, so that per-type values can be rolled up for all subtrees in one pass."""
+
+    def __init__(self, cur: sqlite3.Cursor, paths: Iterable[str]):
+        self.paths = list(paths)
+        self._subtrees: Dict[int, List[int]] = defaultdict(list)
+        for i, p in enumerate(self.paths):
+            for type_id in subtree_types(cur, p):
+                self._subtrees[type_id].append(i)
+        self._subtrees = dict(self._subtrees)
+
+    def subtrees_of(self, type_id: int) -> List[int]:
+        """Indices into paths of the subtrees containing type_id."""
+        return self._subtrees.get(type_id, [])
+
+    def rollup(self, values: Iterable[Tuple[int, float]]) -> List[float]:
+        """Sums (type ID, value) pairs per subtree."""
+        totals = [0.0] * len(self.paths)
+        for type_id, v in values:
+            for i in self._subtrees.get(type_id, ()):
+                totals[i] += v
+        return totals
+
+    def count(self, type_ids: Iterable[int]) -> List[int]:
+        """Number of the given types falling in each subtree."""
+        totals = [0] * len(self.paths)
+        for type_id in type_ids:
+            for i in self._subtrees.get(type_id, ()):
+                totals[i] += 1
+        return totals
@@ -0,0 +1,71 @@
+import sqlite3
+import unittest
+
+import market_groups
+
+def make_sde() -> sqlite3.Connection:
+    conn = sqlite3.connect(":memory:")
+    c = conn.cursor()
+    c.execute("""
+    CREATE TABLE Types(
+      ID      INT PRIMARY KEY NOT NULL,
+      Name    TEXT NOT NULL,
+      GroupID INT NOT NULL,
+      MarketGroupID INT,
+      PortionSize INT
+    );""")
+    c.execute("""
+    CREATE TABLE MarketGroups(
+      ID      INT PRIMARY KEY NOT NULL,
+      Path    TEXT NOT NULL
+    );""")
+    c.execute("""
+    CREATE TABLE MarketGroupTree(
+      AncestorID   INT NOT NULL,
+      DescendantID INT NOT NULL,
+      Depth        INT NOT NULL,
+      PRIMARY KEY (AncestorID, DescendantID)
+    );""")
+    c.executemany("""INSERT INTO MarketGroups VALUES(?,?)""", [
+        (1, "Ammunition & Charges"),
+        (2, "Ammunition & Charges>Hybrid Charges"),
+        (3, "Ammunition & Charges>Hybrid Charges>Standard Charges"),
+        (4, "Ammunition & Charges>Projectile Ammo"),
+        (5, "Drones"),
+        ])
+    c.executemany("""INSERT INTO MarketGroupTree VALUES(?,?,?)""", [
+        (1, 1, 0), (2, 2, 0), (3, 3, 0), (4, 4, 0), (5, 5, 0),
+        (1, 2, 1), (1, 3, 2), (2, 3, 1), (1, 4, 1),
+        ])
+    c.executemany("""INSERT INTO Types VALUES(?,?,?,?,?)""", [
+        (10, "Antimatter Charge S", 1, 3, 1),
+        (11, "Void S", 1, 2, 1),
+        (12, "EMP S", 1, 4, 1),
+        (13, "Hobgoblin I", 1, 5, 1),
+        ])
+    return conn
+
+class TestSubtrees(unittest.TestCase):
+    def setUp(self):
+        self.conn = make_sde()
+
+    def testSubtreeTypes(self):
+        self.assertEqual(sorted(market_groups.subtree_types(self.conn, "Ammunition & Charges")), [10, 11, 12])
+        self.assertEqual(sorted(market_groups.subtree_types(self.conn, "Ammunition & Charges>Hybrid Charges")), [10, 11])
+        self.assertEqual(market_groups.subtree_types(self.conn, "Nothing"), [])
+
+    def testChildGroupTypes(self):
+        self.assertEqual(market_groups.child_group_types(self.conn, "Ammunition & Charges"), {
+            10: "Ammunition & Charges>Hybrid Charges",
+            11: "Ammunition & Charges>Hybrid Charges",
+            12: "Ammunition & Charges>Projectile Ammo",
+            })
+
+    def testRollup(self):
+        s = market_groups.SubtreeIndex(self.conn, ["Ammunition & Charges", "Ammunition & Charges>Hybrid Charges", "Drones"])
+        self.assertEqual(s.rollup([(10, 1.0), (12, 2.0), (13, 4.0), (99, 8.0)]), [3.0, 1.0, 4.0])
+        self.assertEqual(s.count([10, 11, 12]), [3, 2, 0])
+        self.assertEqual(s.subtrees_of(10), [0, 1])
+
+
+unittest.main()
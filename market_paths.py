@@ -0,0 +1,111 @@
+from fnmatch import fnmatchcase
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+SEPARATOR = '>'
+_NO_MATCH = object()
+
+def _is_wildcard(segment: str) -> bool:
+    return any(c in segment for c in '*?[')
+
+class _Node():
+    __slots__ = ('children', 'wildcards', 'exact', 'prefix', 'partial')
+
+    def __init__(self):
+        # literal segment -> child
+        self.children: Dict[str, '_Node'] = {}
+        # (fnmatch pattern, child) for segments containing wildcards
+        self.wildcards: List[Tuple[str, '_Node']] = []
+        # lowest rule index matching a path ending exactly here
+        self.exact: Optional[int] = None
+        # lowest rule index matching any path at or below here
+        self.prefix: Optional[int] = None
+        # last segment of a prefix rule -> lowest rule index, matching any
+        # path whose next segment starts with it, and everything below
+        self.partial: Dict[str, int] = {}
+
+class MarketPathMatcher():
+    """Matches market group paths ('A>B>C') against a list of rules.
+
+    Rules are stored in a trie keyed on path segments, so a lookup costs time
+    proportional to the depth of the path rather than the number of rules, and
+    results are memoized per path. Each rule is either
+
+      * a prefix: matches any path starting with it as a string, so the last
+        segment may be cut short ('A>Bx' matches 'A>Bxy>C'), or
+      * an fnmatch-style pattern matching the whole path. As with fnmatch, a
+        wildcard segment may span several levels of the path (so 'A>*>C'
+        matches 'A>X>Y>C').
+
+    When several rules match, the one added first wins."""
+
+    def __init__(self):
+        self._root = _Node()
+        self._values: List[Any] = []
+        self._cache: Dict[str, Optional[int]] = {}
+
+    def add_prefix(self, prefix: str, value: Any):
+        if not prefix:
+            self._root.prefix = self._add_value(self._root.prefix, value)
+            return
+        *segments, last = prefix.split(SEPARATOR)
+        node = self._root
+        for s in segments:
+            node = node.children.setdefault(s, _Node())
+        node.partial[last] = self._add_value(node.partial.get(last), value)
+
+    def add_pattern(self, pattern: str, value: Any = True):
+        node = self._root
+        for s in pattern.split(SEPARATOR):
+            if _is_wildcard(s):
+                for p, child in node.wildcards:
+                    if p == s:
+                        node = child
+                        break
+                else:
+                    child = _Node()
+                    node.wildcards.append((s, child))
+                    node = child
+            else:
+                node = node.children.setdefault(s, _Node())
+        node.exact = self._add_value(node.exact, value)
+
+    def _add_value(self, current: Optional[int], value: Any) -> int:
+        self._cache.clear()
+        self._values.append(value)
+        idx = len(self._values) - 1
+        return idx if current is None else current
+
+    def _match(self, node: _Node, segments: List[str], i: int) -> Optional[int]:
+        best = node.prefix
+        if i == len(segments):
+            return best if node.exact is None or (best is not None and best < node.exact) else node.exact
+        for p, m in node.partial.items():
+            if segments[i].startswith(p) and (best is None or m < best): best = m
+        child = node.children.get(segments[i])
+        if child is not None:
+            m = self._match(child, segments, i + 1)
+            if m is not None and (best is None or m < best): best = m
+        for pattern, child in node.wildcards:
+            # Try the wildcard segment against one or more path segments.
+            for j in range(i + 1, len(segments) + 1):
+                if not fnmatchcase(SEPARATOR.join(segments[i:j]), pattern): continue
+                m = self._match(child, segments, j)
+                if m is not None and (best is None or m < best): best = m
+        return best
+
+    def first_match(self, path: str, default: Any = None) -> Any:
+        """The value of the first-added rule matching path."""
+        idx = self._cache.get(path, _NO_MATCH)
+        if idx is _NO_MATCH:
+            idx = self._match(self._root, path.split(SEPARATOR), 0)
+            self._cache[path] = idx
+        return default if idx is None else self._values[idx]
+
+    def matches(self, path: str) -> bool:
+        return self.first_match(path, _NO_MATCH) is not _NO_MATCH
+
+def compile_patterns(patterns: Iterable[str]) -> MarketPathMatcher:
+    m = MarketPathMatcher()
+    for p in patterns:
+        m.add_pattern(p)
+    return m
@@ -0,0 +1,81 @@
+from fnmatch import fnmatchcase
+import unittest
+
+import market_paths
+
+PATHS = [
+    "Ammunition & Charges>Hybrid Charges>Standard Charges>Small",
+    "Ammunition & Charges>Hybrid Charges>Standard Charges>Extra Large",
+    "Ammunition & Charges>Missiles>XL Torpedoes>Standard XL Torpedoes",
+    "Ammunition & Charges>Missiles>Cruise Missiles",
+    "Ship and Module Modifications>Rigs>Armor Rigs>Large Armor Rigs",
+    "Ship and Module Modifications>Rigs>Armor Rigs>Medium Armor Rigs",
+    "Ship Equipment>Hull & Armor>Armor Plates>Large",
+    "Ship Equipment>Hull & Armor>Armor Hardeners>Deprecated>Large",
+    "Ship Equipment>Turrets & Launchers>Missile Launchers>Cruise Launchers",
+    "Drones>Fighters>Light Fighters",
+    "Drones>Combat Drones>Light Scout Drones",
+    "Manufacture & Research",
+    "Ships>Battleships>Standard Battleships>Amarr",
+]
+
+class TestMarketPathMatcher(unittest.TestCase):
+    def testPatternsMatchFnmatch(self):
+        patterns = [
+            "Ammunition & Charges>*>*>Extra Large",
+            "Ammunition & Charges>Missiles>XL Torpedoes>*",
+            "Manufacture & Research>*",
+            "Ship Equipment>Hull & Armor>*>Large",
+            "Ship and Module Modifications>Rigs>*>Large*",
+            "Drones>Fighters>*",
+            "Ships>Battleships>*",
+        ]
+        m = market_paths.compile_patterns(patterns)
+        for p in PATHS:
+            self.assertEqual(m.matches(p), any(fnmatchcase(p, x) for x in patterns), p)
+
+    def testWildcardSpansSegments(self):
+        m = market_paths.compile_patterns(["Ship Equipment>*>Large"])
+        self.assertTrue(m.matches("Ship Equipment>Hull & Armor>Armor Hardeners>Deprecated>Large"))
+        self.assertFalse(m.matches("Ship Equipment>Large"))
+
+    def testFirstPrefixWins(self):
+        m = market_paths.MarketPathMatcher()
+        m.add_prefix("Ammunition & Charges>Hybrid Charges", 1)
+        m.add_prefix("Ammunition & Charges", 2)
+        m.add_prefix("Ammunition & Charges>Hybrid Charges>Standard Charges", 3)
+        m.add_prefix("", 4)
+        self.assertEqual(m.first_match("Ammunition & Charges>Hybrid Charges>Standard Charges>Small"), 1)
+        self.assertEqual(m.first_match("Ammunition & Charges>Missiles"), 2)
+        self.assertEqual(m.first_match("Ammunition & Charges"), 2)
+        self.assertEqual(m.first_match("Drones"), 4)
+
+    def testNoMatch(self):
+        m = market_paths.MarketPathMatcher()
+        m.add_prefix("Drones", 1)
+        self.assertIsNone(m.first_match("Ships>Frigates"))
+        self.assertFalse(m.matches("Ships>Frigates"))
+        self.assertFalse(m.matches("Drone"))
+
+    def testPartialLastSegment(self):
+        # As str.startswith: the last segment of a prefix needn't be whole.
+        m = market_paths.MarketPathMatcher()
+        m.add_prefix("Ammunition & Charges>Command Burst Charge", 1)
+        m.add_prefix("Ammunition & Charges", 2)
+        m.add_prefix("Dro", 3)
+        self.assertEqual(m.first_match("Ammunition & Charges>Command Burst Charges>Armored Command Charges"), 1)
+        self.assertEqual(m.first_match("Ammunition & Charges>Command Burst Charge"), 1)
+        self.assertEqual(m.first_match("Ammunition & Charges>Command Burst"), 2)
+        self.assertEqual(m.first_match("Drones>Fighters"), 3)
+        self.assertIsNone(m.first_match("Ammunition"))
+        for path in PATHS:
+            self.assertEqual(m.matches(path), any(path.startswith(p) for p in ["Ammunition & Charges", "Dro"]), path)
+
+    def testCacheInvalidatedOnAdd(self):
+        m = market_paths.MarketPathMatcher()
+        self.assertFalse(m.matches("Drones"))
+        m.add_pattern("Drones")
+        self.assertTrue(m.matches("Drones"))
+
+
+unittest.main()
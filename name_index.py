@@ -0,0 +1,187 @@
+from bisect import bisect_left
+from collections import defaultdict, namedtuple
+from heapq import nsmallest
+from itertools import islice
+import re
+import sqlite3
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+Candidate = namedtuple('Candidate', ['ID', 'Name', 'Score'])
+
+def _trigrams(s: str) -> List[str]:
+    s = "  {} ".format(s)
+    return [s[i:i+3] for i in range(len(s) - 2)]
+
+# The positions of the set bits in each byte value.
+_BYTE_BITS = [tuple(k for k in range(8) if v >> k & 1) for v in range(256)]
+_NONZERO = re.compile(rb'[^\x00]')
+
+def _mask(ids: Iterable[int], n: int) -> int:
+    """The set of ids as an int with bit i set for each i, out of n."""
+    b = bytearray((n + 7) // 8)
+    for i in ids:
+        b[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(b, 'little')
+
+def _bits(x: int) -> Iterator[int]:
+    """The positions of the set bits of x, lowest first."""
+    b = x.to_bytes((x.bit_length() + 7) // 8, 'little')
+    for m in _NONZERO.finditer(b):
+        j = m.start() * 8
+        for k in _BYTE_BITS[b[m.start()]]:
+            yield j + k
+
+def _add(counts: List[int], x: int):
+    """Adds one to the count of each name in x, where the counts are kept bit
+    sliced: bit i of counts[b] is bit b of the count of name i."""
+    for b in range(len(counts)):
+        carry = counts[b] & x
+        counts[b] ^= x
+        x = carry
+        if not x:
+            return
+    counts.append(x)
+
+def _at_least(counts: List[int], n: int, everyone: int) -> int:
+    """The names whose bit sliced count is at least n."""
+    if n >> len(counts):
+        return 0
+    greater = 0
+    equal = everyone
+    for b in reversed(range(len(counts))):
+        if n >> b & 1:
+            equal &= counts[b]
+        else:
+            greater |= equal & counts[b]
+            equal &= ~counts[b]
+    return greater | equal
+
+class NameIndex():
+    """In-memory index over (ID, Name) pairs supporting prefix and fuzzy search.
+
+    Prefix search is a binary search over the case-folded names; fuzzy search ranks
+    names by the Dice coefficient of their trigrams with those of the query.
+
+    Trigrams found in many names (' ch', 'ter') are kept as bitmasks over the
+    names, so that fuzzy search counts the trigrams each name shares with the
+    query for all names at once, rather than walking long posting lists."""
+
+    def __init__(self, entries: Iterable[Tuple[int, str]]):
+        entries = sorted(entries, key=lambda x: (x[1].casefold(), x[1]))
+        self._ids = [e[0] for e in entries]
+        self._names = [e[1] for e in entries]
+        self._keys = [n.casefold() for n in self._names]
+        postings: Dict[str, List[int]] = defaultdict(list)
+        by_length: Dict[int, List[int]] = defaultdict(list)
+        for i, k in enumerate(self._keys):
+            t = set(_trigrams(k))
+            by_length[len(t)].append(i)
+            for x in t:
+                postings[x].append(i)
+        # Names by their number of distinct trigrams, shortest first.
+        self._by_length = sorted((c, _mask(ids, len(self._keys))) for c, ids in by_length.items())
+        # From this many names on, a bitmask takes no more room than the list.
+        dense = max(1, len(self._keys) // 64)
+        self._postings = {t: p for t, p in postings.items() if len(p) < dense}
+        self._masks = {t: _mask(p, len(self._keys)) for t, p in postings.items() if len(p) >= dense}
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def _candidate(self, i: int, score: float) -> Candidate:
+        return Candidate(ID=self._ids[i], Name=self._names[i], Score=score)
+
+    def prefix(self, query: str, limit: int = 10) -> List[Candidate]:
+        """Names starting with query (case-insensitive), shortest then alphabetically first."""
+        q = query.casefold()
+        start = bisect_left(self._keys, q)
+        end = bisect_left(self._keys, q + '\U0010ffff', start)
+        matches = nsmallest(limit, range(start, end), key=lambda i: (len(self._keys[i]), i))
+        return [self._candidate(i, 1.0 if self._keys[i] == q else len(q) / len(self._keys[i])) for i in matches]
+
+    def fuzzy(self, query: str, limit: int = 10, min_score: float = 0.3) -> List[Candidate]:
+        """Names sharing the most trigrams with query, best first."""
+        q = frozenset(_trigrams(query.casefold()))
+        n = len(self._keys)
+        counts: List[int] = []
+        for t in q:
+            if t in self._masks:
+                _add(counts, self._masks[t])
+            elif t in self._postings:
+                _add(counts, _mask(self._postings[t], n))
+
+        everyone = (1 << n) - 1
+        scored = []
+        worst = min_score
+        above = 0
+        # Names sharing the most trigrams first. A name sharing k of them
+        # scores at most 2k/(len(q)+k), so stop once that can't beat what we have.
+        for k in reversed(range(1, min(len(q), (1 << len(counts)) - 1) + 1)):
+            if 2.0 * k / (len(q) + k) < worst:
+                break
+            at_least = _at_least(counts, k, everyone)
+            sharing = at_least & ~above
+            above = at_least
+            if not sharing:
+                continue
+            # Names sharing k trigrams and having the same number of their own
+            # score the same, and ties go to the first names, so no more than
+            # limit of each are needed.
+            for c, names in self._by_length:
+                if c < k:
+                    continue
+                score = 2.0 * k / (len(q) + c)
+                if score < worst:
+                    break
+                names &= sharing
+                if not names:
+                    continue
+                scored.extend((score, i) for i in islice(_bits(names), limit))
+                if len(scored) >= limit:
+                    scored = nsmallest(limit, scored, key=lambda x: (-x[0], x[1]))
+                    worst = max(min_score, scored[-1][0])
+        scored.sort(key=lambda x: (-x[0], x[1]))
+        return [self._candidate(i, score) for score, i in scored[:limit]]
+
+    def search(self, query: str, limit: int = 10) -> List[Candidate]:
+        """Prefix matches first, then fill up to limit with fuzzy matches."""
+        res = self.prefix(query, limit)
+        if len(res) < limit:
+            seen = set(c.ID for c in res)
+            res.extend(c for c in self.fuzzy(query, limit) if c.ID not in seen)
+        return res[:limit]
+
+    def unique(self, query: str) -> Optional[Candidate]:
+        """The exact match for query, or the only name it is a prefix of."""
+        res = self.prefix(query, 2)
+        if len(res) == 1 or (len(res) > 0 and res[0].Score == 1.0):
+            return res[0]
+        return None
+
+# Per database and table, the source hashes it was built from and the index.
+_indexes: Dict[Tuple[object, str], Tuple[List[Tuple[str, str]], NameIndex]] = {}
+
+def _table_index(conn: sqlite3.Connection, table: str) -> NameIndex:
+    """The index of a table's names, rebuilt when build_sde.py records new
+    source hashes for it, so long running processes see a rebuilt sde.db."""
+    path = conn.execute("PRAGMA database_list").fetchone()[2]
+    # In-memory databases have no path, only the connection tells them apart.
+    key = (path or conn, table)
+    try:
+        version = conn.execute("""
+            SELECT Path, Hash FROM SourceHashes WHERE TableName = ? ORDER BY Path""", [table]).fetchall()
+    except sqlite3.OperationalError:
+        # sde.db predates source hashes, so we can't tell if it changed.
+        version = []
+    cached = _indexes.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    index = NameIndex(conn.execute("SELECT ID, Name FROM {}".format(table)).fetchall())
+    _indexes[key] = (version, index)
+    return index
+
+def type_index(conn: sqlite3.Connection) -> NameIndex:
+    return _table_index(conn, 'Types')
+
+def station_index(conn: sqlite3.Connection) -> NameIndex:
+    return _table_index(conn, 'Stations')
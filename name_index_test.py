@@ -0,0 +1,99 @@
+import random
+import sqlite3
+import unittest
+
+import name_index
+
+class TestNameIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = name_index.NameIndex([
+            (1, "Multispectrum Energized Membrane I"),
+            (2, "Multispectrum Energized Membrane II"),
+            (3, "Tritanium"),
+            (4, "Caldari Navy Antimatter Charge S"),
+            (5, "Antimatter Charge S"),
+            (6, "Antimatter Charge M"),
+        ])
+
+    def testPrefix(self):
+        r = self.index.prefix("antimatter")
+        self.assertEqual([c.ID for c in r], [6, 5])
+
+    def testPrefixExactFirst(self):
+        r = self.index.prefix("multispectrum energized membrane i")
+        self.assertEqual([c.ID for c in r], [1, 2])
+        self.assertEqual(r[0].Score, 1.0)
+
+    def testPrefixLimit(self):
+        self.assertEqual(len(self.index.prefix("m", 1)), 1)
+        self.assertEqual(self.index.prefix("x"), [])
+
+    def testFuzzy(self):
+        r = self.index.fuzzy("navy antimatter S")
+        self.assertEqual(r[0].ID, 4)
+
+    def testFuzzyTypo(self):
+        r = self.index.fuzzy("Tritanum")
+        self.assertEqual(r[0].ID, 3)
+
+    def testSearch(self):
+        r = self.index.search("antimatter charge s", 3)
+        self.assertEqual(r[0].ID, 5)
+        self.assertEqual(set(c.ID for c in r[1:]), set([4, 6]))
+
+    def testFuzzyMatchesScan(self):
+        # Enough names for common trigrams to be kept as bitmasks and rare ones as lists.
+        rnd = random.Random(1)
+        words = ["Antimatter", "Charge", "Navy", "Caldari", "Hail", "Multispectrum", "Membrane", "Shield", "Booster", "Large", "Small", "Tritanium", "Xray", "Blueprint"]
+        names = sorted(set(" ".join(rnd.choice(words) for _ in range(rnd.randint(1, 4))) + rnd.choice(["", " I", " II", " S"]) for _ in range(2000)))
+        index = name_index.NameIndex(enumerate(names))
+        for query in ["antimatr charge", "navy hail s", "xray", "Booster Blueprint", "zzz"]:
+            q = set(name_index._trigrams(query.casefold()))
+            scores = []
+            for i, n in enumerate(names):
+                t = set(name_index._trigrams(n.casefold()))
+                score = 2.0 * len(q & t) / (len(q) + len(t))
+                if score >= 0.3:
+                    scores.append((-score, i))
+            expected = [(i, -score) for score, i in sorted(scores)[:10]]
+            self.assertEqual(expected, [(c.ID, c.Score) for c in index.fuzzy(query)], query)
+
+    def testUnique(self):
+        self.assertEqual(self.index.unique("trit").ID, 3)
+        self.assertEqual(self.index.unique("Multispectrum Energized Membrane I").ID, 1)
+        self.assertIsNone(self.index.unique("antimatter"))
+        self.assertIsNone(self.index.unique("nothing"))
+
+class TestStationIndex(unittest.TestCase):
+    def testFromSDE(self):
+        conn = sqlite3.connect(":memory:")
+        conn.execute("""
+        CREATE TABLE Stations(
+          ID       INT PRIMARY KEY NOT NULL,
+          Name     TEXT NOT NULL,
+          SystemID INT NOT NULL,
+          RegionID INT NOT NULL
+        );""")
+        conn.execute("""INSERT INTO Stations VALUES(?,?,?,?);""", [60003760, "Jita IV - Moon 4 - Caldari Navy Assembly Plant", 30000142, 10000002])
+        conn.execute("""INSERT INTO Stations VALUES(?,?,?,?);""", [60008494, "Amarr VIII (Oris) - Emperor Family Academy", 30002187, 10000043])
+        self.assertEqual(name_index.station_index(conn).unique("jita").ID, 60003760)
+
+    def testRebuiltWithSourceHashes(self):
+        conn = sqlite3.connect(":memory:")
+        conn.executescript("""
+        CREATE TABLE Stations(ID INT PRIMARY KEY NOT NULL, Name TEXT NOT NULL, SystemID INT NOT NULL, RegionID INT NOT NULL);
+        CREATE TABLE SourceHashes(TableName TEXT NOT NULL, Path TEXT NOT NULL, Hash TEXT NOT NULL, PRIMARY KEY (TableName, Path));
+        INSERT INTO Stations VALUES(60003760, 'Jita IV - Moon 4 - Caldari Navy Assembly Plant', 30000142, 10000002);
+        INSERT INTO SourceHashes VALUES('Stations', 'sde/bsd/staStations.yaml', 'a');
+        """)
+        index = name_index.station_index(conn)
+        self.assertIs(index, name_index.station_index(conn))
+        conn.executescript("""
+        UPDATE Stations SET Name = 'Perimeter II - Tranquility Trading Tower';
+        UPDATE SourceHashes SET Hash = 'b';
+        """)
+        self.assertIsNone(name_index.station_index(conn).unique("jita"))
+        self.assertEqual(name_index.station_index(conn).unique("perimeter").ID, 60003760)
+
+
+unittest.main()
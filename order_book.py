@@ -0,0 +1,121 @@
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+import heapq
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Quantity bought at a station, and what it costs once delivered.
+Allocation = namedtuple('Allocation', ['StationID', 'Quantity', 'LandedCost'])
+
+class PriceLadder():
+    """The sell side of one item's order book at one station, as price levels
+    in increasing order with running totals of volume and cost, so that the
+    cost of buying any number of units is a binary search away."""
+
+    __slots__ = ('prices', '_cum_volume', '_cum_cost')
+
+    def __init__(self, orders: Iterable[Tuple[float, int]]):
+        self.prices = array('d')
+        # _cum_volume[i] and _cum_cost[i] are the totals of the cheapest i levels.
+        self._cum_volume = array('q', [0])
+        self._cum_cost = array('d', [0.0])
+        for price, volume in sorted(orders):
+            if self.prices and self.prices[-1] == price:
+                self._cum_volume[-1] += volume
+                self._cum_cost[-1] += price * volume
+                continue
+            self.prices.append(price)
+            self._cum_volume.append(self._cum_volume[-1] + volume)
+            self._cum_cost.append(self._cum_cost[-1] + price * volume)
+
+    def __len__(self) -> int:
+        return len(self.prices)
+
+    @property
+    def lowest(self) -> Optional[float]:
+        return self.prices[0] if self.prices else None
+
+    @property
+    def total_volume(self) -> int:
+        return self._cum_volume[-1]
+
+    def level_volume(self, i: int) -> int:
+        return self._cum_volume[i+1] - self._cum_volume[i]
+
+    def volume_below(self, price: float) -> int:
+        """Units on sale for strictly less than price."""
+        return self._cum_volume[bisect_left(self.prices, price)]
+
+    def _level(self, n: int) -> int:
+        # Index into prices of the level holding the n-th cheapest unit.
+        return bisect_left(self._cum_volume, n, 1) - 1
+
+    def cost_to_acquire(self, n: int) -> Optional[float]:
+        """Total cost of buying the n cheapest units, or None if fewer are on sale."""
+        if n <= 0: return 0.0
+        if n > self.total_volume: return None
+        i = self._level(n)
+        return self._cum_cost[i] + (n - self._cum_volume[i]) * self.prices[i]
+
+    def average_price(self, n: int) -> Optional[float]:
+        cost = self.cost_to_acquire(n)
+        return cost / n if cost is not None and n > 0 else None
+
+    def marginal_price(self, n: int) -> Optional[float]:
+        """Price of the n-th cheapest unit, or None if fewer are on sale."""
+        if n <= 0 or n > self.total_volume: return None
+        return self.prices[self._level(n)]
+
+    def volume_within(self, budget: float) -> int:
+        """The most units that can be bought for at most budget."""
+        if budget <= 0: return 0
+        i = bisect_left(self._cum_cost, budget)
+        if i < len(self._cum_cost) and self._cum_cost[i] == budget:
+            return self._cum_volume[i]
+        if i == len(self._cum_cost):
+            return self.total_volume
+        # The cheapest i-1 levels fit entirely, then as much of the next as the rest pays for.
+        partial = int((budget - self._cum_cost[i-1]) // self.prices[i-1])
+        return min(self._cum_volume[i-1] + partial, self._cum_volume[i])
+
+def build_ladders(orders: Dict[int, Dict[int, Iterable[Tuple[float, int]]]]) -> Dict[int, Dict[int, PriceLadder]]:
+    """Ladders from (price, volume) sell orders per item, per station."""
+    return {type_id: {station_id: PriceLadder(o) for station_id, o in per_station.items()}
+            for type_id, per_station in orders.items()}
+
+def landed_price(price: float, isk_cost: float, haul_cost: float) -> float:
+    """Cost per unit of buying at price at a source station and delivering it:
+    isk_cost is a fraction of the price (e.g. hauling collateral), haul_cost a
+    fixed amount per unit (e.g. per m3 rate times the item's volume)."""
+    return price * (1 + isk_cost) + haul_cost
+
+def allocate(ladders: Dict[int, PriceLadder], quantity: int, max_price: float, costs: Dict[int, Tuple[float, float]]) -> List[Allocation]:
+    """Splits buying quantity units across stations to minimise the total landed
+    cost, only buying orders priced below max_price.
+
+    costs gives (isk_cost, haul_cost) per station, see landed_price. As the
+    landed cost of each unit doesn't depend on what else is bought, taking the
+    cheapest landed units first across all stations is optimal. Returns the
+    allocations with the largest first; they add up to less than quantity if
+    not enough is on sale."""
+    heap = []
+    for station_id, ladder in ladders.items():
+        if len(ladder) > 0 and ladder.prices[0] < max_price:
+            isk_cost, haul_cost = costs.get(station_id, (0.0, 0.0))
+            heap.append((landed_price(ladder.prices[0], isk_cost, haul_cost), station_id, 0))
+    heapq.heapify(heap)
+
+    bought: Dict[int, List] = {}
+    remaining = quantity
+    while heap and remaining > 0:
+        unit_cost, station_id, i = heapq.heappop(heap)
+        ladder = ladders[station_id]
+        n = min(remaining, ladder.level_volume(i))
+        b = bought.setdefault(station_id, [0, 0.0])
+        b[0] += n
+        b[1] += n * unit_cost
+        remaining -= n
+        if i + 1 < len(ladder) and ladder.prices[i+1] < max_price:
+            isk_cost, haul_cost = costs.get(station_id, (0.0, 0.0))
+            heapq.heappush(heap, (landed_price(ladder.prices[i+1], isk_cost, haul_cost), station_id, i + 1))
+    return sorted((Allocation(s, q, c) for s, (q, c) in bought.items()), key=lambda a: (-a.Quantity, a.StationID))
@@ -0,0 +1,95 @@
+import unittest
+
+import order_book
+
+class TestPriceLadder(unittest.TestCase):
+    def setUp(self):
+        # Out of order, with two orders at the same price.
+        self.ladder = order_book.PriceLadder([(12.0, 5), (10.0, 10), (11.0, 3), (10.0, 2)])
+
+    def testLevels(self):
+        self.assertEqual([10.0, 11.0, 12.0], list(self.ladder.prices))
+        self.assertEqual(3, len(self.ladder))
+        self.assertEqual(10.0, self.ladder.lowest)
+        self.assertEqual(20, self.ladder.total_volume)
+
+    def testEmpty(self):
+        ladder = order_book.PriceLadder([])
+        self.assertIsNone(ladder.lowest)
+        self.assertEqual(0, ladder.volume_below(100))
+        self.assertEqual(0.0, ladder.cost_to_acquire(0))
+        self.assertIsNone(ladder.cost_to_acquire(1))
+        self.assertIsNone(ladder.marginal_price(1))
+        self.assertEqual(0, ladder.volume_within(100))
+
+    def testVolumeBelow(self):
+        self.assertEqual(0, self.ladder.volume_below(10.0))
+        self.assertEqual(12, self.ladder.volume_below(10.5))
+        self.assertEqual(12, self.ladder.volume_below(11.0))
+        self.assertEqual(15, self.ladder.volume_below(11.5))
+        self.assertEqual(20, self.ladder.volume_below(100))
+
+    def testCostToAcquire(self):
+        self.assertEqual(10.0, self.ladder.cost_to_acquire(1))
+        self.assertEqual(120.0, self.ladder.cost_to_acquire(12))
+        self.assertEqual(131.0, self.ladder.cost_to_acquire(13))
+        self.assertEqual(213.0, self.ladder.cost_to_acquire(20))
+        self.assertIsNone(self.ladder.cost_to_acquire(21))
+        self.assertEqual(131.0/13, self.ladder.average_price(13))
+
+    def testMarginalPrice(self):
+        self.assertEqual(10.0, self.ladder.marginal_price(12))
+        self.assertEqual(11.0, self.ladder.marginal_price(13))
+        self.assertEqual(12.0, self.ladder.marginal_price(20))
+        self.assertIsNone(self.ladder.marginal_price(21))
+
+    def testVolumeWithin(self):
+        self.assertEqual(0, self.ladder.volume_within(9.99))
+        self.assertEqual(12, self.ladder.volume_within(120.0))
+        self.assertEqual(12, self.ladder.volume_within(130.0))
+        self.assertEqual(13, self.ladder.volume_within(131.0))
+        self.assertEqual(14, self.ladder.volume_within(150.0))
+        self.assertEqual(20, self.ladder.volume_within(1000.0))
+
+    def testMatchesBruteForce(self):
+        units = sorted(p for p, v in [(12.0, 5), (10.0, 10), (11.0, 3), (10.0, 2)] for _ in range(v))
+        for n in range(len(units) + 1):
+            self.assertEqual(sum(units[:n]), self.ladder.cost_to_acquire(n))
+
+class TestAllocate(unittest.TestCase):
+    def setUp(self):
+        self.ladders = {
+            1: order_book.PriceLadder([(10.0, 5), (12.0, 100)]),
+            2: order_book.PriceLadder([(11.0, 5), (20.0, 100)]),
+        }
+
+    def testSplitsAcrossStations(self):
+        a = order_book.allocate(self.ladders, 12, 100, {})
+        self.assertEqual([order_book.Allocation(1, 7, 74.0), order_book.Allocation(2, 5, 55.0)], a)
+
+    def testSingleStationWhenCheapest(self):
+        a = order_book.allocate(self.ladders, 5, 100, {})
+        self.assertEqual([order_book.Allocation(1, 5, 50.0)], a)
+
+    def testMaxPrice(self):
+        a = order_book.allocate(self.ladders, 1000, 12.0, {})
+        self.assertEqual([order_book.Allocation(1, 5, 50.0), order_book.Allocation(2, 5, 55.0)], a)
+
+    def testLandedCost(self):
+        # Hauling from station 1 costs 2 per unit, so station 2 is cheaper.
+        a = order_book.allocate(self.ladders, 5, 100, {1: (0.0, 2.0)})
+        self.assertEqual([order_book.Allocation(2, 5, 55.0)], a)
+        a = order_book.allocate(self.ladders, 5, 100, {2: (0.1, 0.0)})
+        self.assertEqual([order_book.Allocation(1, 5, 50.0)], a)
+
+    def testNothingAvailable(self):
+        self.assertEqual([], order_book.allocate(self.ladders, 5, 10.0, {}))
+        self.assertEqual([], order_book.allocate({}, 5, 100, {}))
+
+class TestBuildLadders(unittest.TestCase):
+    def testBuild(self):
+        ladders = order_book.build_ladders({1: {100: [(2.0, 1), (1.0, 1)], 200: [(3.0, 4)]}})
+        self.assertEqual([1.0, 2.0], list(ladders[1][100].prices))
+        self.assertEqual(4, ladders[1][200].total_volume)
+
+unittest.main()
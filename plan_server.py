@@ -0,0 +1,255 @@
+#!/usr/bin/python3
+
+from argparse import ArgumentParser, Namespace
+from collections import namedtuple
+from dataclasses import replace
+import datetime
+import glob
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import json
+import logging
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import asset_store
+import market_filler
+import top_market_items
+
+log = logging.getLogger(__name__)
+
+# Files whose change means re-reading the whole market, as opposed to just our
+# assets and orders.
+MARKET_DBS = ["sde.db", "market-prices.db", "industry.db"]
+
+def expand_files(patterns: Optional[List[str]]) -> List[str]:
+    """The files matching any of the glob patterns, so that new asset and
+    order files are picked up."""
+    files = set()
+    for p in patterns or []:
+        files.update(glob.glob(p))
+    return sorted(files)
+
+def file_versions(files: List[str]) -> Tuple:
+    """Identifies the current contents of files by their modification times.
+    Symlinks such as latest.csv.gz are followed, so pointing them at a new
+    file counts as a change."""
+    res = []
+    for f in files:
+        try:
+            res.append((f, os.path.realpath(f), os.stat(f).st_mtime_ns))
+        except FileNotFoundError:
+            res.append((f, None, None))
+    return tuple(res)
+
+def parse_plan_query(query: str) -> market_filler.SweepPoint:
+    """Planning settings from the query string of a plan request, e.g.
+    stock_fraction=0.04&markups=1.01:1.24:1.26&competitor_weight=0.5.
+    Raises ValueError for bad values."""
+    q = parse_qs(query)
+    point = market_filler.NORMAL_POINT
+    try:
+        if 'stock_fraction' in q:
+            point = point._replace(StockFraction=float(q['stock_fraction'][-1]))
+        if 'markups' in q:
+            point = point._replace(Markups=market_filler.parse_markups(q['markups'][-1]))
+        if 'competitor_weight' in q:
+            point = point._replace(CompetitorWeight=float(q['competitor_weight'][-1]))
+    except market_filler.ArgumentTypeError as e:
+        raise ValueError(str(e))
+    return point
+
+# What requests are answered from: the plans, the market state read for them
+# and the order of the items in a plan. Replaced whole on a refresh, so a
+# request never sees the plans of one read with the state of another.
+Snapshot = namedtuple('Snapshot', ['plans', 'state', 'order_keys', 'loaded_at'])
+
+class PlanService():
+    """Keeps the market state of market_filler in memory, re-reading it when
+    its inputs change, and plans from it on request.
+
+    A change to the orderset, the databases, the sources file or any file it
+    names re-reads everything; a change to only the asset and order files
+    re-reads just those. The new snapshot is swapped in once read, so requests
+    are answered from the previous one in the meantime."""
+
+    def __init__(self, args):
+        self._args = args
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._market_version = None
+        self._account_version = None
+        self.snapshot: Optional[Snapshot] = None
+
+    def sde_conn(self) -> sqlite3.Connection:
+        # sqlite connections can't be shared between the server's threads.
+        if not hasattr(self._local, 'sde_conn'):
+            self._local.sde_conn = sqlite3.connect("sde.db")
+        return self._local.sde_conn
+
+    def read_plans(self) -> List[market_filler.StationPlan]:
+        args = self._args
+        return market_filler.get_plans(self.sde_conn(), args.station, args.sources, args.limit_top_traded_items, args.stock_fraction, args.exclude_market_paths)
+
+    def market_files(self, plans: List[market_filler.StationPlan]) -> List[str]:
+        """Everything the market state is read from, including the exclusion
+        files named per station in the sources file."""
+        args = self._args
+        files = [args.orderset, args.sources] + MARKET_DBS
+        files += [f for f in (args.top_traded_items, args.exclude_industry, args.exclude_market_paths) if f is not None]
+        files += [plan.exclude_file for plan in plans if plan.exclude_file is not None]
+        files += args.popular or []
+        return list(dict.fromkeys(files))
+
+    def read_market(self, args, plans: List[market_filler.StationPlan]) -> market_filler.MarketState:
+        prices_conn = sqlite3.connect("market-prices.db")
+        industry_conn = sqlite3.connect("industry.db")
+        try:
+            return market_filler.load_state(args, plans, self.sde_conn(), prices_conn, industry_conn, top_market_items.CACHE_DIR)
+        finally:
+            prices_conn.close()
+            industry_conn.close()
+
+    def read_account(self, args, state: market_filler.MarketState) -> market_filler.MarketState:
+        return replace(state,
+                       assets=market_filler.read_assets(args.assets, top_market_items.CACHE_DIR) if args.assets else asset_store.AssetIndex(),
+                       my_orders=market_filler.read_orders_by_location(args.orders, top_market_items.CACHE_DIR) if args.orders else {})
+
+    def refresh(self):
+        """Re-reads whatever inputs changed since the last refresh."""
+        with self._lock:
+            # The sources file is read every time, as the files it names are inputs too.
+            plans = self.read_plans()
+            market_version = file_versions(self.market_files(plans))
+            account_files = expand_files(self._args.assets), expand_files(self._args.orders)
+            account_version = file_versions(account_files[0] + account_files[1])
+            if market_version == self._market_version and account_version == self._account_version:
+                return
+
+            args = replace_files(self._args, *account_files)
+            if market_version != self._market_version:
+                log.info("market inputs changed, reading orderset {}".format(os.path.realpath(args.orderset)))
+                state = self.read_market(args, plans)
+                sde_conn = self.sde_conn()
+                order_keys = {i: market_filler.item_order_key(sde_conn, item) for i, item in state.items.items()}
+                snapshot = Snapshot({plan.id: plan for plan in plans}, state, order_keys, datetime.datetime.now())
+            else:
+                log.info("asset or order files changed, reading {} files".format(len(account_files[0]) + len(account_files[1])))
+                snapshot = self.snapshot._replace(state=self.read_account(args, self.snapshot.state), loaded_at=datetime.datetime.now())
+            self.snapshot = snapshot
+            self._market_version = market_version
+            self._account_version = account_version
+
+    def plan(self, station_id: str, point: market_filler.SweepPoint) -> Optional[str]:
+        """The plan for a station as market_filler writes it, or None for
+        stations not served."""
+        snapshot = self.snapshot
+        plan = snapshot.plans.get(station_id) if snapshot is not None else None
+        if plan is None:
+            return None
+        results = market_filler.plan_station(self.sde_conn(), snapshot.state, plan, point.Markups, point.StockFraction, point.CompetitorWeight)
+        fh = io.StringIO()
+        market_filler.write_plan(fh, results, snapshot.order_keys)
+        return fh.getvalue()
+
+    def status(self) -> dict:
+        snapshot = self.snapshot
+        if snapshot is None:
+            return {'orderset': None, 'orderset_date': None, 'loaded_at': None, 'stations': [], 'items': 0}
+        return {
+            'orderset': snapshot.state.oinfo.Orderset,
+            'orderset_date': str(snapshot.state.oinfo.Date),
+            'loaded_at': snapshot.loaded_at.isoformat(),
+            'stations': sorted(snapshot.plans),
+            'items': len(snapshot.state.items),
+        }
+
+def replace_files(args, assets: List[str], orders: List[str]):
+    """A copy of args with the asset and order patterns expanded."""
+    return Namespace(**dict(vars(args), assets=assets, orders=orders))
+
+class PlanHandler(BaseHTTPRequestHandler):
+    """GET /plan/<station id>[?settings] for a plan as CSV, see
+    parse_plan_query; GET /status for what is loaded, as JSON."""
+
+    service: PlanService = None
+
+    def _reply(self, code: int, content_type: str, body: str):
+        data = body.encode()
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/status':
+            self._reply(200, 'application/json', json.dumps(self.service.status()))
+            return
+        if url.path.startswith('/plan/'):
+            try:
+                point = parse_plan_query(url.query)
+            except ValueError as e:
+                self._reply(400, 'text/plain', "{}\n".format(e))
+                return
+            plan = self.service.plan(url.path[len('/plan/'):], point)
+            if plan is None:
+                self._reply(404, 'text/plain', "no plan for {}\n".format(url.path[len('/plan/'):]))
+                return
+            self._reply(200, 'text/csv', plan)
+            return
+        self._reply(404, 'text/plain', "unknown path {}\n".format(url.path))
+
+    def log_message(self, format, *args):
+        log.info(format % args)
+
+def watch(service: PlanService, interval: float, stop: threading.Event):
+    while not stop.wait(interval):
+        try:
+            service.refresh()
+        except Exception:
+            # Keep serving the last good state, e.g. while a file is half written.
+            log.exception("failed to refresh")
+
+def main():
+    logging.basicConfig(format='%(threadName)s %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    arg_parser = ArgumentParser(prog='plan_server.py')
+    arg_parser.add_argument('--orderset', type=str, required=True)
+    arg_parser.add_argument('--limit-top-traded-items', type=int)
+    arg_parser.add_argument('--top-traded-items', type=str)
+    top_market_items.add_basket_args(arg_parser)
+    arg_parser.add_argument('--station', nargs='+', type=str, help='ids from the sources file')
+    arg_parser.add_argument('--stock_fraction', type=float, default=0.02)
+    arg_parser.add_argument('--sources', type=str, required=True)
+    arg_parser.add_argument('--assets', nargs='*', type=str, help='files or glob patterns, e.g. "assets-*.csv"')
+    arg_parser.add_argument('--orders', nargs='*', type=str, help='files or glob patterns, e.g. "orders-*.csv"')
+    arg_parser.add_argument('--exclude_market_paths', type=str)
+    arg_parser.add_argument('--exclude_industry', type=str)
+    arg_parser.add_argument('--port', type=int, default=8765)
+    arg_parser.add_argument('--poll', type=float, default=10, help='seconds between checks for changed inputs')
+    args = arg_parser.parse_args()
+
+    service = PlanService(args)
+    service.refresh()
+    PlanHandler.service = service
+
+    stop = threading.Event()
+    watcher = threading.Thread(target=watch, args=(service, args.poll, stop), name='watcher', daemon=True)
+    watcher.start()
+    # Only on localhost: plans include our assets and orders.
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), PlanHandler)
+    log.info("serving plans for {} on http://127.0.0.1:{}/plan/<station>".format(', '.join(service.snapshot.plans), args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+import csv
+import datetime
+import io
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from argparse import Namespace
+from http.server import ThreadingHTTPServer
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import asset_store
+import lib
+import market_filler
+import order_book
+import plan_server
+import trade_lib
+
+class TestFiles(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.dir.name, name)
+
+    def write(self, name: str, mtime: int):
+        with open(self.path(name), "wt") as fh:
+            fh.write(name)
+        os.utime(self.path(name), (mtime, mtime))
+
+    def testExpandPicksUpNewFiles(self):
+        self.write("assets-a.csv", 1)
+        pattern = [self.path("assets-*.csv")]
+        self.assertEqual([self.path("assets-a.csv")], plan_server.expand_files(pattern))
+        self.write("assets-b.csv", 1)
+        self.assertEqual([self.path("assets-a.csv"), self.path("assets-b.csv")], plan_server.expand_files(pattern))
+        self.assertEqual([], plan_server.expand_files(None))
+
+    def testVersionChangesWithMtime(self):
+        self.write("a.csv", 1)
+        v = plan_server.file_versions([self.path("a.csv")])
+        self.assertEqual(v, plan_server.file_versions([self.path("a.csv")]))
+        os.utime(self.path("a.csv"), (2, 2))
+        self.assertNotEqual(v, plan_server.file_versions([self.path("a.csv")]))
+
+    def testVersionFollowsSymlink(self):
+        self.write("orderset-1.csv.gz", 1)
+        self.write("orderset-2.csv.gz", 1)
+        os.symlink(self.path("orderset-1.csv.gz"), self.path("latest.csv.gz"))
+        v = plan_server.file_versions([self.path("latest.csv.gz")])
+        os.remove(self.path("latest.csv.gz"))
+        os.symlink(self.path("orderset-2.csv.gz"), self.path("latest.csv.gz"))
+        self.assertNotEqual(v, plan_server.file_versions([self.path("latest.csv.gz")]))
+
+    def testMissingFile(self):
+        self.assertEqual(((self.path("x"), None, None),), plan_server.file_versions([self.path("x")]))
+
+class TestParsePlanQuery(unittest.TestCase):
+    def testDefaults(self):
+        self.assertEqual(market_filler.NORMAL_POINT, plan_server.parse_plan_query(""))
+
+    def testSettings(self):
+        p = plan_server.parse_plan_query("stock_fraction=0.04&markups=1.1:1.3:1.32&competitor_weight=0.5")
+        self.assertEqual(market_filler.SweepPoint(0.04, market_filler.Markups(1.1, 1.3, 1.32), 0.5), p)
+
+    def testBadValues(self):
+        for q in ["stock_fraction=x", "markups=1.2", "competitor_weight=none"]:
+            with self.assertRaises(ValueError):
+                plan_server.parse_plan_query(q)
+
+class FakeMarketService(plan_server.PlanService):
+    """Reads the market from a stand-in orderset holding just the fair price
+    of one item, which is on sale at station 2."""
+
+    ITEM = trade_lib.ItemSummary(ID=1, Name="Hail S", GroupID=1, CategoryID=1, MarketGroup="Ammunition & Charges>Hybrid", ValueTraded=1e6)
+
+    def __init__(self, args):
+        super().__init__(args)
+        self.market_reads = 0
+
+    def read_market(self, args, plans):
+        self.market_reads += 1
+        with open(args.orderset, "rt") as fh:
+            price = float(fh.read())
+        state = market_filler.MarketState(
+            oinfo=lib.OrdersetInfo(1, datetime.date(2024, 1, 1)),
+            plan_items={plan.id: [s for s in [self.ITEM] if not plan.excluded_mpaths.matches(s.MarketGroup)] for plan in plans},
+            ladders=order_book.build_ladders({1: {2: [(price, 1000)]}}),
+            fair_prices={1: price},
+            industry_items={},
+            assets=asset_store.AssetIndex(),
+            my_orders={},
+            volumes={1: 0.01})
+        return self.read_account(args, state)
+
+class TestPlanService(unittest.TestCase):
+    SOURCES = """
+- id: A
+  to: Station A
+  exclude_market_paths: exclude-a.txt
+  from:
+    - name: Station B
+"""
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.dir = tempfile.TemporaryDirectory()
+        os.chdir(self.dir.name)
+        conn = sqlite3.connect("sde.db")
+        conn.executescript("""
+        CREATE TABLE Stations(ID INT PRIMARY KEY NOT NULL, Name TEXT NOT NULL, SystemID INT NOT NULL, RegionID INT NOT NULL);
+        INSERT INTO Stations VALUES(1, 'Station A', 1, 1), (2, 'Station B', 2, 1);
+        CREATE TABLE Types(ID INT PRIMARY KEY NOT NULL, Name TEXT NOT NULL, GroupID INT NOT NULL, MarketGroupID INT, PortionSize INT, Volume FLOAT);
+        INSERT INTO Types VALUES(1, 'Hail S', 1, 1, 1, 0.01);
+        CREATE TABLE Groups(ID INT PRIMARY KEY NOT NULL, Name TEXT NOT NULL, CategoryID INT NOT NULL);
+        INSERT INTO Groups VALUES(1, 'Hybrid Charge', 1);
+        CREATE TABLE Categories(ID INT PRIMARY KEY NOT NULL, Name TEXT NOT NULL);
+        INSERT INTO Categories VALUES(1, 'Charge');
+        CREATE TABLE MarketGroups(ID INT PRIMARY KEY NOT NULL, Path TEXT NOT NULL);
+        INSERT INTO MarketGroups VALUES(1, 'Ammunition & Charges>Hybrid');
+        """)
+        conn.commit()
+        conn.close()
+        self.write("sources.yaml", self.SOURCES, 1)
+        self.write("exclude-a.txt", "Ships>*\n", 1)
+        self.write("orderset.txt", "100", 1)
+        self.write("order-sizes.txt", "Ammunition & Charges\t1000\t10\n", 1)
+        trade_lib._get_min_order_rules.cache_clear()
+        trade_lib._get_order_size_matcher.cache_clear()
+
+        args = Namespace(orderset="orderset.txt", sources="sources.yaml", station=["A"], limit_top_traded_items=None,
+                         stock_fraction=0.02, exclude_market_paths=None, top_traded_items=None, exclude_industry=None,
+                         popular=None, assets=["assets-*.csv"], orders=None)
+        self.service = FakeMarketService(args)
+        self.service.refresh()
+        plan_server.PlanHandler.service = self.service
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), plan_server.PlanHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.stop = threading.Event()
+        threading.Thread(target=plan_server.watch, args=(self.service, 0.01, self.stop), daemon=True).start()
+
+    def tearDown(self):
+        self.stop.set()
+        self.server.shutdown()
+        self.server.server_close()
+        os.chdir(self.cwd)
+        self.dir.cleanup()
+
+    def write(self, name: str, content: str, mtime: int):
+        with open(name, "wt") as fh:
+            fh.write(content)
+        os.utime(name, (mtime, mtime))
+
+    def get_plan(self) -> list:
+        with urlopen("http://127.0.0.1:{}/plan/A".format(self.server.server_address[1])) as r:
+            return list(csv.DictReader(io.StringIO(r.read().decode())))
+
+    def wait_for(self, condition):
+        deadline = time.monotonic() + 10
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail("no reload")
+            time.sleep(0.01)
+
+    def testReloadsOrderset(self):
+        [row] = self.get_plan()
+        self.assertEqual("101.00", row['Max Buy'])
+        self.write("orderset.txt", "200", 2)
+        self.wait_for(lambda: self.get_plan()[0]['Max Buy'] == "202.00")
+        self.assertEqual(2, self.service.market_reads)
+
+    def testReloadsStationExcludeFile(self):
+        self.assertEqual(1, len(self.get_plan()))
+        self.write("exclude-a.txt", "Ammunition & Charges>*\n", 2)
+        self.wait_for(lambda: self.get_plan() == [])
+
+    def testReloadsOnlyAssets(self):
+        [row] = self.get_plan()
+        self.assertEqual("0", row['My Quantity'])
+        self.write("assets-x.csv", "ItemID,TypeID,Quantity,Singleton,LocationID\n10,1,7,False,1\n", 2)
+        self.wait_for(lambda: self.get_plan()[0]['My Quantity'] == "7")
+        self.assertEqual(1, self.service.market_reads)
+
+    def testUnknownStation(self):
+        with self.assertRaises(HTTPError) as e:
+            urlopen("http://127.0.0.1:{}/plan/X".format(self.server.server_address[1]))
+        self.assertEqual(404, e.exception.code)
+
+unittest.main()
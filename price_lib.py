@@ -1,7 +1,7 @@
 from dataclasses import dataclass
 import datetime
 import sqlite3
-from typing import Dict, Tuple
+from typing import Dict, Iterable, Optional, Tuple
 
 @dataclass
 class ItemPricing():
@@ -25,3 +25,29 @@ def get_pricing(conn: sqlite3.Connection, type_id: int, date: datetime.date) ->
     fair_price = res.fetchall()[0][0]
     return ItemPricing(other_stations=current_prices, fair_price=fair_price)
 
+
+def get_fair_prices(conn: sqlite3.Connection, type_ids: Iterable[int], date: datetime.date) -> Dict[int, Optional[float]]:
+    """Same as get_pricing(...).fair_price, for many types in one query."""
+    type_ids = set(type_ids)
+    conn.execute("""
+    CREATE TEMP TABLE IF NOT EXISTS FairPriceTypes(
+      TypeID INTEGER PRIMARY KEY NOT NULL
+    );""")
+    conn.execute("""DELETE FROM temp.FairPriceTypes""")
+    conn.executemany("""INSERT INTO temp.FairPriceTypes VALUES(?)""", [(i,) for i in type_ids])
+    res = conn.execute("""
+    SELECT TypeID, AVG(daily_price) FROM (
+      SELECT TypeID, Date, MIN(Sell) AS daily_price FROM PriceHistory
+      WHERE TypeID IN (SELECT TypeID FROM temp.FairPriceTypes) AND Date > date(?, "-3 months")
+        AND StationID IN (60003760, 60011866, 60008494) -- Jita 4-4, Dodixie FNAP, Amarr EFA
+      GROUP BY TypeID, Date)
+    GROUP BY TypeID""", [date.isoformat()])
+    prices = {i: None for i in type_ids}
+    prices.update(res.fetchall())
+    conn.execute("""DELETE FROM temp.FairPriceTypes""")
+    return prices
+
+def price_history_version(conn: sqlite3.Connection) -> Optional[int]:
+    """Changes whenever prices are added. add_orderset_to_market_history.py
+    only ever inserts into PriceHistory, so the last rowid will do."""
+    return conn.execute("""SELECT MAX(rowid) FROM PriceHistory""").fetchone()[0]
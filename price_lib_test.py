@@ -0,0 +1,58 @@
+import datetime
+import sqlite3
+from typing import List
+import unittest
+
+import price_lib
+
+class TestGetFairPrices(unittest.TestCase):
+    TODAY = datetime.date(year=2021, month=1, day=1)
+    JITA = 60003760
+    AMARR = 60008494
+    HEK = 60005686
+
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        self.conn.execute("""
+            CREATE TABLE PriceHistory(
+            TypeID INTEGER,
+            Date DATE,
+            StationID INTEGER,
+            Buy FLOAT,
+            Sell FLOAT,
+            SellVolume INTEGER
+            );""")
+
+    def AddPrices(self, typeID: int, stationID: int, sell: List[float]):
+        date = self.TODAY - datetime.timedelta(days=len(sell)-1)
+        for s in sell:
+            self.conn.execute("INSERT INTO PriceHistory VALUES(?,?,?,?,?,?)", [typeID, date.isoformat(), stationID, s*0.9, s, 1000])
+            date += datetime.timedelta(days=1)
+
+    def testMatchesGetPricing(self):
+        self.AddPrices(1, self.JITA, [100, 110, 120])
+        self.AddPrices(1, self.AMARR, [90, 120, 130])
+        self.AddPrices(2, self.JITA, [10])
+        self.AddPrices(3, self.HEK, [10])
+        prices = price_lib.get_fair_prices(self.conn, [1, 2, 3, 4], self.TODAY)
+        self.assertEqual(set(prices.keys()), set([1, 2, 3, 4]))
+        for i in [1, 2, 3, 4]:
+            self.assertEqual(prices[i], price_lib.get_pricing(self.conn, i, self.TODAY).fair_price)
+        self.assertEqual(prices[1], 320/3)
+        self.assertIsNone(prices[3])
+
+    def testRepeated(self):
+        self.AddPrices(1, self.JITA, [100])
+        self.AddPrices(2, self.JITA, [10])
+        price_lib.get_fair_prices(self.conn, [1], self.TODAY)
+        self.assertEqual(price_lib.get_fair_prices(self.conn, [2], self.TODAY), {2: 10})
+
+    def testVersion(self):
+        self.assertIsNone(price_lib.price_history_version(self.conn))
+        self.AddPrices(1, self.JITA, [100])
+        v = price_lib.price_history_version(self.conn)
+        self.AddPrices(1, self.JITA, [100])
+        self.assertNotEqual(v, price_lib.price_history_version(self.conn))
+
+
+unittest.main()
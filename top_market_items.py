@@ -1,111 +1,243 @@
 #!/usr/bin/python3
 
 from argparse import ArgumentParser
+from array import array
 from collections import defaultdict, namedtuple
 import csv
+from dataclasses import asdict, dataclass
 import datetime
 import gzip
+import hashlib
+import json
 import logging
 import math
 import operator
+import os
 import sqlite3
 import sys
+from typing import Dict, IO, Iterable, List, Optional, Tuple
 import yaml
 
 import lib
-from industry import get_reprocess_value
-from price_lib import get_pricing
+from industry import get_reprocess_values
+from price_lib import get_fair_prices
 import trade_lib
 
-logging.basicConfig(format='%(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 log = logging.getLogger(__name__)
-arg_parser = ArgumentParser(prog='top-market-items')
-arg_parser.add_argument('--include_group', nargs='*', type=int)
-arg_parser.add_argument('--exclude_group', nargs='*', type=int)
-arg_parser.add_argument('--include_category', nargs='*', type=int)
-arg_parser.add_argument('--exclude_category', nargs='*', type=int)
-arg_parser.add_argument('--exclude_junk', action='store_true')
-arg_parser.add_argument('--popular', nargs='*', type=str)
-args = arg_parser.parse_args()
-
-items = {}
+
 TypeInfo = lib.TypeInfo
+CACHE_DIR = "cache"
+MAX_BASKET_ITEMS = 10001
 
-con = sqlite3.connect("sde.db")
-prices_conn = sqlite3.connect("market-prices.db")
-cur = con.cursor()
+@dataclass
+class BasketFilters:
+    include_group: Optional[List[int]] = None
+    exclude_group: Optional[List[int]] = None
+    include_category: Optional[List[int]] = None
+    exclude_category: Optional[List[int]] = None
+    exclude_junk: bool = False
 
-def is_junk(type_id):
-    date = datetime.date.today()
-    price = get_pricing(prices_conn, type_id, date).fair_price
-    reprocess_value = get_reprocess_value(con, prices_conn, type_id, date)
-    if reprocess_value and price and price < reprocess_value*1.1:
-        log.info('  {} excluded as junk (value {} vs reprocessed {})'.format(type_id, price, reprocess_value))
+    def is_selected(self, ti: TypeInfo) -> bool:
+        if self.include_group is not None and ti.GroupID not in self.include_group: return False
+        if self.exclude_group is not None and ti.GroupID in self.exclude_group: return False
+        if self.include_category is not None and ti.CategoryID not in self.include_category: return False
+        if self.exclude_category is not None and ti.CategoryID in self.exclude_category: return False
         return True
-    return False
-
-months = len(args.popular)
-for name in args.popular:
-  log.info('Reading trade volumes {}...'.format(name))
-  new = 0
-  updated = 0
-  junk_items = 0
-  with open(name) as market_data_csv:
-    reader = csv.DictReader(market_data_csv)
-    for r in reader:
-        t = r['Commodity']
-
-        ti = lib.get_type_info_byname(con, t)
-        if ti is None:
-            #log.warning('Unknown type {}'.format(t))
-            continue
-        if args.include_group is not None and ti.GroupID not in args.include_group: continue
-        if args.exclude_group is not None and ti.GroupID in args.exclude_group: continue
-        if args.include_category is not None and ti.CategoryID not in args.include_category: continue
-        if args.exclude_category is not None and ti.CategoryID in args.exclude_category: continue
-        if args.exclude_junk and is_junk(ti.ID):
-            junk_items += 1
-            continue
-
-        if ti.MarketGroup is None:
-            log.debug("non-market item {}".format(t))
-            continue
-
-        value_traded = int(r['Value of trades'].replace('.', ''))
-        traded_items = int(r['Traded items'].replace('.', ''))
-        if ti.ID not in items:
-            items[ti.ID] = { 'ID': ti.ID, 'Name': ti.Name, 'CategoryID': ti.CategoryID, 'GroupID': ti.GroupID, 'MarketGroup': ti.MarketGroup, 'NormalMarketSize': trade_lib.get_order_size(ti).NormalMarketSize, 'by_month': []}
-            new += 1
-        else:
-            updated += 1
-        items[ti.ID]['by_month'].append({'num': traded_items, 'value': value_traded})
-  log.info('...read trade volumes {}: new {} updated {} junk {}'.format(name, new, updated, junk_items))
-
-for type_id, r in items.items():
-    r['num'] = min(x['num'] for x in r['by_month'])
-    r['value'] = min(x['value'] for x in r['by_month'])
-
-    if len(r['by_month']) < months:
-        # Anything seasonal, I don't want.
-        r['score'] = 0
-    else:
-        value_per_item = r['value']/r['num']
-        value_per_trade = value_per_item * r['NormalMarketSize']
-        # Lowest score across all months considered - we're looking for consistently heavily traded items.
-        r['score'] = min(x['value']/math.pow(value_per_trade, 0.6) for x in r['by_month'])
-
-def parse_agg_what(s: str) -> (int, int, bool):
-    region,  type_id, is_buy = s.split('|')
-    return (int(region), int(type_id), is_buy=='true')
-
-log.info('Producing output...')
-count = 0
-
-w = csv.writer(sys.stdout, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-w.writerow(['ID', 'Name', 'GroupID', 'CategoryID', 'MarketGroup', 'Value Traded'])
-for id, d in sorted(items.items(), key=lambda x: x[1]['score'], reverse=True):
-    w.writerow([d['ID'], d['Name'], d['GroupID'], d['CategoryID'], d['MarketGroup'], d['value']])
-    count += 1
-    if count > 10000:
-        break
-log.info('...done')
+
+class JunkClassifier():
+    """Items which are worth less than what they reprocess into are junk."""
+
+    def __init__(self, sde_conn: sqlite3.Connection, prices_conn: sqlite3.Connection, date: datetime.date):
+        self._sde_conn = sde_conn
+        self._prices_conn = prices_conn
+        self._date = date
+        self._junk: Dict[int, bool] = {}
+
+    def classify(self, type_ids):
+        type_ids = set(type_ids) - self._junk.keys()
+        if not type_ids: return
+        prices = get_fair_prices(self._prices_conn, type_ids, self._date)
+        reprocess_values = get_reprocess_values(self._sde_conn, self._prices_conn, type_ids, self._date)
+        for type_id in type_ids:
+            price = prices[type_id]
+            reprocess_value = reprocess_values[type_id]
+            self._junk[type_id] = bool(reprocess_value and price and price < reprocess_value*1.1)
+            if self._junk[type_id]:
+                log.info('  {} excluded as junk (value {} vs reprocessed {})'.format(type_id, price, reprocess_value))
+
+    def is_junk(self, type_id: int) -> bool:
+        self.classify([type_id])
+        return self._junk[type_id]
+
+def parse_count(s: str) -> int:
+    """Parses counts formatted like '1.234.567'."""
+    return int(s.replace('.', ''))
+
+class PopularityMerge():
+    """Streams monthly popularity files into arrays aligned by type, keeping only
+    the per-type minimum counts and the number of months each type was seen in."""
+
+    def __init__(self):
+        self.slot: Dict[int, int] = {}
+        self.types: List[TypeInfo] = []
+        self.min_num = array('q')
+        self.min_value = array('q')
+        self.months_seen = array('l')
+        self.months = 0
+
+    def add_month(self, rows: Iterable[Tuple[TypeInfo, int, int]]) -> Tuple[int, int]:
+        """Merges one month of (type, traded items, value traded). Returns (new, updated)."""
+        new = 0
+        updated = 0
+        self.months += 1
+        for ti, num, value in rows:
+            i = self.slot.get(ti.ID)
+            if i is None:
+                self.slot[ti.ID] = len(self.types)
+                self.types.append(ti)
+                self.min_num.append(num)
+                self.min_value.append(value)
+                self.months_seen.append(1)
+                new += 1
+            else:
+                if num < self.min_num[i]: self.min_num[i] = num
+                if value < self.min_value[i]: self.min_value[i] = value
+                self.months_seen[i] += 1
+                updated += 1
+        return new, updated
+
+    def scores(self) -> List[float]:
+        normal_sizes = [trade_lib.get_order_size(ti).NormalMarketSize for ti in self.types]
+        res = []
+        for num, value, seen, nms in zip(self.min_num, self.min_value, self.months_seen, normal_sizes):
+            if seen < self.months:
+                # Anything seasonal, I don't want.
+                res.append(0)
+            else:
+                value_per_trade = value / num * nms
+                # Lowest score across all months considered - we're looking for consistently
+                # heavily traded items. value_per_trade is the same for every month, so that is
+                # the score of the month with the lowest value.
+                res.append(value / math.pow(value_per_trade, 0.6))
+        return res
+
+def build_basket(sde_conn: sqlite3.Connection, prices_conn: Optional[sqlite3.Connection], popular: List[str], filters: BasketFilters, max_items: int = MAX_BASKET_ITEMS) -> List[trade_lib.ItemSummary]:
+    """Ranks the items in the popular-*.csv files, most consistently traded first."""
+    merge = PopularityMerge()
+    junk = JunkClassifier(sde_conn, prices_conn, datetime.date.today()) if filters.exclude_junk else None
+
+    for name in popular:
+        log.info('Reading trade volumes {}...'.format(name))
+        with open(name) as market_data_csv:
+            r = csv.reader(market_data_csv)
+            header = next(r)
+            name_col = header.index('Commodity')
+            num_col = header.index('Traded items')
+            value_col = header.index('Value of trades')
+            rows = [(row[name_col], row[num_col], row[value_col]) for row in r]
+
+        type_infos, unknown = lib.get_type_info_bynames(sde_conn, (t for t, _, _ in rows))
+        log.debug('{} unknown types in {}'.format(len(unknown), name))
+        selected = [ti for ti in type_infos.values() if filters.is_selected(ti)]
+        junk_items = 0
+        if junk is not None:
+            junk.classify(ti.ID for ti in selected)
+            junk_items = sum(1 for ti in selected if junk.is_junk(ti.ID))
+        keep = set(ti.Name for ti in selected
+                   if ti.MarketGroup is not None and (junk is None or not junk.is_junk(ti.ID)))
+
+        new, updated = merge.add_month(
+                (type_infos[t], parse_count(num), parse_count(value))
+                for t, num, value in rows if t in keep)
+        log.info('...read trade volumes {}: new {} updated {} junk {}'.format(name, new, updated, junk_items))
+
+    scores = merge.scores()
+    ranked = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:max_items]
+    return [trade_lib.ItemSummary(ID=merge.types[i].ID, Name=merge.types[i].Name, GroupID=merge.types[i].GroupID, CategoryID=merge.types[i].CategoryID, MarketGroup=merge.types[i].MarketGroup, ValueTraded=float(merge.min_value[i]))
+            for i in ranked]
+
+def write_basket(fh: IO, basket: List[trade_lib.ItemSummary]):
+    w = csv.writer(fh, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+    w.writerow(['ID', 'Name', 'GroupID', 'CategoryID', 'MarketGroup', 'Value Traded'])
+    for d in basket:
+        w.writerow([d.ID, d.Name, d.GroupID, d.CategoryID, d.MarketGroup, int(d.ValueTraded)])
+
+def sde_hashes(sde_conn: sqlite3.Connection) -> List[Tuple[str, str]]:
+    try:
+        return sde_conn.execute("""
+            SELECT TableName, Hash FROM SourceHashes
+            WHERE TableName IN ('Types', 'Groups', 'MarketGroups') ORDER BY TableName, Path""").fetchall()
+    except sqlite3.OperationalError:
+        # sde.db predates source hashes, so we can't tell if it changed.
+        return []
+
+def basket_cache_key(sde_conn: sqlite3.Connection, popular: List[str], filters: BasketFilters, max_items: int) -> str:
+    key = {
+        'popular': [lib.file_hash(f) for f in popular],
+        'filters': asdict(filters),
+        'order_sizes': lib.file_hash("order-sizes.txt"),
+        'max_items': max_items,
+        # Names and market groups come from the SDE.
+        'sde': sde_hashes(sde_conn),
+    }
+    if filters.exclude_junk:
+        # Junk classification depends on current prices.
+        key['date'] = datetime.date.today().isoformat()
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+def get_basket(sde_conn: sqlite3.Connection, prices_conn: Optional[sqlite3.Connection], popular: List[str], filters: BasketFilters, max_items: int = MAX_BASKET_ITEMS, cache_dir: str = CACHE_DIR) -> List[trade_lib.ItemSummary]:
+    """build_basket, with the result cached on disk keyed by all of its inputs."""
+    cache_file = os.path.join(cache_dir, "top-traded-{}.csv".format(basket_cache_key(sde_conn, popular, filters, max_items)))
+    if os.path.exists(cache_file):
+        log.info("Using cached basket {}".format(cache_file))
+        with open(cache_file, "rt") as fh:
+            return list(trade_lib.get_most_traded_items(fh, None))
+
+    basket = build_basket(sde_conn, prices_conn, popular, filters, max_items)
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(cache_file + ".tmp", "wt") as fh:
+        write_basket(fh, basket)
+    os.replace(cache_file + ".tmp", cache_file)
+    return basket
+
+def add_basket_args(arg_parser: ArgumentParser):
+    arg_parser.add_argument('--include_group', nargs='*', type=int)
+    arg_parser.add_argument('--exclude_group', nargs='*', type=int)
+    arg_parser.add_argument('--include_category', nargs='*', type=int)
+    arg_parser.add_argument('--exclude_category', nargs='*', type=int)
+    arg_parser.add_argument('--exclude_junk', action='store_true')
+    arg_parser.add_argument('--popular', nargs='*', type=str)
+
+def basket_from_args(args, sde_conn: sqlite3.Connection, use_cache: bool = True) -> List[trade_lib.ItemSummary]:
+    """The basket for the options added by add_basket_args."""
+    filters = BasketFilters(include_group=args.include_group, exclude_group=args.exclude_group,
+                            include_category=args.include_category, exclude_category=args.exclude_category,
+                            exclude_junk=args.exclude_junk)
+    prices_conn = sqlite3.connect("market-prices.db") if args.exclude_junk else None
+    if not use_cache:
+        return build_basket(sde_conn, prices_conn, args.popular, filters)
+    return get_basket(sde_conn, prices_conn, args.popular, filters)
+
+def load_basket(args, sde_conn: sqlite3.Connection, limit: Optional[int]) -> List[trade_lib.ItemSummary]:
+    """The basket for tools which take either --top-traded-items or the
+    add_basket_args options, limited to the top limit items (all if None)."""
+    if args.popular:
+        return basket_from_args(args, sde_conn)[:limit]
+    with open(args.top_traded_items, "rt") as tt_fh:
+        return list(trade_lib.get_most_traded_items(tt_fh, limit))
+
+def main():
+    logging.basicConfig(format='%(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    arg_parser = ArgumentParser(prog='top-market-items')
+    add_basket_args(arg_parser)
+    arg_parser.add_argument('--no_cache', action='store_true')
+    args = arg_parser.parse_args()
+
+    basket = basket_from_args(args, sqlite3.connect("sde.db"), use_cache=not args.no_cache)
+
+    log.info('Producing output...')
+    write_basket(sys.stdout, basket)
+    log.info('...done')
+
+if __name__ == "__main__":
+    main()
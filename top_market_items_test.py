@@ -0,0 +1,60 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import top_market_items as tmi
+
+def make_sde() -> sqlite3.Connection:
+    conn = sqlite3.connect(":memory:")
+    conn.executescript("""
+    CREATE TABLE Types(ID INT PRIMARY KEY NOT NULL, Name TEXT NOT NULL, GroupID INT NOT NULL, MarketGroupID INT, PortionSize INT);
+    CREATE TABLE Groups(ID INT PRIMARY KEY NOT NULL, Name TEXT NOT NULL, CategoryID INT NOT NULL);
+    CREATE TABLE Categories(ID INT PRIMARY KEY NOT NULL, Name TEXT NOT NULL);
+    CREATE TABLE MarketGroups(ID INT PRIMARY KEY NOT NULL, Path TEXT NOT NULL);
+    INSERT INTO Categories VALUES(8, 'Charge'), (6, 'Ship');
+    INSERT INTO Groups VALUES(85, 'Hybrid Charge', 8), (25, 'Frigate', 6);
+    INSERT INTO MarketGroups VALUES(1, 'Ammunition & Charges>Hybrid Charges'), (2, 'Ships>Frigates');
+    INSERT INTO Types VALUES(230, 'Antimatter Charge S', 85, 1, 100), (231, 'Void S', 85, 1, 100),
+        (587, 'Rifter', 25, 2, 1), (999, 'Unpublished Thing', 85, NULL, 1);
+    """)
+    return conn
+
+class TestBasket(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.sde = make_sde()
+        self.popular = []
+        for month, rows in enumerate([
+                [("Antimatter Charge S", "1.000.000", "10.000.000"), ("Void S", "10.000", "1.000.000"), ("Rifter", "100", "100.000.000"), ("Unpublished Thing", "1", "1")],
+                [("Antimatter Charge S", "2.000.000", "20.000.000"), ("Rifter", "200", "200.000.000")]]):
+            fname = os.path.join(self.dir.name, "popular-{}.csv".format(month))
+            with open(fname, "wt") as f:
+                f.write("Commodity,Number of trades,Traded items,Value of trades,x\n")
+                for name, num, value in rows:
+                    f.write('"{}",1,"{}","{}",L\n'.format(name, num, value))
+            self.popular.append(fname)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def testRanking(self):
+        basket = tmi.build_basket(self.sde, None, self.popular, tmi.BasketFilters())
+        self.assertEqual([i.ID for i in basket], [230, 587, 231])
+        self.assertEqual(basket[0].ValueTraded, 10000000)
+        self.assertEqual(basket[0].MarketGroup, "Ammunition & Charges>Hybrid Charges")
+
+    def testFilters(self):
+        basket = tmi.build_basket(self.sde, None, self.popular, tmi.BasketFilters(exclude_category=[6]))
+        self.assertEqual([i.ID for i in basket], [230, 231])
+
+    def testCached(self):
+        cache_dir = os.path.join(self.dir.name, "cache")
+        basket = tmi.get_basket(self.sde, None, self.popular, tmi.BasketFilters(), cache_dir=cache_dir)
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+        self.assertEqual(tmi.get_basket(self.sde, None, self.popular, tmi.BasketFilters(), cache_dir=cache_dir), basket)
+        tmi.get_basket(self.sde, None, self.popular, tmi.BasketFilters(exclude_category=[6]), cache_dir=cache_dir)
+        self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+
+unittest.main()
@@ -3,6 +3,8 @@ from functools import cache
 from typing import IO, Iterator, List, Optional
 import csv
 
+import market_paths
+
 ItemSummary = namedtuple('ItemSummary', ['ID', 'Name', 'GroupID', 'CategoryID', 'MarketGroup', 'ValueTraded'])
 OrderSizeRule = namedtuple('OrderSizeRule', ['Prefix', 'NormalMarketSize', 'MinOrderSize'])
 
@@ -34,10 +36,16 @@ def _get_min_order_rules() -> List[OrderSizeRule]:
                 raise RuntimeError("Failed to parse line {}: {}".format(row, e))
     return rules
 
-def get_order_size(i: ItemSummary) -> (int, int):
-    rules = _get_min_order_rules()
+@cache
+def _get_order_size_matcher() -> market_paths.MarketPathMatcher:
+    m = market_paths.MarketPathMatcher()
+    for r in _get_min_order_rules():
+        m.add_prefix(r.Prefix, r)
+    return m
+
+def get_order_size(i: ItemSummary) -> OrderSizeRule:
+    r = _get_order_size_matcher().first_match(i.MarketGroup)
+    if r is None:
+        raise RuntimeError("No rule matches {} ({})".format(i.Name, i.MarketGroup))
+    return r
 
-    for r in rules:
-        if i.MarketGroup.startswith(r.Prefix):
-            return r
-    raise RuntimeError("No rule matches {} ({})", i.Name, i.MarketGroup) 